@@ -6,4 +6,7 @@ setup(name='sirspy',
       author='Bernard J. Rauscher',
       author_email='Bernard.J.Rauscher@nasa.gov',
       packages=['sirspy'],
+      entry_points={'console_scripts':['sirspy-compact=sirspy.Weights:main',
+                                      'sirspy-correct=sirspy.Batch:main',
+                                      'sirspy-bench=sirspy.Benchmark:main']},
       zip_safe=False)
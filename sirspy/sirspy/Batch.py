@@ -0,0 +1,220 @@
+import os
+import sys
+import glob
+import time
+import argparse
+import traceback
+import multiprocessing
+import numpy as np
+from .SIRS import SIRS
+from .Stream import correct_file
+
+_sirs = None # The SIRS object of a worker process
+
+
+def expand_inputs(inputs, manifest=None):
+    """
+    expand_inputs(inputs, manifest=None)
+
+    List input files from paths, glob patterns and a manifest
+
+    Parameters: inputs, list of string
+                  Filenames or glob patterns. Patterns are expanded in sorted order.
+                manifest, string (optional)
+                  A text file listing one input per line. Blank lines and lines
+                  starting with # are ignored.
+    Returns:
+      * List of filenames without duplicates, in the order given
+    """
+    inputs = list(inputs)
+    if manifest is not None:
+        with open(manifest) as f:
+            inputs += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    files = []
+    for item in inputs:
+        matches = sorted(glob.glob(item)) if glob.has_magic(item) else [item]
+        if len(matches) == 0:
+            print('WARNING: nothing matches', item)
+        files += [file for file in matches if file not in files]
+    return(files)
+
+
+def output_name(in_file, odir):
+    """
+    output_name(in_file, odir)
+
+    Output filename for an input file. As in adapt_sirssub, the suffix
+    .fits becomes .sirs.fits. Other suffixes (e.g. .h5) are kept the same way.
+
+    Parameters: in_file, string
+                  Input filename
+                odir, string
+                  Output directory
+    """
+    base, suffix = os.path.splitext(os.path.basename(in_file))
+    return(os.path.join(odir, base + '.sirs' + suffix))
+
+
+def correct_files(sirs_file, files, odir, workers=None, overwrite=False, engine=None, precision='float64',
+                  refmask=None, sg_repair=False, verbose=True, **kwargs):
+    """
+    correct_files(sirs_file, files, odir, workers=None, overwrite=False, engine=None, precision='float64',
+                  refmask=None, sg_repair=False, verbose=True, **kwargs)
+
+    SIRS reference correct many FITS or HDF5 files using a pool of worker
+    processes. The weights are loaded once and shared with the workers (see
+    SIRS load='shm'). Each worker streams its file frame by frame, reading and
+    writing in background threads while it corrects. Outputs are renamed into
+    place only when they are complete, so after a crash, rerunning skips the
+    files that are finished. A file that fails is reported and left without an
+    output, and the other files are still corrected.
+
+    Parameters: sirs_file, string
+                  SIRS weights file
+                files, list of string
+                  Input files. See expand_inputs().
+                odir, string
+                  Output directory. See output_name().
+                workers, int (optional)
+                  Number of worker processes. The default is the number of CPUs.
+                  With 1, files are corrected in this process.
+                overwrite, Bool (optional)
+                  Correct files whose outputs already exist. Otherwise they are skipped.
+                engine, string (optional)
+                  Incomplete Fourier transform engine. See SIRS.
+                precision, string (optional)
+                  'float64' or 'float32'. See SIRS.
+                refmask, numpy.ndarray or string (optional)
+                  Bad reference pixel map, or a file holding it. See SIRS.set_refmask().
+                sg_repair, Bool (optional)
+                  Savitzky-Golay transient rejection of the reference columns
+                verbose, Bool (optional)
+                  Print per-file and aggregate throughput
+                kwargs
+                  Passed to Stream.correct_file(), e.g. adapt=True
+    Returns: list of dict
+      * One per file attempted, from correct_file(), plus file, out_file, worker (the
+        process ID) and error. error is None if the file was corrected. Otherwise it is
+        the error message, and the dict holds only file, out_file, worker, error and
+        traceback.
+    """
+    t0 = time.perf_counter()
+    os.makedirs(odir, exist_ok=True)
+
+    # Skip files that are already done, and remove temporary files left by
+    # a run that crashed
+    tasks = []
+    for file in files:
+        out_file = output_name(file, odir)
+        if os.path.exists(out_file) and (overwrite == False):
+            if verbose == True:
+                print('Skipping {} ({} exists)'.format(file, out_file))
+            continue
+        base, suffix = os.path.splitext(out_file)
+        for tmp in glob.glob(glob.escape(base) + '.*.tmp' + suffix):
+            os.remove(tmp)
+        tasks.append((file, out_file, kwargs))
+    if len(tasks) == 0:
+        return([])
+
+    # Correct
+    if workers is None:
+        workers = os.cpu_count()
+    workers = max(1, min(workers, len(tasks)))
+    sirs = SIRS(sirs_file, engine=engine, load='shm' if workers > 1 else 'memory', precision=precision,
+                refmask=refmask, sg_repair=sg_repair)
+    results = []
+    pool = None
+    try:
+        if workers == 1:
+            _init_worker(sirs)
+            _results = map(_correct, tasks)
+        else:
+            pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(sirs,))
+            _results = pool.imap_unordered(_correct, tasks)
+        for result in _results:
+            results.append(result)
+            if result['error'] is not None:
+                print('ERROR: {} failed: {}'.format(result['file'], result['error']), file=sys.stderr)
+                if verbose == True:
+                    print(result['traceback'], file=sys.stderr)
+            elif verbose == True:
+                print('{} -> {}: {} frames in {:.1f} s, {:.2f} frames/s, {:.1f} MB/s'.format(
+                      result['file'], result['out_file'], result['frames'], result['seconds'],
+                      result['frames']/result['seconds'], result['bytes_read']/result['seconds']/2**20))
+        if pool is not None:
+            pool.close()
+            pool.join()
+    finally:
+        if pool is not None:
+            pool.terminate()
+        sirs.close()
+
+    # Aggregate throughput
+    done = [result for result in results if result['error'] is None]
+    if verbose == True:
+        seconds = time.perf_counter() - t0
+        frames = sum([result['frames'] for result in done])
+        nbytes = sum([result['bytes_read'] for result in done])
+        print('Corrected {} files, {} frames in {:.1f} s using {} workers: {:.2f} frames/s, {:.1f} MB/s'.format(
+              len(done), frames, seconds, workers, frames/seconds, nbytes/seconds/2**20))
+    if len(done) < len(results):
+        print('ERROR: {} of {} files failed'.format(len(results)-len(done), len(results)), file=sys.stderr)
+    return(results)
+
+
+def _init_worker(sirs):
+    # Keep the shared SIRS object for _correct()
+    global _sirs
+    _sirs = sirs
+
+
+def _correct(task):
+    # Correct one file in a worker process. Errors are returned, not raised,
+    # so that one bad file does not stop the pool.
+    file, out_file, kwargs = task
+    result = {'error':None}
+    try:
+        result.update(correct_file(_sirs, file, out_file, overlap=True, **kwargs))
+    except Exception as e:
+        result = {'error':'{}: {}'.format(type(e).__name__, e), 'traceback':traceback.format_exc()}
+    result.update({'file':file, 'out_file':out_file, 'worker':os.getpid()})
+    return(result)
+
+
+def main():
+    """
+    Console entry point, sirspy-correct. SIRS reference correct files
+    in parallel. This is the sirspy counterpart of adapt_sirssub. Exit
+    with status 1 if any file failed.
+    """
+    parser = argparse.ArgumentParser(description='SIRS reference correct FITS or HDF5 files in parallel')
+    parser.add_argument('sirs_file', help='SIRS weights file (.h5)')
+    parser.add_argument('inputs', nargs='*', help='Input files or glob patterns')
+    parser.add_argument('-o', '--odir', required=True, help='Output directory')
+    parser.add_argument('-m', '--manifest', help='Text file listing more inputs, one per line')
+    parser.add_argument('-j', '--workers', type=int, help='Number of worker processes (default: CPUs)')
+    parser.add_argument('--adapt', action='store_true',
+                        help='adapt_sirssub convention: flip the sign of the input and write UInt16 '
+                             'offset by SIRSBIAS')
+    parser.add_argument('--rowsonly', action='store_true', help='Reference rows only correction')
+    parser.add_argument('--pplfix1', action='store_true', help='Interpolate over the JPL PPL bad reference pixels')
+    parser.add_argument('--refmask', help='Bad reference pixel map (FITS, .npy or HDF5); bad pixels are nonzero')
+    parser.add_argument('--sg-repair', action='store_true',
+                        help='Savitzky-Golay transient rejection of the reference columns')
+    parser.add_argument('--dtype', default='float32', choices=['float32','float64'],
+                        help='Output dtype without --adapt')
+    parser.add_argument('--engine', choices=['dense','fft'], help='Incomplete Fourier transform engine')
+    parser.add_argument('--precision', default='float64', choices=['float64','float32'],
+                        help='Arithmetic precision of the correction')
+    parser.add_argument('--overwrite', action='store_true', help='Redo files whose outputs exist')
+    args = parser.parse_args()
+    files = expand_inputs(args.inputs, manifest=args.manifest)
+    if len(files) == 0:
+        parser.error('no input files')
+    results = correct_files(args.sirs_file, files, args.odir, workers=args.workers, overwrite=args.overwrite,
+                            engine=args.engine, precision=args.precision, refmask=args.refmask,
+                            sg_repair=args.sg_repair, adapt=args.adapt, rowsonly=args.rowsonly,
+                            pplfix1=args.pplfix1, dtype=np.dtype(args.dtype))
+    if any(result['error'] is not None for result in results):
+        sys.exit(1)
@@ -0,0 +1,288 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import h5py
+import numpy as np
+from .SIRS import SIRS
+from .Legendre import Legendre
+from .Shared import process_memory
+from .Synthetic import geometry, synthetic_ramp, synthetic_weights
+from .Weights import operator, write_weights
+
+CASES = ('init', 'init_dense', 'incomplete_ft', 'refcor', 'refcor_rowsonly', 'legfit') # What benchmark() times
+
+
+def benchmark(kinds=('h1rg','h2rg'), nframes=(4,16), engine=None, precision='float64', repeat=3,
+              cases=CASES, workdir=None, out=None):
+    """
+    benchmark(kinds=('h1rg','h2rg'), nframes=(4,16), engine=None, precision='float64', repeat=3,
+              cases=CASES, workdir=None, out=None)
+
+    Time and memory profile sirspy hot paths on synthetic data
+
+    For each detector kind, a matching synthetic weights file and a synthetic
+    ramp are made (see Synthetic.py). Then, for each number of frames, every case
+    is run repeat times:
+      * init: SIRS.__init__() from the compact (version 2) weights file, which
+        regenerates the operator for the engine. With the default fft engine,
+        this is cheap.
+      * init_dense: SIRS.__init__() with engine='dense' from a version 1 weights
+        file, which reads the stored dense operator. Its engine is 'dense'
+        whatever engine is.
+      * incomplete_ft: SIRS.incomplete_ft() of each frame's left reference columns
+      * refcor: SIRS.refcor()
+      * refcor_rowsonly: SIRS.refcor(rowsonly=True)
+      * legfit: Legendre(nframes, 1).legfit()
+    Making the inputs is not timed. Before timing, the weights are checked: SIRS
+    must reduce the CDS noise of the ramp, or a RuntimeError is raised, since
+    timing a correction that does not work would mean little.
+
+    Parameters: kinds, list of string (optional)
+                  Detector kinds. See Synthetic.geometry(). An H4RG needs several GB.
+                nframes, list of int (optional)
+                  Numbers of frames
+                engine, precision (optional)
+                  See SIRS
+                repeat, int (optional)
+                  Number of times to run each case. The fastest run is reported.
+                cases, list of string (optional)
+                  Cases to run, from CASES
+                workdir, string (optional)
+                  Where to put the weights files. The default is a temporary directory.
+                out, file (optional)
+                  Also write each result to out as a line of JSON as soon as it is ready
+    Returns: list of dict, one per case and number of frames
+      * case, hxrg_kind, naxis1, naxis2, nout, nroh, nframes, engine, precision: What was run
+      * seconds: Fastest time
+      * seconds_all: All times
+      * rate, unit: Throughput of the fastest run
+      * peak_alloc: Peak bytes of memory allocated by the case (from tracemalloc, in a
+        separate untimed run). NumPy arrays are included.
+      * peak_rss: Peak resident memory of the process during that run, in bytes. This
+        needs Linux, where the peak can be reset. Elsewhere it is None.
+      * noise_raw, noise_sirs: CDS noise of the ramp's regular pixels in DN, before and
+        after SIRS correction
+      * sirspy, numpy, python, machine, cpus, time: Where and when it ran
+    """
+    for case in cases:
+        if case not in CASES:
+            raise ValueError('unknown case ' + case)
+    tmp = None
+    if workdir is None:
+        tmp = tempfile.TemporaryDirectory()
+        workdir = tmp.name
+    env = _environment()
+    results = []
+    try:
+        for kind in kinds:
+            g = geometry(kind)
+            weights = os.path.join(workdir, 'synthetic_{}.h5'.format(kind))
+            synthetic_weights(weights, kind, nframes=4, seed=1)
+            D = synthetic_ramp(max(nframes), kind, seed=2, dtype=precision)
+            if 'init_dense' in cases:
+                weights_v1 = os.path.join(workdir, 'synthetic_{}_v1.h5'.format(kind))
+                _write_v1(weights, weights_v1)
+            sirs = SIRS(weights, engine=engine, precision=precision)
+            noise = _check_noise(sirs, D)
+            for nz in nframes:
+                runs = {'init':(lambda: None, lambda a: SIRS(weights, engine=engine, precision=precision).close(),
+                                1, 'files/s'),
+                        'init_dense':(lambda: None, lambda a: SIRS(weights_v1, engine='dense',
+                                                                   precision=precision).close(), 1, 'files/s'),
+                        'incomplete_ft':(lambda: D[:nz,:,:SIRS.RB].reshape(nz,-1),
+                                         lambda a: [sirs.incomplete_ft(d) for d in a], nz, 'transforms/s'),
+                        'refcor':(lambda: D[:nz].copy(), lambda a: sirs.refcor(a), nz, 'frames/s'),
+                        'refcor_rowsonly':(lambda: D[:nz].copy(), lambda a: sirs.refcor(a, rowsonly=True),
+                                           nz, 'frames/s'),
+                        'legfit':(lambda: None, lambda a: Legendre(nz, 1).legfit(D[:nz]), nz, 'frames/s')}
+                for case in cases:
+                    setup, run, n, unit = runs[case]
+                    seconds, peak_alloc, peak_rss = _measure(setup, run, repeat)
+                    result = {'case':case, 'hxrg_kind':kind, 'naxis1':g['naxis1'], 'naxis2':g['naxis2'],
+                              'nout':g['nout'], 'nroh':g['nroh'], 'nframes':int(nz),
+                              'engine':'dense' if case == 'init_dense' else sirs.engine,
+                              'precision':str(precision), 'seconds':min(seconds), 'seconds_all':seconds,
+                              'rate':n/min(seconds), 'unit':unit, 'peak_alloc':peak_alloc,
+                              'peak_rss':peak_rss, 'noise_raw':noise[0], 'noise_sirs':noise[1]}
+                    result.update(env)
+                    results.append(result)
+                    if out is not None:
+                        out.write(json.dumps(result) + '\n')
+                        out.flush()
+            sirs.close()
+            del D
+    finally:
+        if tmp is not None:
+            tmp.cleanup()
+    return(results)
+
+
+def compare_benchmarks(results, baseline, tolerance=.2):
+    """
+    compare_benchmarks(results, baseline, tolerance=.2)
+
+    Find regressions relative to earlier benchmark() results. Results are
+    matched on case, hxrg_kind, nout, nroh, nframes, engine and precision.
+
+    Parameters: results, baseline, list of dict
+                  From benchmark() or read_benchmarks()
+                tolerance, float (optional)
+                  Allowed fractional loss of throughput or growth of peak_rss
+    Returns: list of dict, one per regression
+      * The result, plus what regressed ('rate', 'peak_alloc' or 'peak_rss') and its
+        baseline value
+    """
+    base = {_key(b):b for b in baseline}
+    regressions = []
+    for r in results:
+        b = base.get(_key(r))
+        if b is None:
+            continue
+        if r['rate'] < (1-tolerance)*b['rate']:
+            regressions.append(dict(r, what='rate', baseline=b['rate']))
+        for what in ('peak_alloc', 'peak_rss'):
+            if (r.get(what) is not None) and (b.get(what) is not None) and\
+               (r[what] > (1+tolerance)*b[what] + 2**20): # Ignore growth under 1 MB
+                regressions.append(dict(r, what=what, baseline=b[what]))
+    return(regressions)
+
+
+def read_benchmarks(file):
+    """
+    read_benchmarks(file)
+
+    Read benchmark() results written as lines of JSON
+
+    Parameters: file, string
+                  Filename
+    """
+    with open(file) as f:
+        return([json.loads(line) for line in f if line.strip()])
+
+
+def _key(result):
+    # What a benchmark result measures
+    return(tuple(result[k] for k in ('case', 'hxrg_kind', 'nout', 'nroh', 'nframes', 'engine', 'precision')))
+
+
+def _measure(setup, run, repeat):
+    """
+    Run run(setup()) repeat times
+
+    Returns:
+      * List of seconds for each run
+      * Peak bytes allocated by run()
+      * Peak resident memory during run(), in bytes. None if the peak cannot be
+        reset (not Linux).
+    """
+    seconds = []
+    for i in np.arange(repeat):
+        a = setup()
+        t0 = time.perf_counter()
+        run(a)
+        seconds.append(time.perf_counter() - t0)
+        del a
+
+    # Memory, in another run so that tracing does not slow the timed runs
+    a = setup()
+    ok = _reset_peak()
+    tracemalloc.start()
+    try:
+        run(a)
+        peak_alloc = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    peak_rss = process_memory()['rss_peak'] if ok == True else None
+    return(seconds, peak_alloc, peak_rss)
+
+
+def _check_noise(sirs, D):
+    """
+    CDS noise of the regular pixels of D before and after SIRS correction.
+    Raise RuntimeError if the correction does not reduce it.
+    """
+    nz = 2*(D.shape[0]//2)
+    if nz == 0:
+        return(None, None)
+    rb = SIRS.RB
+    raw = D[:nz].copy()
+    corrected = D[:nz].copy()
+    sirs.refcor(corrected)
+    noise = tuple(float(np.std((a[1::2]-a[0::2])[:,rb:-rb,rb:-rb], dtype=np.float64)) for a in (raw, corrected))
+    if noise[1] >= noise[0]:
+        raise RuntimeError('SIRS correction raised the CDS noise from {:.3f} to {:.3f} DN'.format(*noise))
+    return(noise)
+
+
+def _write_v1(in_file, out_file):
+    # Version 1 copy of a compact weights file, holding the dense operator
+    with h5py.File(in_file, 'r') as f:
+        g = f['SIRSCore']
+        naxis1, naxis2, nout, nroh, xsize, ysize = [int(np.int64(g[key])) for key in
+                                                    ('naxis1','naxis2','nout','nroh','xsize','ysize')]
+        write_weights(out_file, naxis1, naxis2, nout, nroh, xsize, ysize, g['freq'][...],
+                      np.transpose(g['α'][...]), np.transpose(g['β'][...]),
+                      incft=operator(ysize, xsize, nroh, rb=SIRS.RB))
+
+
+def _reset_peak():
+    # Reset this process's peak resident memory (Linux only)
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return('rss_peak' in process_memory())
+    except OSError:
+        return(False)
+
+
+def _environment():
+    # Where and when benchmarks run
+    try:
+        from importlib.metadata import version
+        sirspy_version = version('sirspy')
+    except Exception:
+        sirspy_version = None
+    return({'sirspy':sirspy_version, 'numpy':np.__version__, 'python':platform.python_version(),
+            'machine':platform.machine(), 'cpus':os.cpu_count(),
+            'time':time.strftime('%Y-%m-%dT%H:%M:%S%z')})
+
+
+def main():
+    """
+    Console entry point, sirspy-bench. Benchmark sirspy on synthetic data
+    and write the results as lines of JSON. With --baseline, exit with
+    status 1 if throughput or peak memory regressed.
+    """
+    parser = argparse.ArgumentParser(description='Benchmark sirspy on synthetic data')
+    parser.add_argument('-k', '--kinds', nargs='+', default=['h1rg','h2rg'], choices=['h1rg','h2rg','h4rg'],
+                        help='Detector kinds')
+    parser.add_argument('-n', '--nframes', nargs='+', type=int, default=[4,16], help='Numbers of frames')
+    parser.add_argument('-c', '--cases', nargs='+', default=list(CASES), choices=CASES, help='Cases to run')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Runs of each case')
+    parser.add_argument('--engine', choices=['dense','fft'], help='Incomplete Fourier transform engine')
+    parser.add_argument('--precision', default='float64', choices=['float64','float32'], help='Precision')
+    parser.add_argument('-o', '--output', help='Output file (default: standard output)')
+    parser.add_argument('--baseline', help='Earlier output to compare against')
+    parser.add_argument('--tolerance', type=float, default=.2,
+                        help='Allowed fractional loss of throughput or growth of peak memory')
+    args = parser.parse_args()
+    out = sys.stdout if args.output is None else open(args.output, 'w')
+    try:
+        results = benchmark(args.kinds, args.nframes, engine=args.engine, precision=args.precision,
+                            repeat=args.repeat, cases=args.cases, out=out)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    if args.baseline is not None:
+        regressions = compare_benchmarks(results, read_benchmarks(args.baseline), tolerance=args.tolerance)
+        for r in regressions:
+            print('REGRESSION: {} {} nframes={}: {} {} (baseline {})'.format(
+                  r['case'], r['hxrg_kind'], r['nframes'], r['what'], r[r['what']], r['baseline']),
+                  file=sys.stderr)
+        if len(regressions) > 0:
+            sys.exit(1)
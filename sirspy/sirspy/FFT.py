@@ -0,0 +1,259 @@
+import threading
+import numpy as np
+import scipy.fft
+
+# FFT backends. SIRS, SIRSCore and IncompleteFT do all of their FFTs
+# through one of these:
+#
+#   'numpy' (default): numpy.fft
+#   'scipy': scipy.fft, which can split batched transforms over workers threads
+#   'fftw': planned FFTW through pyFFTW, if it is installed. Plans are made with
+#     FFTW_MEASURE, so making one takes a while, and it is much faster after.
+#
+# Every backend keeps a plan cache keyed by (kind, n, input dtype, batch
+# shape, axis). plan() fills it ahead of time. For numpy and scipy, which
+# plan internally, this runs one transform to warm their twiddle factor caches.
+# FFTW plans are kept per thread, hold at most a few transforms each, and are
+# limited in number. See FFTWBackend.
+# Single precision inputs give single precision outputs with every backend.
+# numpy and fftw transform directly into out=. scipy cannot, so it makes
+# a new result for every transform and copies it into out (inplace = False).
+
+
+def get_backend(backend=None, workers=None):
+    """
+    get_backend(backend=None, workers=None)
+
+    Get an FFT backend
+
+    Parameters: backend, string or FFTBackend (optional)
+                  Selected from {'numpy','scipy','fftw'}, or an FFTBackend, which is
+                  returned as is. The default is 'numpy'.
+                workers, int (optional)
+                  Number of threads for each transform. Used by 'scipy' and 'fftw'.
+    """
+    if isinstance(backend, FFTBackend):
+        return(backend)
+    if (backend is None) or (backend == 'numpy'):
+        return(NumpyFFT())
+    if backend == 'scipy':
+        return(ScipyFFT(workers=workers))
+    if backend == 'fftw':
+        return(FFTWBackend(workers=workers))
+    raise ValueError("FFT backend must be 'numpy', 'scipy' or 'fftw'")
+
+
+class FFTBackend():
+    """
+    Base class for FFT backends. Subclasses implement _fft(), _rfft() and _irfft().
+    """
+    name = None
+    inplace = True # Transforms into out= without allocating the result
+
+    def __init__(self, workers=None):
+        self.workers = workers
+        self.plans = {} # Plan cache
+
+    def plan(self, kind, n, dtype, batch=(), axis=-1):
+        """
+        Plan a transform ahead of time
+
+        Parameters: kind, string
+                      Selected from {'fft','rfft','irfft'}
+                    n, int
+                      Transform length. For irfft, this is the length of the output.
+                    dtype, numpy.dtype
+                      Input dtype
+                    batch, tuple (optional)
+                      Shape of the other axes, in order, without the transform axis
+                    axis, int (optional)
+                      Transform axis
+        """
+        key = (kind, int(n), np.dtype(dtype), tuple(batch), axis)
+        if key not in self.plans:
+            self.plans[key] = self._plan(*key)
+        return(self.plans[key])
+
+    def _plan(self, kind, n, dtype, batch, axis):
+        # Run one transform so that the library caches what it needs
+        m = n//2+1 if kind == 'irfft' else n
+        shape = list(batch)
+        shape.insert(axis if axis >= 0 else len(shape)+axis+1, m)
+        getattr(self, kind)(np.zeros(shape, dtype=dtype), n=n, axis=axis)
+        return(True)
+
+    def fft(self, a, n=None, axis=-1, out=None):
+        """
+        Complex FFT of a along axis, like numpy.fft.fft(a, n, axis, out=out)
+        """
+        return(self._fft(a, a.shape[axis] if n is None else n, axis, out))
+
+    def rfft(self, a, n=None, axis=-1, out=None):
+        """
+        Real FFT of a along axis, like numpy.fft.rfft(a, n, axis, out=out)
+        """
+        return(self._rfft(a, a.shape[axis] if n is None else n, axis, out))
+
+    def irfft(self, a, n=None, axis=-1, out=None):
+        """
+        Inverse real FFT of a along axis, like numpy.fft.irfft(a, n, axis, out=out)
+        """
+        return(self._irfft(a, 2*(a.shape[axis]-1) if n is None else n, axis, out))
+
+    def __repr__(self):
+        return('{}(workers={})'.format(type(self).__name__, self.workers))
+
+
+class NumpyFFT(FFTBackend):
+    """
+    numpy.fft. It is single threaded, and it does not take workers.
+    """
+    name = 'numpy'
+
+    def _fft(self, a, n, axis, out):
+        return(np.fft.fft(a, n=n, axis=axis, out=out))
+
+    def _rfft(self, a, n, axis, out):
+        return(np.fft.rfft(a, n=n, axis=axis, out=out))
+
+    def _irfft(self, a, n, axis, out):
+        return(np.fft.irfft(a, n=n, axis=axis, out=out))
+
+
+class ScipyFFT(FFTBackend):
+    """
+    scipy.fft. Batched transforms are split over workers threads. scipy.fft
+    does not take out=, so every transform allocates its result, and
+    SIRS.refcor_frame() is not allocation free with this backend.
+    """
+    name = 'scipy'
+    inplace = False
+
+    def _call(self, f, a, n, axis, out):
+        result = f(a, n=n, axis=axis, workers=self.workers)
+        if out is None:
+            return(result)
+        out[...] = result
+        return(out)
+
+    def _fft(self, a, n, axis, out):
+        return(self._call(scipy.fft.fft, a, n, axis, out))
+
+    def _rfft(self, a, n, axis, out):
+        return(self._call(scipy.fft.rfft, a, n, axis, out))
+
+    def _irfft(self, a, n, axis, out):
+        return(self._call(scipy.fft.irfft, a, n, axis, out))
+
+
+class FFTWBackend(FFTBackend):
+    """
+    Planned FFTW through pyFFTW. Each plan owns aligned input and output
+    arrays, so each thread gets its own plans. Plans are made the first time
+    a transform is used in a thread, or ahead of time by plan().
+
+    A plan does at most batch transforms of one length at once. Longer
+    batches are done in chunks, so a plan's arrays stay small however many
+    frames refcor(batch=True) or SIRSCore.coadd() transform together. Each
+    thread keeps at most max_plans plans, dropping the least recently used.
+
+    Parameters: workers, int (optional)
+                  Number of FFTW threads for each transform
+                effort, string (optional)
+                  FFTW planner effort
+                batch, int (optional)
+                  Maximum number of transforms per plan
+                max_plans, int (optional)
+                  Maximum number of plans kept by each thread
+    """
+    name = 'fftw'
+
+    def __init__(self, workers=None, effort='FFTW_MEASURE', batch=8, max_plans=8):
+        import pyfftw # Fail here, not at the first transform, if it is missing
+        self.effort = effort
+        self.batch = int(batch)
+        self.max_plans = int(max_plans)
+        super().__init__(workers)
+        self._local = threading.local() # Per thread plan caches, used instead of self.plans
+
+    def __getstate__(self):
+        # FFTW plans cannot be pickled. They are remade where needed.
+        state = self.__dict__.copy()
+        del state['_local']
+        return(state)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def _plan(self, kind, n, dtype, rows):
+        # Plan rows transforms along the last axis
+        import pyfftw
+        shapes = {'fft':(n, n), 'rfft':(n, n//2+1), 'irfft':(n//2+1, n)}[kind]
+        dtypes = _dtypes(kind, dtype)
+        arrays = [pyfftw.empty_aligned((rows,m), dtype=dt) for m, dt in zip(shapes, dtypes)]
+        direction = 'FFTW_BACKWARD' if kind == 'irfft' else 'FFTW_FORWARD'
+        return(pyfftw.FFTW(arrays[0], arrays[1], axes=(-1,), direction=direction,
+                           flags=(self.effort,), threads=self.workers or 1))
+
+    def plan(self, kind, n, dtype, batch=(), axis=-1):
+        rows = int(min(np.prod(batch, dtype=np.int64), self.batch))
+        key = (kind, int(n), np.dtype(dtype), max(rows, 1))
+        plans = self._plans()
+        plan = plans.pop(key, None) # Reinserted as the most recently used
+        if plan is None:
+            while len(plans) >= self.max_plans:
+                del plans[next(iter(plans))]
+            plan = self._plan(*key)
+        plans[key] = plan
+        return(plan)
+
+    def _plans(self):
+        # Plan cache of this thread, least recently used first
+        if not hasattr(self._local, 'plans'):
+            self._local.plans = {}
+        return(self._local.plans)
+
+    def _execute(self, kind, a, n, axis, out):
+        # Transform chunks of rows, copying into each plan's input array so the
+        # input is never overwritten
+        axis = axis % a.ndim
+        shape = list(a.shape)
+        shape[axis] = n//2+1 if kind == 'rfft' else n
+        if out is None:
+            out = np.empty(shape, dtype=_dtypes(kind, a.dtype)[1])
+        src = np.moveaxis(a, axis, -1)
+        src = src.reshape(-1, src.shape[-1])
+        dst = np.moveaxis(out, axis, -1)
+        rows = dst.reshape(-1, dst.shape[-1]) # A copy if out cannot be viewed this way
+        for r0 in np.arange(0, len(src), self.batch):
+            r1 = min(r0+self.batch, len(src))
+            plan = self.plan(kind, n, a.dtype, batch=(r1-r0,))
+            plan.input_array[...] = src[r0:r1]
+            plan()
+            rows[r0:r1] = plan.output_array
+        if not np.shares_memory(rows, out):
+            dst[...] = rows.reshape(dst.shape)
+        return(out)
+
+    def _fft(self, a, n, axis, out):
+        if n != a.shape[axis]:
+            raise ValueError('The fftw backend does not pad or truncate')
+        return(self._execute('fft', np.asarray(a, dtype=np.result_type(a, np.complex64)), n, axis, out))
+
+    def _rfft(self, a, n, axis, out):
+        if n != a.shape[axis]:
+            raise ValueError('The fftw backend does not pad or truncate')
+        return(self._execute('rfft', a, n, axis, out))
+
+    def _irfft(self, a, n, axis, out):
+        return(self._execute('irfft', a, n, axis, out))
+
+
+def _dtypes(kind, dtype):
+    # Input and output dtypes of an FFTW transform of a dtype input
+    dtype = np.dtype(dtype)
+    if kind == 'irfft':
+        return(dtype, dtype.type(0).real.dtype)
+    cdtype = np.result_type(dtype, np.complex64)
+    return((dtype if kind == 'rfft' else cdtype), cdtype)
@@ -0,0 +1,154 @@
+import copy
+import numpy as np
+
+
+def sirs_freq_index(ysize, nstep):
+    """
+    sirs_freq_index(ysize, nstep)
+
+    Indices into the full rfft of one output's time series of the
+    frequencies that SIRS keeps. These are the ysize//2+1 lowest
+    frequencies and the ysize//2 frequencies just below Nyquist.
+    This is the k_ref vector in SIRSCore.jl, but 0-based.
+
+    Parameters: ysize, int
+                  Number of rows per output
+                nstep, int
+                  Number of time steps per output per frame
+    """
+    return(np.concatenate((np.arange(ysize//2+1),
+                           np.arange(nstep//2-ysize//2+1, nstep//2+1))))
+
+
+class IncompleteFT():
+    """
+    Fast incomplete Fourier transform of a reference column stream.
+    See Documentation/derivation_of_incomplete_ft.ipynb.
+
+    Reference pixels are sampled at rb consecutive time steps out of every
+    xsize+nroh. Because the number of time steps per output is an integer
+    multiple of this row period, the Gram matrix of the incomplete Fourier
+    basis only couples frequencies that alias onto the same bin of a
+    ysize-point DFT. The Moore-Penrose inverse therefore factors into rb
+    ysize-point FFTs followed by a fixed linear combination of the rb
+    columns for each frequency. The result is the same as multiplying by
+    the dense incft matrix in a weights file, but it costs O(n log n)
+    and needs almost no memory.
+
+    Parameters: ysize, int
+                  Number of rows per output
+                xsize, int
+                  Number of columns per output
+                nroh, int
+                  New row overhead in pixels
+                k, numpy.ndarray (optional)
+                  0-based rfft indices of the frequencies to compute.
+                  Defaults to sirs_freq_index(ysize, nstep).
+                rb, int (optional)
+                  Reference column border width
+    """
+    def __init__(self, ysize, xsize, nroh, k=None, rb=4):
+
+        # Pick off arguments
+        self.ysize = int(ysize)
+        self.xsize = int(xsize)
+        self.nroh  = int(nroh)
+        self.rb    = int(rb)
+        self.nstep = (self.xsize+self.nroh)*self.ysize # Time steps per output
+        if k is None:
+            k = sirs_freq_index(self.ysize, self.nstep)
+        self.k = np.asarray(k, dtype=np.int64)
+
+        # Every reference pixel is at time step j = row*(xsize+nroh) + c,
+        # c ∊ {0,1,...rb-1}. For frequency k, the basis vector is then a
+        # ysize-point DFT at bin k mod ysize times a phase that depends only on c.
+        self.q = np.mod(self.k, self.ysize) # DFT bin that each k aliases onto
+        c = np.arange(self.rb)
+        Bc = np.exp(2j*np.pi*np.outer(self.k, c)/self.nstep)/self.nstep # (nk, rb)
+
+        # Gram matrix, G = B^H B. It is block diagonal with blocks formed by
+        # frequencies sharing a DFT bin. Invert it block by block. Then fold the
+        # inverse into per-frequency column weights so that
+        # pinv(B) d = Σ_c C[k,c] FFT(d[:,c])[q[k]].
+        self.C = np.zeros((len(self.k), self.rb), dtype=np.complex128)
+        for q in np.unique(self.q):
+            g = np.flatnonzero(self.q == q) # Frequencies in this block
+            G = self.ysize * np.matmul(np.conj(Bc[g]), Bc[g].T)
+            self.C[g] = np.matmul(np.linalg.pinv(G), np.conj(Bc[g]))
+
+    @property
+    def nbytes(self):
+        """
+        Bytes held by this operator
+        """
+        return(self.C.nbytes + self.q.nbytes + self.k.nbytes)
+
+    def subset(self, sel):
+        """
+        A new IncompleteFT that computes only some of the frequencies. Its
+        result equals the selected rows of this one's. This is the same as
+        dropping rows of the dense incft matrix.
+
+        Parameters: sel, slice or numpy.ndarray
+                      Selects entries of k
+        """
+        ift = copy.copy(self)
+        ift.k = self.k[sel]
+        ift.q = self.q[sel]
+        ift.C = self.C[sel]
+        return(ift)
+
+    def astype(self, dtype):
+        """
+        This operator, computing in complex dtype. It is returned as is if it
+        already does. Otherwise, a copy is made.
+
+        Parameters: dtype, numpy.dtype
+                      np.complex128 (the default) or np.complex64
+        """
+        if self.C.dtype == dtype:
+            return(self)
+        ift = copy.copy(self)
+        ift.C = self.C.astype(dtype)
+        return(ift)
+
+    def transform(self, d, out=None, work=None, backend=None):
+        """
+        Incomplete Fourier transform
+
+        Parameters: d, numpy.ndarray
+                      Reference pixels in time order. The last axis holds
+                      ysize*rb samples, i.e. one frame of reference columns
+                      flattened in row major order. Leading axes are batched.
+                    out, numpy.ndarray (optional)
+                      Complex array in which to put the result
+                    work, tuple (optional)
+                      Preallocated complex buffers (X, g) having shapes
+                      d.shape[:-1]+(ysize,rb) and d.shape[:-1]+(len(k),rb). With
+                      these, a complex d and out, nothing is allocated. Complex
+                      means complex128, or complex64 after astype(np.complex64).
+                    backend, FFT.FFTBackend (optional)
+                      FFT backend. The default is numpy.fft.
+        Returns:
+          * Complex array having the leading axes of d and one
+            entry per frequency in k along the last axis.
+        """
+        d = np.asarray(d, dtype=self.C.dtype) # Transform in the precision of C
+        d = d.reshape(d.shape[:-1]+(self.ysize,self.rb))
+        fft = np.fft.fft if backend is None else backend.fft
+        if work is None:
+            X = fft(d, axis=-2)
+            return(np.einsum('...kc,kc->...k', X[...,self.q,:], self.C, out=out))
+        X, g = work
+        fft(d, axis=-2, out=X)
+        np.take(X, self.q, axis=-2, out=g)
+        return(np.einsum('...kc,kc->...k', g, self.C, out=out))
+
+    def matrix(self):
+        """
+        Build the equivalent dense operator. This is the incft matrix
+        that a version 1 weights file stores.
+        """
+        r = np.arange(self.ysize)
+        M = np.exp(-2j*np.pi*np.outer(self.q, r)/self.ysize)
+        return((M[:,:,np.newaxis]*self.C[:,np.newaxis,:]).reshape(len(self.k), -1))
@@ -1,49 +1,173 @@
+import threading
 import numpy as np
+from .Threads import thread_pool, wait
+from .Profiler import call, stage
+
+TILE = 16384 # Default pixels per tile. 100 float64 samples of a tile are about 13 MB.
+
+_bases = {}                # Basis matrices for each (nsamp, degree)
+_lock  = threading.Lock()  # Protects _bases
+
+
+def basis(nsamp, degree):
+    """
+    basis(nsamp, degree)
+
+    Legendre basis matrices for nsamp samples and a fit of degree. These are
+    computed once per (nsamp, degree) and cached, so ramps having the same
+    shape share them. They are read-only.
+
+    Parameters: nsamp, int
+                  Number of equally spaced samples or groups up-the-ramp
+                degree, int
+                  Degree of Legendre polynomial fit
+    Returns: tuple
+      * x: Sample positions
+      * B: (nsamp, degree+1) basis matrix
+      * pinvB: Its Moore-Penrose inverse, which does the fitting
+      * B_x_pinvB: The matrix that does the modeling
+    """
+    key = (int(nsamp), int(degree))
+    with _lock:
+        if key not in _bases:
+            nsamp, degree = key
+
+            # Build the Legendre basis matrix. In doing so, we allow
+            # for the very first sample to be a "virtual" sample taken
+            # immediately after reset. Although the Legendre polynomials
+            # are defined over the interval x ∈ [-1,+1], our basis vectors
+            # always have x > -1.
+            x = (2*np.arange(nsamp+1)/nsamp-1)[1:]
+            B = np.empty((nsamp,degree+1), dtype=np.float64) # Empty basis matrix
+            p = np.zeros((degree+1), dtype=np.int64) # Used to pick out Legendre polynomials
+            p[0] = 1 # Initialize it
+            for col in np.arange(degree+1):
+                B[:,col] = np.polynomial.legendre.legval(x,np.roll(p, col))
+            pinvB = np.linalg.pinv(B)
+            B_x_pinvB = np.matmul(B, pinvB)
+            for a in (x, B, pinvB, B_x_pinvB):
+                a.flags.writeable = False
+            _bases[key] = (x, B, pinvB, B_x_pinvB)
+        return(_bases[key])
+
 
 class Legendre():
     """
     Base Class for up-the-ramp Legendre fitting and modeling
-    
+
+    legfit(), legval() and residual() work on tiles of pixels. Each tile is
+    one BLAS matrix-matrix product, and tiles can be done in parallel threads.
+    Inputs can be memory-mapped. Only one tile at a time per thread is read
+    into memory, and results can go into a preallocated (or memory-mapped)
+    out= array.
+
     Parameters: nsamp, int
                   Number of equally spaced samples or groups up-the-ramp
                 degree, int
                   Degree of Legendre polynomial fit
+                profiler, Profiler (optional)
+                  Profile each call, with one 'matmul' stage per tile. See Profiler.py.
     """
-    def __init__(self, nsamp, degree):
-        
+    def __init__(self, nsamp, degree, profiler=None):
+
         # Pick off arguments
         self.nsamp = nsamp   # Number of up-the-ramp samples
         self.degree = degree # Fit degree
-        
-        # Build the Legendre basis matrix. In doing so, we allow
-        # for the very first sample to be a "virtual" sample taken
-        # immediately after reset. Although the Legendre polynomials
-        # are defined over the interval x ∈ [-1,+1], our basis vectors
-        # always have x > -1.
-        self.x = (2*np.arange(nsamp+1)/nsamp-1)[1:]
-        self.B = np.empty((nsamp,degree+1), dtype=np.float) # Empty basis matrix
-        p = np.zeros((degree+1), dtype=np.int) # Used to pick out Legendre polynomials
-        p[0] = 1 # Initialize it
-        for col in np.arange(degree+1):
-            self.B[:,col] = np.polynomial.legendre.legval(self.x,np.roll(p, col))
-        
-        # Compute its Moore-Penrose inverse, which does the fitting
-        self.pinvB = np.linalg.pinv(self.B)
-        
-        # Compute the matrix that does the modeling
-        self.B_x_pinvB = np.matmul(self.B, self.pinvB)
-        
-    def legfit(self, D):
+        self.profiler = profiler
+
+        # Basis matrix, its Moore-Penrose inverse, which does the fitting, and
+        # the matrix that does the modeling. These are shared by all Legendre
+        # objects having the same nsamp and degree.
+        self.x, self.B, self.pinvB, self.B_x_pinvB = basis(nsamp, degree)
+
+    def legfit(self, D, out=None, tile=TILE, workers=None):
         """
         Legendre fit a datacube
-        
+
         Parameters: D, numpy.ndarray
-                      The input datacube. This has been tested
-                      with floating point inputs.
+                      The input datacube, with up-the-ramp samples along the
+                      first axis. This has been tested with floating point inputs.
+                      It can be memory-mapped.
+                    out, numpy.ndarray (optional)
+                      C-contiguous (degree+1,)+D.shape[1:] array for the result
+                    tile, int (optional)
+                      Number of pixels per tile
+                    workers, int (optional)
+                      Number of threads
         Returns:
           * The Legendre fit. It can be converted to other things
             as follows.
               - Integrated DN = 2*λ1
               - "Slope" = 2*λ1/(NAXIS3-1)
         """
-        return(np.einsum('ij,jkl',self.pinvB, D))
\ No newline at end of file
+        with call(self.profiler, 'legfit'):
+            return(_tiled(self.pinvB, D, out, tile, workers, profiler=self.profiler))
+
+    def legval(self, λ, out=None, tile=TILE, workers=None):
+        """
+        Model a datacube from its Legendre fit
+
+        Parameters: λ, numpy.ndarray
+                      Legendre fit from legfit()
+                    out, tile, workers (optional)
+                      See legfit(). out is shaped (nsamp,)+λ.shape[1:].
+        Returns:
+          * The model datacube
+        """
+        with call(self.profiler, 'legval'):
+            return(_tiled(self.B, λ, out, tile, workers, profiler=self.profiler))
+
+    def residual(self, D, out=None, tile=TILE, workers=None):
+        """
+        Subtract the Legendre fit from a datacube, without keeping the fit
+
+        Parameters: D, numpy.ndarray
+                      The input datacube. See legfit().
+                    out, tile, workers (optional)
+                      See legfit(). out is shaped like D, and it can be D.
+        Returns:
+          * D minus its Legendre model
+        """
+        with call(self.profiler, 'residual'):
+            return(_tiled(self.B_x_pinvB, D, out, tile, workers, residual=True, profiler=self.profiler))
+
+
+def _tiled(M, A, out, tile, workers, residual=False, profiler=None):
+    """
+    Compute out = M·A (or A - M·A if residual), where A and out have
+    their first axes contracted/produced by M and all other axes are pixels.
+    Tiles are blocks of whole rows along the second axis, so for C-contiguous
+    inputs every tile is a view.
+    """
+    shape = (M.shape[0],) + A.shape[1:]
+    if out is None:
+        out = np.empty(shape, dtype=np.result_type(M.dtype, A.dtype))
+    if out.shape != shape:
+        raise ValueError('out must be {}'.format(shape))
+    if not out.flags.c_contiguous:
+        raise ValueError('out must be C-contiguous')
+    _A, _out = A, out
+    if A.ndim == 1:
+        _A, _out = A[:,np.newaxis], out[:,np.newaxis] # A single pixel
+
+    # Tiles of whole rows
+    ny = _A.shape[1]
+    rows = max(1, tile // max(1, int(np.prod(_A.shape[2:]))))
+    tiles = [(y0, min(y0+rows, ny)) for y0 in np.arange(0, ny, rows)]
+
+    def task(y):
+        with stage(profiler, 'matmul'):
+            a = _A[:,y[0]:y[1]].reshape(_A.shape[0], -1)
+            o = _out[:,y[0]:y[1]].reshape(_out.shape[0], -1)
+            if residual == True:
+                np.subtract(a, np.matmul(M, a), out=o) # o may be a
+            else:
+                np.matmul(M, a, out=o)
+
+    if (workers is None) or (workers <= 1):
+        for y in tiles:
+            task(y)
+    else:
+        with thread_pool(workers, profiler) as pool:
+            wait(pool.map(task, tiles))
+    return(out)
@@ -0,0 +1,167 @@
+import time
+import threading
+import contextlib
+import tracemalloc
+
+_NO_STAGE = contextlib.nullcontext() # What stage() and call() return without a Profiler
+
+
+class Profiler():
+    """
+    Per stage profile of SIRS and Legendre
+
+    Attach a Profiler with SIRS.set_profiler() or Legendre(..., profiler=).
+    Each refcor(), refcor_frame(), legfit(), legval() or residual() call is
+    then timed stage by stage:
+      * repair: Reference pixel repair
+      * incomplete_ft: Projection of the reference columns into Fourier space
+      * spectrum: Building the rfft of each output's correction
+      * irfft: Inverting it
+      * subtract: Flipping odd numbered outputs and subtracting
+      * dc: Trimmed mean reference row (DC and ACN) correction
+      * matmul: Legendre fitting or modeling, tile by tile
+    One Profiler can be shared by several SIRS and Legendre objects, so that
+    a whole pipeline is profiled the same way. Without a Profiler, each stage
+    costs one attribute lookup.
+
+    Calls are tracked per thread, so calls made at the same time from
+    different threads get separate reports. The worker threads of a call
+    (refcor() or Legendre with workers > 1) add their stages to that call.
+    See worker().
+
+    Parameters: callback, function (optional)
+                  Called with the report of each call as it finishes, e.g. to
+                  send it to a metrics system. See call().
+                memory, Bool (optional)
+                  Also measure the peak bytes allocated by each stage. This
+                  traces allocations with tracemalloc, which slows everything down,
+                  so times are not representative when it is on. With threads,
+                  stages that run at the same time share one measurement.
+    """
+    def __init__(self, callback=None, memory=False):
+        self.callback = callback
+        self.memory = memory
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Forget everything measured so far
+        """
+        with self._lock:
+            self.last = None     # Report of the last call
+            self.totals = {}     # Accumulated reports for each kind of call
+            self._local = threading.local() # Nesting of call() and its stages, per thread
+
+    def _state(self):
+        # This thread's (depth, stages): nesting of call() and the stages of
+        # the call in progress
+        if not hasattr(self._local, 'depth'):
+            self._local.depth, self._local.stages = 0, None
+        return(self._local)
+
+    def worker(self):
+        """
+        Initializer for the worker threads of the call in progress in this
+        thread. Their stages are then added to that call. See Threads.thread_pool().
+        """
+        stages = self._state().stages
+        def init():
+            self._local.depth, self._local.stages = 1, stages
+        return(init)
+
+    @contextlib.contextmanager
+    def call(self, name):
+        """
+        Context for one top level call. Its report is a dict
+          * call: name
+          * seconds: Wall time
+          * stages: dict of stage name to dict of
+              - seconds: Wall time. With threads, this is summed over threads.
+              - calls: Number of times the stage ran
+              - bytes: Peak bytes allocated, summed over calls. None without memory=True.
+        It goes to the callback, to last, and is added into totals[name]. Calls
+        made inside another call (e.g. legfit() inside a profiled pipeline step)
+        only add to the outermost call's stages.
+        """
+        state = self._state()
+        state.depth += 1
+        outer = state.depth == 1
+        if outer:
+            state.stages = {}
+        started = False
+        if outer and self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            started = True
+        t0 = time.perf_counter()
+        try:
+            yield self
+        finally:
+            seconds = time.perf_counter() - t0
+            if started:
+                tracemalloc.stop()
+            state.depth -= 1
+            report = None
+            if outer:
+                report = {'call':name, 'seconds':seconds, 'stages':state.stages}
+                state.stages = None
+                with self._lock:
+                    self.last = report
+                    self._add(report)
+            if (report is not None) and (self.callback is not None):
+                self.callback(report)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Context for one stage of a call
+        """
+        if self.memory and tracemalloc.is_tracing():
+            b0 = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        t0 = time.perf_counter()
+        try:
+            yield self
+        finally:
+            seconds = time.perf_counter() - t0
+            nbytes = None
+            if self.memory and tracemalloc.is_tracing():
+                nbytes = max(0, tracemalloc.get_traced_memory()[1] - b0)
+            stages = self._state().stages
+            if stages is not None:
+                with self._lock: # Worker threads share their call's stages
+                    _add_stage(stages, name, seconds, 1, nbytes)
+
+    def _add(self, report):
+        # Add a report into totals. Called holding the lock.
+        total = self.totals.setdefault(report['call'], {'calls':0, 'seconds':0., 'stages':{}})
+        total['calls'] += 1
+        total['seconds'] += report['seconds']
+        for name, s in report['stages'].items():
+            _add_stage(total['stages'], name, s['seconds'], s['calls'], s['bytes'])
+
+    def __repr__(self):
+        return('Profiler(calls={})'.format({name:t['calls'] for name, t in self.totals.items()}))
+
+
+def _add_stage(stages, name, seconds, calls, nbytes):
+    # Accumulate one stage measurement
+    s = stages.setdefault(name, {'seconds':0., 'calls':0, 'bytes':None})
+    s['seconds'] += seconds
+    s['calls'] += calls
+    if nbytes is not None:
+        s['bytes'] = (s['bytes'] or 0) + nbytes
+
+
+def call(profiler, name):
+    """
+    profiler.call(name), or a do-nothing context if profiler is None
+    """
+    return(_NO_STAGE if profiler is None else profiler.call(name))
+
+
+def stage(profiler, name):
+    """
+    profiler.stage(name), or a do-nothing context if profiler is None
+    """
+    return(_NO_STAGE if profiler is None else profiler.stage(name))
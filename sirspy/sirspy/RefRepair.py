@@ -0,0 +1,181 @@
+import os
+import h5py
+import numpy as np
+from scipy.signal import savgol_filter
+
+# Savitzky-Golay outlier repair of the reference columns. These are the
+# same as in SIRS.jl.
+SG_HALF_WIDTH = 5           # Filter half width in samples
+SG_DEGREE     = 3           # Polynomial degree
+SG_SIGREJ     = 4.          # Sigma clipping threshold
+TRIM_SOFT     = 3.16712e-5  # "4-sigma" clip. 1/2 the total amount to trim.
+
+# The JPL PPL detector has bad right reference pixels in these rows
+PPL_BAD_ROWS = (1870, 2225) # First and last+1 0-based rows
+
+
+class RefRepair():
+    """
+    Repair bad reference pixels before SIRS uses them
+
+    Bad pixels in the left and right reference columns are replaced by
+    linear interpolation between the nearest good pixels above and below in
+    the same column. Bad pixels at the top or bottom of a column take the
+    value of the nearest good pixel. The interpolation weights are computed
+    here, once, so repair() is one gather for all frames and columns.
+
+    Optionally, transients in the reference columns are then replaced using
+    the Savitzky-Golay filter that coadd!() in SIRS.jl uses.
+
+    Parameters: shape, tuple
+                  Frame shape, (naxis2, naxis1)
+                mask, numpy.ndarray or string (optional)
+                  Bad pixel map shaped like a frame. Bad pixels are True (nonzero).
+                  Only the reference columns are used. This can also be a FITS,
+                  .npy or HDF5 file holding the map. See read_mask().
+                rb, int (optional)
+                  Reference column border width
+                sg, Bool (optional)
+                  Apply Savitzky-Golay transient rejection
+    """
+    def __init__(self, shape, mask=None, rb=4, sg=False):
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.rb = int(rb)
+        self.sg = sg
+        naxis2, naxis1 = self.shape
+        cols = np.concatenate((np.arange(self.rb), np.arange(naxis1-self.rb, naxis1))) # Reference columns
+
+        # Bad reference pixels
+        if mask is None:
+            bad = np.zeros((naxis2, len(cols)), dtype=bool)
+        else:
+            if isinstance(mask, (str, os.PathLike)):
+                mask = read_mask(mask)
+            mask = np.asarray(mask)
+            if mask.shape != self.shape:
+                raise ValueError('mask must be {} x {}'.format(naxis2, naxis1))
+            bad = mask[:,cols] != 0
+        self.nbad = int(np.sum(bad))
+
+        # For each bad pixel, the rows of the good pixels on either side of it
+        # and the weight of the upper one
+        y, x, ylo, yhi = ([np.zeros(0, dtype=np.int64)] for i in range(4))
+        for j in np.flatnonzero(np.any(bad, axis=0)):
+            good = np.flatnonzero(~bad[:,j])
+            if len(good) == 0:
+                raise ValueError('reference column {} has no good pixels'.format(cols[j]))
+            _y = np.flatnonzero(bad[:,j])
+            i = np.searchsorted(good, _y)
+            y.append(_y)
+            x.append(np.full(len(_y), cols[j]))
+            ylo.append(good[np.maximum(i-1, 0)])
+            yhi.append(good[np.minimum(i, len(good)-1)])
+        self.y, self.x, self.ylo, self.yhi = [np.concatenate(a) for a in (y, x, ylo, yhi)]
+        span = self.yhi - self.ylo
+        self.w = np.where(span > 0, (self.y-self.ylo)/np.maximum(span, 1), 0.)
+
+    @classmethod
+    def ppl(cls, shape, rb=4, sg=False, y0=0):
+        """
+        RefRepair for the JPL PPL detector's bad right reference pixels.
+        This is what pplfix1=True does.
+
+        Parameters: shape, tuple
+                      Frame shape, (naxis2, naxis1)
+                    rb, sg (optional)
+                      See RefRepair
+                    y0, int (optional)
+                      Full frame row of the first row of the frames, for row windows.
+                      See SIRS.window().
+        """
+        b0, b1 = PPL_BAD_ROWS
+        if (y0 == 0) and (shape[0] < b1+1):
+            raise ValueError('the PPL bad reference pixels are in rows {}-{}, but frames have {} rows'.format(
+                             b0, b1-1, shape[0]))
+        mask = np.zeros(shape, dtype=bool)
+        mask[max(b0-y0, 0):max(b1-y0, 0),-rb:] = True
+        return(cls(shape, mask=mask, rb=rb, sg=sg))
+
+    def repair(self, D, z0=0, z1=None):
+        """
+        Repair the reference columns of frames z0 ≤ z < z1, in place
+
+        Parameters: D, numpy.ndarray
+                      Datacube. It is overwritten. D can be any view of the data,
+                      e.g. a slice of a larger datacube.
+                    z0, z1, int (optional)
+                      Frames to repair. The default is all of them.
+        """
+        if z1 is None:
+            z1 = D.shape[0]
+        nz, rb = z1-z0, self.rb
+
+        # Interpolate over bad pixels. Advanced indexing on D writes through
+        # whether D is contiguous or not.
+        if self.nbad > 0:
+            D[z0:z1,self.y,self.x] = (1-self.w)*D[z0:z1,self.ylo,self.x] + self.w*D[z0:z1,self.yhi,self.x]
+
+        # Savitzky-Golay transient rejection of each column group's time series,
+        # as in SIRSCore. The right columns are read out in reverse.
+        if self.sg == True:
+            lr = np.stack((D[z0:z1,:,:rb].reshape(nz,-1), D[z0:z1,:,:-rb-1:-1].reshape(nz,-1)), axis=1)
+            _sg_repair(lr)
+            D[z0:z1,:,:rb] = lr[:,0].reshape(nz,-1,rb)
+            D[z0:z1,:,:-rb-1:-1] = lr[:,1].reshape(nz,-1,rb)
+
+    def __repr__(self):
+        return('RefRepair(shape={}, nbad={}, sg={})'.format(self.shape, self.nbad, self.sg))
+
+
+def read_mask(file):
+    """
+    read_mask(file)
+
+    Read a bad pixel map from a file
+
+    Parameters: file, string
+                  A .npy file, an HDF5 file holding one dataset (or a dataset
+                  named 'mask'), or a FITS file with the map in the first image HDU
+    Returns:
+      * The map as a numpy.ndarray
+    """
+    file = os.fspath(file)
+    if file.endswith('.npy'):
+        return(np.load(file))
+    if h5py.is_hdf5(file):
+        with h5py.File(file, 'r') as f:
+            if 'mask' in f:
+                return(f['mask'][...])
+            names = [name for name in f if isinstance(f[name], h5py.Dataset)]
+            if len(names) != 1:
+                raise ValueError(file + ': expected one dataset or a dataset named mask')
+            return(f[names[0]][...])
+    from astropy.io import fits
+    with fits.open(file) as hdul:
+        for hdu in hdul:
+            if (hdu.data is not None) and (hdu.data.ndim == 2):
+                return(np.array(hdu.data))
+    raise ValueError(file + ': no image found')
+
+
+def _sg_repair(lr):
+    """
+    Replace transients in reference column streams with a Savitzky-Golay
+    smoothed version, in place. Transients are samples that differ from the
+    smoothed stream by more than SG_SIGREJ standard deviations. The mean and
+    standard deviation are computed after trimming TRIM_SOFT on either side.
+
+    Parameters: lr, numpy.ndarray
+                  Reference pixels in time order along the last axis
+    """
+    sm = savgol_filter(lr, 2*SG_HALF_WIDTH+1, SG_DEGREE, axis=-1, mode='interp')
+    dif = lr - sm
+    n = dif.shape[-1]
+    discard = int(TRIM_SOFT*n)
+    trimmed = dif
+    if discard > 0:
+        trimmed = np.partition(dif, (discard, n-discard-1), axis=-1)[...,discard:n-discard]
+    μ = np.mean(trimmed, axis=-1, keepdims=True)
+    σ = np.std(trimmed, axis=-1, ddof=1, keepdims=True)
+    bad = (dif < μ-SG_SIGREJ*σ) | (dif > μ+SG_SIGREJ*σ)
+    lr[bad] = sm[bad]
@@ -0,0 +1,160 @@
+import threading
+from collections import OrderedDict
+import h5py
+import numpy as np
+from .SIRS import SIRS
+from .IncompleteFT import IncompleteFT
+from .Weights import operator
+
+
+class Registry():
+    """
+    A registry of SIRS objects for many detectors
+
+    Detectors are registered by ID together with their weights files. A
+    detector's SIRS object, and with it α and β, is loaded lazily the
+    first time it is requested. All detectors having the same readout
+    geometry (naxis1, naxis2, nout, nroh) share one incomplete Fourier
+    transform operator. When the bytes held exceed memory_budget, the least
+    recently used SIRS objects are evicted, together with any operator that
+    no remaining detector uses. The registry is thread safe.
+
+    Parameters: files, dict (optional)
+                  Maps detector IDs to weights filenames. More can be added
+                  using register(). get() also accepts weights filenames directly.
+                memory_budget, int (optional)
+                  Memory budget in bytes. The default is no limit. The most
+                  recently requested detector is never evicted.
+                engine, string (optional)
+                  Incomplete Fourier transform engine, selected from {'fft','dense'}.
+                  See SIRS. 'fft' operators need almost no memory.
+                operator_cache, string (optional)
+                  With engine='dense', a directory in which regenerated operators
+                  are cached. See Weights.operator().
+
+    Example:
+      reg = sirspy.Registry({'SCA01':'sca01.h5', 'SCA02':'sca02.h5'}, memory_budget=2**30)
+      reg['SCA01'].refcor(D)
+    """
+    def __init__(self, files=None, memory_budget=None, engine='fft', operator_cache=None):
+        if engine not in ('dense', 'fft'):
+            raise ValueError("engine must be 'dense' or 'fft'")
+        self.files = dict(files) if files is not None else {}
+        self.memory_budget = memory_budget
+        self.engine = engine
+        self.operator_cache = operator_cache
+        self._sirs = OrderedDict()  # Loaded SIRS objects, least recently used first
+        self._geometry = {}         # Readout geometry of each loaded detector
+        self._operators = {}        # Shared operators, keyed by readout geometry
+        self._lock = threading.RLock()
+        self.hits, self.misses, self.evictions = 0, 0, 0
+
+    def register(self, key, sirs_file):
+        """
+        Register a detector
+
+        Parameters: key, hashable
+                      Detector ID
+                    sirs_file, string
+                      Weights filename
+        """
+        with self._lock:
+            if (key in self._sirs) and (self.files.get(key) != sirs_file):
+                self.evict(key) # Its weights changed
+            self.files[key] = sirs_file
+
+    def get(self, key):
+        """
+        Get the SIRS object for a detector, loading it if necessary
+
+        Parameters: key, hashable
+                      A registered detector ID or a weights filename
+        """
+        with self._lock:
+            if key in self._sirs:
+                self.hits += 1
+                self._sirs.move_to_end(key)
+                return(self._sirs[key])
+            self.misses += 1
+            sirs_file = self.files.get(key, key)
+            geometry = self._read_geometry(sirs_file)
+            if geometry not in self._operators:
+                self._operators[geometry] = self._build_operator(sirs_file)
+            sirs = SIRS(sirs_file, operator=self._operators[geometry])
+            self._sirs[key] = sirs
+            self._geometry[key] = geometry
+            self._enforce_budget()
+            return(sirs)
+
+    __getitem__ = get
+
+    def __contains__(self, key):
+        return(key in self._sirs)
+
+    def __len__(self):
+        return(len(self._sirs))
+
+    def evict(self, key):
+        """
+        Evict a detector's SIRS object. Its operator is also dropped if no
+        other loaded detector uses it.
+
+        Parameters: key, hashable
+                      Detector ID or weights filename
+        """
+        with self._lock:
+            if key not in self._sirs:
+                return
+            del self._sirs[key]
+            geometry = self._geometry.pop(key)
+            if geometry not in self._geometry.values():
+                del self._operators[geometry]
+            self.evictions += 1
+
+    def nbytes(self):
+        """
+        Bytes held by all loaded SIRS objects and shared operators
+        """
+        with self._lock:
+            total = sum([sirs._nbytes()[0] for sirs in self._sirs.values()])
+            for op in self._operators.values():
+                total += op.nbytes
+            return(total)
+
+    def stats(self):
+        """
+        Registry statistics
+
+        Returns: dict
+          * loaded: IDs of loaded detectors, least recently used first
+          * operators: Number of shared operators
+          * nbytes: Bytes held. See nbytes().
+          * memory_budget, hits, misses, evictions
+        """
+        with self._lock:
+            return({'loaded':list(self._sirs.keys()), 'operators':len(self._operators),
+                    'nbytes':self.nbytes(), 'memory_budget':self.memory_budget,
+                    'hits':self.hits, 'misses':self.misses, 'evictions':self.evictions})
+
+    def _enforce_budget(self):
+        # Evict least recently used detectors, but never the newest
+        if self.memory_budget is None:
+            return
+        while (len(self._sirs) > 1) and (self.nbytes() > self.memory_budget):
+            self.evict(next(iter(self._sirs)))
+
+    def _read_geometry(self, sirs_file):
+        with h5py.File(sirs_file, 'r') as f:
+            return(tuple([int(np.int64(f['SIRSCore'][key]))
+                          for key in ('naxis1','naxis2','nout','nroh')]))
+
+    def _build_operator(self, sirs_file):
+        # Build (or load) the operator once for a readout geometry
+        with h5py.File(sirs_file, 'r') as f:
+            g = f['SIRSCore']
+            ysize, xsize, nroh = [int(np.int64(g[key])) for key in ('ysize','xsize','nroh')]
+            if self.engine == 'fft':
+                return(IncompleteFT(ysize, xsize, nroh, rb=SIRS.RB))
+            if 'incft' in g:
+                return(np.array(g['incft']))
+        return(operator(ysize, xsize, nroh, rb=SIRS.RB, cache_dir=self.operator_cache))
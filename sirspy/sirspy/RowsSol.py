@@ -0,0 +1,221 @@
+import h5py
+import numpy as np
+from .SIRS import SIRS, _trimmed_mean, _refrows
+from .Legendre import Legendre
+from .Stream import _open
+from .SIRSCore import TRIM_HARD
+
+
+class RowsSol():
+    """
+    Accumulate reference row sums from up-the-ramp darks and solve for the
+    f = 0 Hz reference row weights, w
+
+    This is the python equivalent of rowssol.jl. For each frame and output,
+    μ is the trimmed mean of the regular pixels after fitting and subtracting
+    a straight line from each pixel, and R is the output's reference rows
+    (rb bottom rows, then rb top rows, as one vector). rowssol.jl keeps R for
+    every frame of every file and multiplies μ by pinv(R). Here only the
+    normal equation sums RᵀR and Rᵀμ are kept, so memory does not grow with
+    the number of frames, and darks are read one frame at a time. Partial
+    sums can be combined using merge(). solve() then gives, for all outputs
+    at once, w = pinv(RᵀR)·Rᵀμ, which equals pinv(R)·μ.
+
+    RᵀR is (2*rb*xsize)² per output: 32 MB for a 16 output H1RG, about 270 MB
+    for a 32 output H4RG and 540 MB for a 4 output H2RG.
+
+    Parameters: naxis1, naxis2, nout, int
+                  Detector geometry
+                rb, int (optional)
+                  Reference pixel border width
+
+    Example:
+      rs = sirspy.RowsSol.from_weights('weights.h5')
+      for file in files:
+          rs.coadd(file, sign=-1)
+      rs.solve()
+      rs.write('weights.h5')
+    """
+    def __init__(self, naxis1, naxis2, nout, rb=SIRS.RB):
+        self.naxis1 = int(naxis1)
+        self.naxis2 = int(naxis2)
+        self.nout = int(nout)
+        self.rb = int(rb)
+        self.xsize = self.naxis1 // self.nout
+        self.clear()
+
+    @classmethod
+    def from_weights(cls, sirs_file):
+        """
+        RowsSol for the detector geometry of a sirspy weights file
+
+        Parameters: sirs_file, string
+                      Name of a sirspy weights file
+        """
+        with h5py.File(sirs_file, 'r') as f:
+            g = f['SIRSCore']
+            return(cls(np.int64(g['naxis1']), np.int64(g['naxis2']), np.int64(g['nout'])))
+
+    def clear(self):
+        """
+        Reset the sums to zero
+        """
+        nw = 2*self.rb*self.xsize # Reference row pixels per output
+        self.RᵀR = np.zeros((self.nout,nw,nw)) # = Σ Rᵀ R
+        self.Rᵀμ = np.zeros((self.nout,nw))    # = Σ Rᵀ μ
+        self.nframes = 0                       # Number of frames coadded
+        self.w = None
+
+    def coadd(self, source, degree=1, sign=1.0, hdu=None, dataset=None, max_frames=64):
+        """
+        Coadd an up-the-ramp sampled dark into the sums
+
+        The dark is read twice, one frame at a time: once to fit a Legendre
+        polynomial to each pixel, and once to accumulate the sums from the
+        residuals. Only the reference rows and μ of up to max_frames frames are
+        held, and they are added into RᵀR with one batched matrix product.
+
+        Parameters: source, string, RampReader or numpy.ndarray
+                      Input FITS or HDF5 file, an open RampReader, or a datacube,
+                      which is not modified
+                    degree, int (optional)
+                      Degree of the Legendre fit that is subtracted. rowssol.jl fits lines.
+                    sign, hdu, dataset (optional)
+                      See RampReader. Use sign=-1 for DCL data, as rowssol.jl does.
+                    max_frames, int (optional)
+                      Frames per batched update of the sums
+        """
+        reader = _open(source, sign, hdu, dataset)
+        try:
+            if tuple(reader.shape) != (self.naxis2,self.naxis1):
+                raise ValueError('frames must be {} x {}'.format(self.naxis2, self.naxis1))
+            leg = Legendre(reader.nframes, degree)
+            frame = np.empty(reader.shape)
+
+            # First pass: Legendre fit of each pixel
+            λ = np.zeros((degree+1,)+reader.shape)
+            for z in np.arange(reader.nframes):
+                reader.read(z, out=frame)
+                for k in np.arange(degree+1):
+                    λ[k] += leg.pinvB[k,z]*frame
+
+            # Second pass: μ and R of each residual frame
+            rb, nout, xsize = self.rb, self.nout, self.xsize
+            nz = min(max_frames, reader.nframes)
+            R = np.empty((nz,nout,2*rb*xsize))
+            μ = np.empty((nz,nout))
+            for z in np.arange(reader.nframes):
+                reader.read(z, out=frame)
+                frame -= np.tensordot(leg.B[z], λ, axes=1)
+                i = z % nz
+                reg = frame[rb:-rb].reshape(-1,nout,xsize).transpose(1,0,2).reshape(nout,-1)
+                μ[i] = _trimmed_mean(reg, int(TRIM_HARD*reg.shape[1]))
+                R[i] = _refrows(frame[np.newaxis], rb, nout, xsize)[0]
+                if (i == nz-1) or (z == reader.nframes-1):
+                    self._add(R[:i+1], μ[:i+1])
+        finally:
+            if reader is not source:
+                reader.close()
+
+    def _add(self, R, μ):
+        """
+        Add the normal equation sums of a group of frames, for all outputs at once
+
+        Parameters: R, numpy.ndarray
+                      (frames, nout, 2*rb*xsize) reference rows
+                    μ, numpy.ndarray
+                      (frames, nout) regular pixel means
+        """
+        Rᵀ = R.transpose(1,2,0) # (nout, 2*rb*xsize, frames)
+        self.RᵀR += np.matmul(Rᵀ, R.transpose(1,0,2))
+        self.Rᵀμ += np.matmul(Rᵀ, μ.T[:,:,np.newaxis])[:,:,0]
+        self.nframes += R.shape[0]
+
+    def merge(self, *others):
+        """
+        Add the sums of other RowsSol objects into this one
+
+        Parameters: others, RowsSol
+                      Having the same geometry
+        """
+        for other in others:
+            if (other.naxis1, other.naxis2, other.nout, other.rb) != (self.naxis1, self.naxis2, self.nout, self.rb):
+                raise ValueError('RowsSol geometries differ')
+            self.RᵀR += other.RᵀR
+            self.Rᵀμ += other.Rᵀμ
+            self.nframes += other.nframes
+        self.w = None
+
+    def solve(self, rcond=None):
+        """
+        Solve for the reference row weights of all outputs at once
+
+        Subtracting the Legendre fit leaves only nframes-degree-1 independent
+        frames per dark, so RᵀR is singular unless there are more of those than
+        2*rb*xsize. Its null space is dropped, giving the minimum norm solution.
+
+        Parameters: rcond, float (optional)
+                      Eigenvalues of RᵀR smaller than rcond times the largest are treated
+                      as zero. The default is 2*rb*xsize times machine epsilon.
+        Returns:
+          * w, (nout, 2*rb*xsize). The DC offset of output op in a frame is
+            w[op]·(its reference rows, bottom then top).
+        """
+        if self.nframes == 0:
+            raise ValueError('Call coadd() before solve()')
+        if rcond is None:
+            rcond = self.RᵀR.shape[-1]*np.finfo(np.float64).eps
+        pinv = np.linalg.pinv(self.RᵀR, rcond=rcond, hermitian=True)
+        self.w = np.matmul(pinv, self.Rᵀμ[:,:,np.newaxis])[:,:,0]
+        return(self.w)
+
+    def write(self, sirs_file):
+        """
+        Write the weights into a sirspy weights file. SIRS then uses them
+        for the f = 0 Hz (DC) correction. See Weights.py.
+
+        Parameters: sirs_file, string
+                      A sirspy weights file for the same detector. It is modified.
+        """
+        if self.w is None:
+            raise ValueError('Call solve() before write()')
+        with h5py.File(sirs_file, 'r+') as f:
+            g = f['SIRSCore']
+            geometry = tuple(int(np.int64(g[key])) for key in ('naxis1','naxis2','nout'))
+            if geometry != (self.naxis1, self.naxis2, self.nout):
+                raise ValueError(sirs_file + ' is for a different detector geometry')
+            if 'w' in g:
+                del g['w']
+            g['w'] = np.ascontiguousarray(np.transpose(self.w)) # Same layout as α and β
+
+
+def rowssol(files, sirs_file, degree=1, sign=1.0, hdu=None, dataset=None, rcond=None, verbose=True):
+    """
+    rowssol(files, sirs_file, degree=1, sign=1.0, hdu=None, dataset=None, rcond=None, verbose=True)
+
+    Solve for the reference row weights of a detector and write them into
+    its sirspy weights file. This is the python equivalent of rowssol.jl.
+    See RowsSol.
+
+    Parameters: files, list of string
+                  Up-the-ramp darks
+                sirs_file, string
+                  The detector's sirspy weights file. It is modified.
+                degree, sign, hdu, dataset (optional)
+                  See RowsSol.coadd()
+                rcond (optional)
+                  See RowsSol.solve()
+                verbose, Bool (optional)
+                  Print progress
+    Returns:
+      * w. See RowsSol.solve().
+    """
+    rs = RowsSol.from_weights(sirs_file)
+    for file in files:
+        if verbose == True:
+            print('rowssol() processing file:', file, flush=True)
+        rs.coadd(file, degree=degree, sign=sign, hdu=hdu, dataset=dataset)
+    w = rs.solve(rcond=rcond)
+    rs.write(sirs_file)
+    return(w)
+
@@ -1,22 +1,101 @@
+import os
+import copy
+import time
 import h5py
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy import interpolate
+from .IncompleteFT import IncompleteFT, sirs_freq_index
+from .Shared import mmap_dataset, SharedArray, process_memory
+from .Weights import operator
+from .Workspace import Workspace
+from .FFT import get_backend
+from .RefRepair import RefRepair, read_mask
+from .Profiler import call, stage
+from .Threads import thread_pool, split, wait
 
 
 class SIRS():
     
     RB = 4 # Reference pixel border width. This is the same for all HxRG detectors
     
-    def __init__(self, sirs_file):
+    def __init__(self, sirs_file, engine=None, load='memory', operator_cache=None, operator=None,
+                 f_max=None, fmask=None, fft_backend=None, fft_workers=None, precision='float64',
+                 refmask=None, sg_repair=False, row_weights=True):
         """
-        __init__(sirs_file)
+        __init__(sirs_file, engine=None, load='memory', operator_cache=None, operator=None,
+                 f_max=None, fmask=None, fft_backend=None, fft_workers=None, precision='float64',
+                 refmask=None, sg_repair=False, row_weights=True)
             
         Instantiate a SIRS object
         
         Parameters: sirs_file:string
                       Name of a SIRS weights file. The suffix will be .jld.
+                    engine:string (optional)
+                      Incomplete Fourier transform engine. Selected from {'dense','fft'}.
+                      'dense' multiplies by the incft matrix. 'fft' uses the structured
+                      FFT-based IncompleteFT. It gives the same 𝓵 and 𝓻 to within floating
+                      point rounding in O(n log n) time, and the incft matrix is never loaded.
+                      The default is 'dense' for version 1 weights files, which store incft,
+                      and 'fft' for compact version 2 files, which do not. See Weights.py.
+                    load:string (optional)
+                      How the incft matrix is held. Selected from {'memory','mmap','shm'}.
+                      'memory' reads it into a private array. 'mmap' memory-maps it
+                      read-only from the weights file, so all processes share the page
+                      cache copy. 'shm' copies it once into a multiprocessing.shared_memory
+                      block. In both shared modes, pickling a SIRS object (e.g. to send it
+                      to a multiprocessing worker) sends only a handle, and unpickling
+                      attaches to the shared copy. See memory_report().
+                    operator_cache:string (optional)
+                      For version 2 weights files with engine='dense', a directory where
+                      the regenerated incft matrix is cached for each readout geometry.
+                      Required for load='mmap'.
+                    operator:IncompleteFT or numpy.ndarray (optional)
+                      A prebuilt operator to use instead of loading or building one. Pass an
+                      IncompleteFT for engine='fft' or an incft matrix for engine='dense'. It
+                      must match the readout geometry of sirs_file. This lets detectors
+                      having the same geometry share one operator. See Registry.
+                    f_max:float (optional)
+                      Maximum frequency in Hz to correct. See restrict().
+                    fmask:numpy.ndarray (optional)
+                      Boolean mask of frequencies to correct, indexed like freq. See restrict().
+                    fft_backend:string or FFT.FFTBackend (optional)
+                      FFT library. Selected from {'numpy','scipy','fftw'}. The default is
+                      'numpy'. 'fftw' needs pyFFTW. The transforms used on every frame are
+                      planned here, so planning is not timed as part of the correction.
+                      See FFT.py.
+                    fft_workers:int (optional)
+                      Threads for each FFT, for the 'scipy' and 'fftw' backends
+                    precision:string (optional)
+                      Selected from {'float64','float32'}. With 'float32', incft (or the
+                      IncompleteFT), α and β are held as complex64, every intermediate
+                      is single precision, and refcor() takes float32 datacubes. This
+                      halves the memory traffic. 'float32' cannot be used with load='mmap',
+                      which maps the complex128 incft in the weights file. Use
+                      compare_precision() to check the accuracy on your data.
+                    refmask:numpy.ndarray or string (optional)
+                      Bad reference pixel map, or a file holding it. See set_refmask().
+                    sg_repair:Bool (optional)
+                      Savitzky-Golay transient rejection of the reference columns.
+                      See set_refmask().
+                    row_weights:Bool (optional)
+                      If the weights file holds reference row weights (w, from RowsSol),
+                      use them for the f = 0 Hz (DC) correction. Otherwise, or if False,
+                      each output's DC is the trimmed mean of the reference rows.
         """
+        if engine not in (None, 'dense', 'fft'):
+            raise ValueError("engine must be 'dense' or 'fft'")
+        if load not in ('memory', 'mmap', 'shm'):
+            raise ValueError("load must be 'memory', 'mmap' or 'shm'")
+        if precision not in ('float64', 'float32'):
+            raise ValueError("precision must be 'float64' or 'float32'")
+        if (precision == 'float32') and (load == 'mmap'):
+            raise ValueError("precision='float32' needs load='memory' or 'shm'")
+        self.precision = np.dtype(precision)                        # Real dtype
+        self.cdtype = np.result_type(self.precision, np.complex64) # Complex dtype
+        self.load = load
+        self.sirs_file = sirs_file
+        t0 = time.perf_counter()
+        
         # Test to be sure it is an HDF5 file and not JLD
         if sirs_file[-3:] != '.h5':
             print('ERROR: Filename suffix must be .h5.')
@@ -25,6 +104,18 @@ class SIRS():
         # Open the cal. file
         f = h5py.File(sirs_file, "r")
         
+        # Version 2 weights files do not store incft
+        if 'version' in f['SIRSCore']:
+            self.version = np.int64(f['SIRSCore']['version'])
+        else:
+            self.version = 1
+        if operator is not None:
+            engine = 'fft' if isinstance(operator, IncompleteFT) else 'dense'
+        elif engine is None:
+            engine = 'dense' if 'incft' in f['SIRSCore'] else 'fft'
+        self.engine = engine
+        self.operator_shared = operator is not None # True if the operator belongs to someone else
+        
         # Recover just the parameters needed to
         # apply SIRS reference correction
         self.naxis1 = np.int64(f['SIRSCore']['naxis1'])       # Number of columns
@@ -34,24 +125,514 @@ class SIRS():
         self.xsize  = np.int64(f['SIRSCore']['xsize'])        # x-size one output
         self.ysize  = np.int64(f['SIRSCore']['ysize'])        # y-size one output)
         self.nstep  = (self.xsize+self.nroh)*self.ysize # Total number of time steps
-        self.α      = np.transpose(np.array(f['SIRSCore']['α']))            # SIRS weights
-        self.β      = np.transpose(np.array(f['SIRSCore']['β']))            # SIRS weights
+        self.kidx   = sirs_freq_index(self.ysize, self.nstep) # Where each freq goes in the full rfft
+        self.band   = None                              # Frequencies kept by restrict()
+        self.α      = np.transpose(np.array(f['SIRSCore']['α'])).astype(self.cdtype) # SIRS weights
+        self.β      = np.transpose(np.array(f['SIRSCore']['β'])).astype(self.cdtype) # SIRS weights
         
         # Zero out f=0 Hz in alpha and beta. We correct this frequency using
         # only reference rows.
         self.α[:,0] = 0.0
         self.β[:,0] = 0.0
         
+        # Reference row weights for f=0 Hz, if any. See RowsSol.py.
+        self.w = None
+        if (row_weights == True) and ('w' in f['SIRSCore']):
+            self.w = np.transpose(np.array(f['SIRSCore']['w'])).astype(self.precision)
+        
         # Parameters used for DC correction
         self.rowslim = (self.naxis2-3,self.naxis2-2) # 1st and last reference rows to use
-        self.discard = np.int(.005 * (self.rowslim[1]-self.rowslim[0]+1) * self.xsize) # Discard this many elements 
+        self.discard = int(.005 * (self.rowslim[1]-self.rowslim[0]+1) * self.xsize) # Discard this many elements 
                                                                                        # on top and bottom of distribution
                                                                                        # when robustly computing reference
                                                                                        # rows mean.
         
         # Parameters related to computing incomplete Fourier transforms
         self.freq   = np.array(f['SIRSCore']['freq'])         # Incomplet Fourier transform frequencies
-        self.incft  = np.array(f['SIRSCore']['incft'])        # Incomplete Fourier transform operator (a matrix)
+        if operator is not None:
+            self._set_operator(operator)
+        elif (self.engine == 'dense') and ('incft' in f['SIRSCore']):
+            self.incft  = self._load_incft(f['SIRSCore']['incft']) # Incomplete Fourier transform operator (a matrix)
+        elif self.engine == 'dense':
+            self.incft  = self._build_incft(operator_cache)   # Regenerate it for this geometry
+        else:
+            self.ift    = IncompleteFT(self.ysize, self.xsize, self.nroh, rb=self.RB).astype(self.cdtype)
+        f.close()
+        
+        # Optionally work in a restricted band
+        if (f_max is not None) or (fmask is not None):
+            self.restrict(f_max=f_max, fmask=fmask)
+        
+        # Reference pixel repair
+        self.set_refmask(refmask, sg_repair=sg_repair)
+        self._ppl = None # RefRepair for pplfix1, made when first used
+        self.profiler = None # See set_profiler()
+        
+        # Readout window. Full frames start at row 0. See window().
+        self.y0 = 0
+        self._regular = (slice(self.RB,int(self.naxis2)-self.RB), slice(self.RB,int(self.naxis1)-self.RB)) # Regular pixels
+        self.window_key = None # (y0, y1, nout, nroh) of a derived object
+        self._windows = {}     # Derived objects, keyed by window_key
+        self._parent_fmask = None
+        
+        # FFT backend, with the per frame transforms planned ahead of time
+        self.fft = get_backend(fft_backend, workers=fft_workers)
+        self.fft.plan('irfft', self.nstep, np.complex64)
+        if self.engine == 'fft':
+            self.fft.plan('fft', self.ysize, self.cdtype, batch=(2,self.RB), axis=-2)
+        self.attach_time = time.perf_counter() - t0 # Seconds to load or attach the weights
+        
+    def set_refmask(self, refmask=None, sg_repair=False):
+        """
+        Set how bad reference pixels are repaired. Every refcor() and
+        refcor_frame() then repairs the reference columns before using them.
+        Bad pixels are replaced by linear interpolation along their column. The
+        interpolation weights are computed here, once. See RefRepair.py.
+        
+        Parameters: refmask, numpy.ndarray or string (optional)
+                      (naxis2, naxis1) bad pixel map. Bad pixels are True (nonzero).
+                      Only the reference columns are used. This can also be a FITS,
+                      .npy or HDF5 file holding the map. None turns repair off.
+                    sg_repair, Bool (optional)
+                      After interpolating, replace transients in the reference columns
+                      using the Savitzky-Golay filter that coadd!() in SIRS.jl uses
+        """
+        if isinstance(refmask, (str, os.PathLike)):
+            refmask = read_mask(refmask)
+        self.refmask, self.sg_repair = refmask, sg_repair
+        self.repair = None
+        if (refmask is not None) or (sg_repair == True):
+            self.repair = RefRepair((self.naxis2,self.naxis1), mask=refmask, rb=self.RB, sg=sg_repair)
+        
+    def _repair(self, D, z0, z1, pplfix1=False):
+        """
+        Repair the reference columns of frames z0 ≤ z < z1 in place
+        """
+        if (pplfix1 == False) and (self.repair is None):
+            return
+        with stage(self.profiler, 'repair'):
+            if pplfix1 == True:
+                if self._ppl is None:
+                    self._ppl = RefRepair.ppl((self.naxis2,self.naxis1), rb=self.RB, y0=self.y0)
+                self._ppl.repair(D, z0, z1)
+            if self.repair is not None:
+                self.repair.repair(D, z0, z1)
+        
+    def set_profiler(self, profiler=None):
+        """
+        Profile refcor() and refcor_frame() stage by stage
+        
+        Parameters: profiler, Profiler (optional)
+                      Where the measurements go. See Profiler.py. It can be shared with
+                      other SIRS and Legendre objects. None turns profiling off.
+        Returns:
+          * profiler
+        """
+        self.profiler = profiler
+        return(profiler)
+        
+    def restrict(self, f_max=None, fmask=None):
+        """
+        Restrict SIRS correction to a band of frequencies
+        
+        This drops the rows of incft, α, β and freq outside the band, so the
+        incomplete Fourier transform and the spectrum assembly only touch the
+        retained frequencies. Dropped frequencies are not corrected. This
+        matches sirssub!() in Julia when it is called with f_max. The irfft
+        and the DC correction cost the same for any band. Use band_tradeoff()
+        to measure accuracy and speed for different bands.
+        
+        Parameters: f_max, float (optional)
+                      Maximum frequency to keep in Hz
+                    fmask, numpy.ndarray (optional)
+                      Boolean mask. Keep frequencies where it is True. It is indexed
+                      like freq.
+        """
+        keep = np.ones(len(self.freq), dtype=bool)
+        if f_max is not None:
+            keep &= (self.freq <= f_max)
+        if fmask is not None:
+            keep &= np.asarray(fmask, dtype=bool)
+        sel = _as_slice(np.flatnonzero(keep))
+        self.kidx = self.kidx[sel]
+        self.freq = self.freq[sel]
+        self.α    = self.α[:,sel]
+        self.β    = self.β[:,sel]
+        if self.engine == 'dense':
+            self.incft = self.incft[sel] # A view if sel is a slice
+        else:
+            self.ift = self.ift.subset(sel)
+            self.operator_shared = False
+        
+        # Remember which rows of the full operator are kept
+        if self.band is None:
+            self.band = sel
+        else:
+            self.band = _as_slice(np.arange(self._nfreq_full())[self.band][sel])
+        
+    def _nfreq_full(self):
+        # Number of frequencies before restrict()
+        return(len(sirs_freq_index(self.ysize, self.nstep)))
+        
+    def _fmask(self):
+        # restrict() mask reproducing the present band, or None
+        if self.band is None:
+            return(None)
+        fmask = np.zeros(self._nfreq_full(), dtype=bool)
+        fmask[self.band] = True
+        return(fmask)
+        
+    def window(self, y0=0, y1=None, nout=None, nroh=None):
+        """
+        A SIRS object for a row window (subarray) readout, or a readout
+        using fewer outputs, derived from this full frame one
+        
+        Each output of the window is read for ny = y1-y0 rows of xsize+nroh
+        time steps, where xsize = naxis1/nout. The derived object has an
+        incomplete Fourier transform and irfft sized to this time series, so
+        correcting a window costs about ny/naxis2 as much as a full frame. Its
+        α and β are interpolated in frequency from this object's, since they
+        are transfer functions of frequency. Frequencies outside the calibrated
+        range (e.g. with a shorter nroh) are not corrected. This is an
+        approximation. Weights calibrated in the readout mode itself are better.
+        
+        With fewer outputs, each output is read by the amplifier of the first
+        full frame output it covers, and takes its α and β. β is shifted in phase
+        when the right reference columns are read at the end of each row
+        instead of the start. The reference columns then sample a smaller
+        fraction of each output's time series, which the full frame weights do
+        not account for, so this is a coarser approximation. On synthetic H1RG
+        data, the CDS noise left after the reference row correction alone
+        (11.3 DN with 4 outputs, 11.5 DN with 1) fell to 10.4 and 11.0 DN,
+        against 9.9 and 9.8 DN with weights calibrated for those readouts.
+        
+        The DC correction uses the reference rows in the window: the same rows
+        as for full frames if the window has them, otherwise the bottom reference
+        rows it has, or failing those the top ones. A window without reference
+        rows gets no DC correction.
+        Reference row weights (w) are not used. A refmask and pplfix1 are
+        cropped to the window.
+        
+        Derived objects are cached, so asking again for the same window costs
+        nothing. They share this object's FFT backend and profiler. The full
+        frame returns this object.
+        
+        Parameters: y0, y1, int (optional)
+                      Full frame rows y0 ≤ y < y1 are read. The default is all rows.
+                      Windows are full width, so they include both sets of reference
+                      columns.
+                    nout, int (optional)
+                      Number of outputs. It must divide this object's. The default is
+                      the same number.
+                    nroh, int (optional)
+                      New row overhead in pixels. The default is the same.
+        Returns:
+          * The derived SIRS object. Its naxis2 is y1-y0. Correct (frames, y1-y0, naxis1)
+            windows with its refcor() or refcor_frame().
+        """
+        if self.window_key is not None:
+            raise ValueError('window() needs a full frame SIRS object')
+        y1 = int(self.naxis2 if y1 is None else y1)
+        nout = int(self.nout if nout is None else nout)
+        nroh = int(self.nroh if nroh is None else nroh)
+        key = (int(y0), y1, nout, nroh)
+        if key == (0, self.naxis2, self.nout, self.nroh):
+            return(self) # The full frame
+        if key in self._windows:
+            return(self._windows[key])
+        if not (0 <= y0 < y1 <= self.naxis2):
+            raise ValueError('need 0 ≤ y0 < y1 ≤ {}'.format(self.naxis2))
+        if (nout < 1) or (self.nout % nout != 0):
+            raise ValueError('nout must divide {}'.format(self.nout))
+        ny, xsize, m = y1-y0, self.naxis1//nout, self.nout//nout
+        if (xsize % 2 != 0) or (ny*self.RB < 2):
+            raise ValueError('window is too small')
+        
+        # Window frequencies
+        τ = self.kidx[-1] / (self.nstep*self.freq[-1]) # Pixel dwell time
+        nstep = (xsize+nroh)*ny
+        kidx = sirs_freq_index(ny, nstep)
+        freq = kidx / (nstep*τ)
+        
+        # Interpolate α and β over the low and high frequency segments separately
+        α, β = (np.zeros((self.nout,len(kidx)), dtype=np.complex128) for i in range(2))
+        for seg, seg_w in ((self.freq < .25/τ, freq < .25/τ), (self.freq >= .25/τ, freq >= .25/τ)):
+            if np.sum(seg) < 2:
+                continue
+            for a, a_w in ((self.α, α), (self.β, β)):
+                for op in np.arange(self.nout):
+                    a_w[op,seg_w] = np.interp(freq[seg_w], self.freq[seg], a[op,seg].real, left=0, right=0) +\
+                                    1j*np.interp(freq[seg_w], self.freq[seg], a[op,seg].imag, left=0, right=0)
+        if m > 1:
+            # Fewer outputs. Output op is read by full frame output op*m's amplifier,
+            # so it takes that output's weights.
+            α, β = α[::m], β[::m]
+            if nout % 2 == 1:
+                β *= np.exp(-2j*np.pi*kidx*(xsize-self.RB)/nstep) # Right refcols at the end of each row
+        α[:,0], β[:,0] = 0, 0
+        
+        # Derive the object
+        sirs = copy.copy(self)
+        sirs.__dict__.pop('_shared', None) # Never close this object's shared memory
+        sirs.__dict__.pop('incft', None)
+        sirs.__dict__.pop('ift', None)
+        sirs.load, sirs.operator_shared, sirs.band = 'memory', False, None
+        sirs.naxis2, sirs.nout, sirs.nroh, sirs.xsize, sirs.ysize = np.int64((ny, nout, nroh, xsize, ny))
+        sirs.nstep, sirs.kidx, sirs.freq = np.int64(nstep), kidx, freq
+        sirs.α, sirs.β = α.astype(self.cdtype), β.astype(self.cdtype)
+        sirs.w = None
+        ift = IncompleteFT(ny, xsize, nroh, rb=self.RB).astype(self.cdtype)
+        if self.engine == 'fft':
+            sirs.ift = ift
+        else:
+            sirs.incft = ift.matrix()
+        sirs.y0, sirs.window_key, sirs._windows = key[0], key, {}
+        sirs._regular = (slice(max(self.RB-y0, 0), max(min(int(self.naxis2)-self.RB, y1)-y0, 0)), self._regular[1])
+        sirs._parent_fmask = self._fmask()
+        
+        # DC correction rows. These must be one contiguous block of reference rows.
+        bottom = np.arange(max(y0, 0), min(y1, self.RB))
+        top = np.arange(max(y0, self.naxis2-self.RB), min(y1, self.naxis2))
+        sirs.rowslim = None
+        if (self.rowslim[0] >= y0) and (self.rowslim[1] < y1):
+            sirs.rowslim = (self.rowslim[0]-y0, self.rowslim[1]-y0)
+        elif len(bottom) > 0:
+            sirs.rowslim = (int(bottom[0])-y0, int(bottom[-1])-y0)
+        elif len(top) > 0:
+            sirs.rowslim = (int(top[0])-y0, int(top[-1])-y0)
+        if sirs.rowslim is not None:
+            sirs.discard = int(.005 * (sirs.rowslim[1]-sirs.rowslim[0]+1) * xsize)
+        
+        # Reference pixel repair
+        sirs._ppl = None
+        sirs.set_refmask(None if self.refmask is None else self.refmask[y0:y1], sg_repair=self.sg_repair)
+        
+        # Keep only the frequencies that the parent corrects
+        if self.band is not None:
+            sirs.restrict(fmask=np.any(α != 0, axis=0) | np.any(β != 0, axis=0))
+        sirs.fft.plan('irfft', sirs.nstep, np.complex64)
+        if sirs.engine == 'fft':
+            sirs.fft.plan('fft', sirs.ysize, sirs.cdtype, batch=(2,sirs.RB), axis=-2)
+        self._windows[key] = sirs
+        return(sirs)
+        
+    def band_tradeoff(self, D, f_maxs, **kwargs):
+        """
+        Measure the accuracy/speed tradeoff of band-limited correction
+        
+        Accuracy is measured on the correlated double sample (CDS) differences
+        of consecutive frames, in the regular pixels, where the bias and
+        reference pixels do not mask the noise that is left uncorrected.
+        
+        Parameters: D, Datacube
+                      A representative datacube with at least 2 frames. It is not modified.
+                    f_maxs, list of float
+                      Values of f_max to try in Hz
+                    kwargs
+                      Passed to refcor()
+        Returns: list of dict, one for the present band and one for each f_max
+          * f_max: Maximum frequency in Hz (None for the present band)
+          * nfreq: Number of frequencies corrected
+          * seconds: Time to correct D
+          * noise: Standard deviation of the CDS differences after correction, in
+            the units of D
+          * rms, max: RMS and maximum absolute difference of the CDS differences
+            from those when correcting the present band
+        """
+        if D.shape[0] < 2:
+            raise ValueError('band_tradeoff() needs at least 2 frames')
+        full = np.array(D, dtype=self.precision)
+        t0 = time.perf_counter()
+        self.refcor(full, **kwargs)
+        seconds = time.perf_counter() - t0
+        full = self._cds(full)
+        results = [{'f_max':None, 'nfreq':len(self.freq), 'seconds':seconds,
+                    'noise':float(np.std(full, dtype=np.float64)), 'rms':0.0, 'max':0.0}]
+        for f_max in f_maxs:
+            sirs = copy.copy(self)
+            sirs._windows = {} # Windows of the copy are for its band
+            sirs.restrict(f_max=f_max)
+            _D = np.array(D, dtype=self.precision)
+            t0 = time.perf_counter()
+            sirs.refcor(_D, **kwargs)
+            seconds = time.perf_counter() - t0
+            _D = self._cds(_D)
+            noise = float(np.std(_D, dtype=np.float64))
+            _D -= full
+            results.append({'f_max':f_max, 'nfreq':len(sirs.freq), 'seconds':seconds, 'noise':noise,
+                            'rms':float(np.sqrt(np.mean(_D**2, dtype=np.float64))),
+                            'max':float(np.max(np.abs(_D)))})
+        return(results)
+        
+    def _cds(self, D):
+        # CDS differences of consecutive frames, in the regular pixels
+        rows, cols = self._regular
+        return(D[1:,rows,cols] - D[:-1,rows,cols])
+        
+    def compare_precision(self, D, **kwargs):
+        """
+        Compare single and double precision correction of a datacube
+        
+        A SIRS object of the other precision is loaded from the same weights
+        file, with the same engine, FFT backend, band and window, and both correct D.
+        The differences should be well below the read noise.
+        
+        Parameters: D, Datacube
+                      A representative datacube. It is not modified.
+                    kwargs
+                      Passed to refcor()
+        Returns: dict
+          * seconds32, seconds64: Time to correct D in single and double precision
+          * rms, max: RMS and maximum absolute difference between the two over whole
+            frames, in the units of D
+          * rms_regular, max_regular: The same over the regular pixels only. These are what
+            matter for science, and should be compared with the read noise.
+        """
+        other = 'float64' if self.precision == np.float32 else 'float32'
+        fmask = self._fmask() if self.window_key is None else self._parent_fmask
+        full = SIRS(self.sirs_file, engine=self.engine, fmask=fmask, fft_backend=self.fft, precision=other,
+                    row_weights=self.w is not None, refmask=self.refmask, sg_repair=self.sg_repair)
+        sirs = {self.precision.name:self, other:full}
+        if self.window_key is not None:
+            sirs[other] = full.window(*self.window_key)
+        results = {}
+        for precision in ('float32', 'float64'):
+            _D = np.array(D, dtype=precision)
+            t0 = time.perf_counter()
+            sirs[precision].refcor(_D, **kwargs)
+            results['seconds'+precision[-2:]] = time.perf_counter() - t0
+            results[precision] = _D
+        full.close()
+        Δ = results.pop('float64') - results.pop('float32')
+        rows, cols = self._regular
+        for suffix, δ in (('', Δ), ('_regular', Δ[:,rows,cols])):
+            results.update({'rms'+suffix:float(np.sqrt(np.mean(δ**2, dtype=np.float64))),
+                            'max'+suffix:float(np.max(np.abs(δ)))})
+        return(results)
+        
+    def _set_operator(self, operator):
+        """
+        Use a prebuilt incomplete Fourier transform operator
+        
+        Parameters: operator, IncompleteFT or numpy.ndarray
+                      The operator. See __init__().
+        """
+        nfreq = len(self.freq)
+        if self.engine == 'fft':
+            if (operator.ysize, operator.xsize, operator.nroh, operator.rb, len(operator.k)) !=\
+               (self.ysize, self.xsize, self.nroh, self.RB, nfreq):
+                raise ValueError('operator does not match the readout geometry of ' + self.sirs_file)
+            self.ift = operator.astype(self.cdtype)
+        else:
+            if operator.shape != (nfreq, self.ysize*self.RB):
+                raise ValueError('operator does not match the readout geometry of ' + self.sirs_file)
+            self.incft = operator.astype(self.cdtype, copy=False)
+        
+        # A private copy in the other precision is no longer shared
+        if (self.ift if self.engine == 'fft' else self.incft) is not operator:
+            self.operator_shared = False
+        
+    def _load_incft(self, dset):
+        """
+        Load the incft matrix as requested by self.load
+        
+        Parameters: dset, h5py.Dataset
+                      The incft dataset
+        """
+        if self.load == 'memory':
+            return(dset.astype(self.cdtype)[...])
+        elif self.load == 'mmap':
+            incft = mmap_dataset(self.sirs_file, dset)
+            self._incft_map = (incft.filename, incft.offset, incft.dtype, incft.shape)
+            return(incft)
+        self._shared = SharedArray(dset.astype(self.cdtype)[...])
+        return(self._shared.array)
+        
+    def _build_incft(self, operator_cache):
+        """
+        Regenerate the incft matrix as requested by self.load
+        
+        Parameters: operator_cache, string
+                      Operator cache directory, or None
+        """
+        incft = operator(self.ysize, self.xsize, self.nroh, rb=self.RB,
+                         cache_dir=operator_cache, mmap=(self.load == 'mmap')).astype(self.cdtype, copy=False)
+        if self.load == 'shm':
+            self._shared = SharedArray(incft)
+            return(self._shared.array)
+        if self.load == 'mmap':
+            self._incft_map = (incft.filename, incft.offset, incft.dtype, incft.shape)
+        return(incft)
+        
+    def __getstate__(self):
+        # In the shared loading modes, only send a handle to incft
+        state = self.__dict__.copy()
+        state['profiler'] = None # Measurements made elsewhere would not come back
+        state['_windows'] = {}   # Derived again where needed
+        if (self.load != 'memory') and ('incft' in state) and not self.operator_shared:
+            state['incft'] = None
+        return(state)
+    
+    def __setstate__(self, state):
+        t0 = time.perf_counter()
+        self.__dict__.update(state)
+        if self.__dict__.get('incft', 1) is None:
+            if self.load == 'mmap':
+                filename, offset, dtype, shape = self._incft_map
+                self.incft = np.memmap(filename, mode='r', dtype=dtype, offset=offset, shape=shape)
+            else:
+                self.incft = self._shared.array
+            if self.band is not None:
+                self.incft = self.incft[self.band]
+        self.attach_time = time.perf_counter() - t0
+        
+    def memory_report(self):
+        """
+        Report how this SIRS object holds its weights in memory
+        
+        Returns: dict
+          * load: The loading mode
+          * attach_time: Seconds it took to load (or, after unpickling, attach to) the weights
+          * private_bytes: Bytes of arrays held privately by this SIRS object
+          * shared_bytes: Bytes of arrays held in a buffer shared with other processes
+            or other SIRS objects
+          * rss, rss_anon, rss_file, rss_shmem, rss_peak: This process's resident memory in bytes
+            (total, private, file-backed and shared memory). Linux only.
+        """
+        private_bytes, shared_bytes = self._nbytes()
+        report = {'load':self.load, 'attach_time':self.attach_time,
+                  'private_bytes':private_bytes, 'shared_bytes':shared_bytes}
+        report.update(process_memory())
+        return(report)
+    
+    def _nbytes(self):
+        """
+        Bytes of arrays held privately and held in shared buffers
+        """
+        private_bytes, shared_bytes = 0, 0
+        for name, a in self.__dict__.items():
+            if not isinstance(a, np.ndarray):
+                continue
+            if (name == 'incft') and ((self.load != 'memory') or self.operator_shared) and\
+               not isinstance(self.band, np.ndarray):
+                shared_bytes += a.nbytes
+            else:
+                private_bytes += a.nbytes
+        if self.engine == 'fft':
+            if self.operator_shared:
+                shared_bytes += self.ift.nbytes
+            else:
+                private_bytes += self.ift.nbytes
+        return(private_bytes, shared_bytes)
+    
+    def close(self):
+        """
+        Release shared weights. In 'shm' mode, the process that loaded the
+        weights file also frees the shared memory block.
+        """
+        if hasattr(self, '_shared'):
+            self.incft = None
+            self._shared.close()
         
     def plot(self, op, title="", mag=1.0):
         """
@@ -120,10 +701,12 @@ class SIRS():
         Parameters: d, Data vector
                       The input data vector
         """
+        if self.engine == 'fft':
+            return(self.ift.transform(d))
         return(np.matmul(self.incft, d))
         
         
-    def refcor(self, D, pplfix1=False, rowsonly=False):
+    def refcor(self, D, pplfix1=False, rowsonly=False, batch=False, max_frames=None, workers=None):
         """
         SIRS reference correction
         
@@ -131,89 +714,429 @@ class SIRS():
                       The input datacube
                     pplfix1, Bool
                       The PPL detector has some bad reference pixels. Interpolate over them.
+                      This is in addition to any repair set by set_refmask().
                     rowsonly, False
                       Optionally do a rowsonly correction. This uses the most stable reference
                       rows only. This is useful for studying the effect of SIRS.
+                    batch, Bool
+                      Correct many frames at once. The reference columns of all frames
+                      are projected into Fourier space with one matrix-matrix product, the
+                      (frames x outputs) spectra are built in one array, and they are
+                      inverted with one irfft. The result agrees with the default
+                      frame-by-frame path to within rounding. With the dense engine, the
+                      matrix-matrix product may round differently from the frame by frame
+                      matrix-vector products, by ~1e-15 relative.
+                    max_frames, int
+                      In batch mode, the maximum number of frames in flight at once. Each
+                      frame needs about 12*nout*nstep bytes of workspace (~220 MB for a
+                      32 output H4RG). The default is all frames.
+                    workers, int
+                      Number of threads. Frame by frame, the outputs of each frame are
+                      corrected in parallel, like the Julia sirssub!(). In batch and rowsonly
+                      modes, groups of frames are corrected in parallel. Each thread writes
+                      its own part of D, so the result does not depend on workers (in batch
+                      mode, to within rounding; see above). While
+                      threads run, BLAS is limited to cpu_count()//workers threads each (this
+                      needs threadpoolctl). See thread_scaling().
         Notes:
           * This method overwrites the input data
+          * With precision='float32', D must be float32
+          * With a Profiler, each call is profiled stage by stage. See set_profiler().
+        """
+        self._check_dtype(D.dtype)
+        with call(self.profiler, 'refcor'):
+            if (workers is not None) and (workers > 1):
+                with thread_pool(workers, self.profiler) as pool:
+                    return(self._refcor(D, pplfix1, rowsonly, batch, max_frames, workers, pool))
+            return(self._refcor(D, pplfix1, rowsonly, batch, max_frames))
+        
+    def _refcor(self, D, pplfix1, rowsonly, batch, max_frames, workers=1, pool=None):
+        """
+        SIRS reference correction. See refcor().
         """
         nframes = D.shape[0] # Number of frames to correct
         
+        # A rows only correction needs no Fourier work. Do all frames at once.
+        if rowsonly == True:
+            self._repair(D, 0, nframes, pplfix1)
+            if pool is None:
+                self._dc_correct(D, 0, nframes)
+            else:
+                wait(pool.map(lambda z: self._dc_correct(D, z[0], z[1]), split(0, nframes, workers)))
+            return
+        
+        # Batch mode works in groups of frames
+        if batch == True:
+            if max_frames is None:
+                max_frames = nframes
+            for z0 in np.arange(0, nframes, max_frames):
+                z1 = min(z0+max_frames, nframes)
+                if pool is None:
+                    self._refcor_batch(D, z0, z1, pplfix1=pplfix1)
+                else:
+                    wait(pool.map(lambda z: self._refcor_batch(D, z[0], z[1], pplfix1=pplfix1),
+                                  split(z0, z1, workers)))
+            return
+        
         # Work frame-by-frame...
         for z in np.arange(nframes):
             
+            # Deal with bad reference pixels
+            self._repair(D, z, z+1, pplfix1)
+            
             # Pick off reference columns
             l = D[z,:,:self.RB]
             r = D[z,:,-self.RB:]
-            
-            # Deal with bad reference pixels in the JPL PPL detector
-            if pplfix1==True:
-                x = np.arange(4096) # All possible row indices
-                px = (x<1870) | (x>2224) # Bool
-                _x = x[px]
-                for col in np.arange(4):                
-                    _y = r[px,col]
-                    spl = interpolate.interp1d(_x, _y, kind='linear')
-                    r[np.logical_not(px),col] = spl(x[np.logical_not(px)])
                 
             # Go to Fourier space
-            𝓵 = self.incomplete_ft(l.flatten()) # Project left refcols into Fourier space
-            𝓻 = self.incomplete_ft(r.flatten()) # Project right refcols...
+            𝓵 = self._project(l.flatten()) # Project left refcols into Fourier space
+            𝓻 = self._project(r.flatten()) # Project right refcols...
                         
             # Work output by output...
-            for op in np.arange(self.nout):
+            if pool is None:
+                for op in np.arange(self.nout):
+                    self._correct_output(D[z], op, 𝓵, 𝓻)
+            else:
+                wait(pool.map(lambda op: self._correct_output(D[z], op, 𝓵, 𝓻), np.arange(self.nout)))
                 
-                # We need the range of columns for this output
-                x0 = op*self.xsize
-                x1 = x0 + self.xsize
-
-                # Do SIRS unless disabled using rowsonly
-                if rowsonly == False:
+            # Correct DC using reference rows
+            self._dc_correct(D, z, z+1)
+                
+    def _correct_output(self, frame, op, 𝓵, 𝓻):
+        """
+        SIRS reference correct one output of one frame
         
-                    # Work out reference correction for this output
-                    ref = np.zeros(self.nstep//2+1, dtype=np.complex64) # Build full rfft here
+        Parameters: frame, numpy.ndarray
+                      One frame. It is overwritten.
+                    op, int
+                      Output number
+                    𝓵, 𝓻, numpy.ndarray
+                      Incomplete Fourier transforms of the frame's reference columns
+        """
+        
+        # We need the range of columns for this output
+        x0 = op*self.xsize
+        x1 = x0 + self.xsize
 
-                    # Low frequencies
-                    ref[:self.ysize//2+1] = self.α[op,:self.ysize//2+1]*𝓵[:self.ysize//2+1] +\
-                                            self.β[op,:self.ysize//2+1]*𝓻[:self.ysize//2+1]
+        # Work out reference correction for this output
+        with stage(self.profiler, 'spectrum'):
+            ref = np.zeros(self.nstep//2+1, dtype=np.complex64) # Build full rfft here
 
-                    # High frequencies
-                    ref[-self.ysize//2:] = self.α[op,-self.ysize//2:]*𝓵[-self.ysize//2:] +\
-                                           self.β[op,-self.ysize//2:]*𝓻[-self.ysize//2:]
+            # Low and high frequencies
+            ref[self.kidx] = self.α[op]*𝓵 + self.β[op]*𝓻
 
-                    # Invert the rfft
-                    ref = np.fft.irfft(ref, n=self.nstep)
+        # Invert the rfft
+        with stage(self.profiler, 'irfft'):
+            ref = self.fft.irfft(ref, n=self.nstep)
 
-                    # Reformat as 2D image
-                    ref = ref.reshape(self.ysize,self.xsize+self.nroh)
+        with stage(self.profiler, 'subtract'):
+            
+            # Reformat as 2D image
+            ref = ref.reshape(self.ysize,self.xsize+self.nroh)
 
-                    # Keep just real samples
-                    ref = ref[:,:self.xsize]
+            # Keep just real samples
+            ref = ref[:,:self.xsize]
 
-                    # Flip odd numbered outputs
-                    if np.mod(op,2)==1:
-                        ref = np.fliplr(ref)
+            # Flip odd numbered outputs
+            if np.mod(op,2)==1:
+                ref = np.fliplr(ref)
 
-                    # SIRS reference correct data
-                    D[z,:,x0:x1] -= ref
+            # SIRS reference correct data
+            frame[:,x0:x1] -= ref
+        
+    def thread_scaling(self, D, workers=None, repeat=1, **kwargs):
+        """
+        Measure how refcor() scales with the number of threads
+        
+        Parameters: D, Datacube
+                      A representative datacube. It is not modified.
+                    workers, list of int (optional)
+                      Numbers of threads to try. The default is 1, 2, 4, ... up to
+                      the number of CPUs.
+                    repeat, int (optional)
+                      Time each case this many times and keep the fastest
+                    kwargs
+                      Passed to refcor(), e.g. batch=True
+        Returns: list of dict, one per number of threads
+          * workers: Number of threads
+          * seconds: Time to correct D
+          * speedup: Speedup relative to the first case
+          * identical: True if the result is bit-identical to the first case
+        """
+        if workers is None:
+            workers = [2**i for i in np.arange(int(np.log2(os.cpu_count()))+1)]
+            if workers[-1] != os.cpu_count():
+                workers.append(os.cpu_count())
+        results, first = [], None
+        for n in workers:
+            seconds = np.inf
+            for i in np.arange(repeat):
+                _D = np.array(D, dtype=self.precision)
+                t0 = time.perf_counter()
+                self.refcor(_D, workers=n, **kwargs)
+                seconds = min(seconds, time.perf_counter()-t0)
+            if first is None:
+                first = (seconds, _D)
+            results.append({'workers':n, 'seconds':seconds, 'speedup':first[0]/seconds,
+                            'identical':bool(np.array_equal(_D, first[1]))})
+        return(results)
                 
-                # Correct DC using reference rows. Per a request from Chris Willott
-                # of Hertzberg Astrophysics, this now includes an alternating column
-                # noise (ACN) correction for the middle outputs. The first and last outputs do
-                # not require this because SIRS already applies an ACN correction.
-                if (op==0) or (op==self.nout-1):
-                    ref = np.mean(np.sort(D[z,self.rowslim[0]:self.rowslim[1]+1,
-                                        x0:x1].flatten())[self.discard:-self.discard])
-                    D[z,:,x0:x1] -= ref
+    def workspace(self, dtype=None):
+        """
+        Make a Workspace for refcor_frame()
+        
+        Parameters: dtype, numpy.dtype
+                      The dtype of the frames that will be corrected. The
+                      default is the precision of this SIRS object.
+        """
+        if dtype is None:
+            dtype = self.precision
+        self._check_dtype(dtype)
+        return(Workspace(self, dtype=dtype))
+        
+    def _check_dtype(self, dtype):
+        # In single precision, data must be single precision too
+        if (self.precision == np.float32) and (np.dtype(dtype) != np.float32):
+            raise ValueError("precision='float32' needs float32 data, not " + str(np.dtype(dtype)))
+        
+    def refcor_frame(self, frame, workspace, rowsonly=False, pplfix1=False):
+        """
+        SIRS reference correct one frame in place
+        
+        This is for correcting frames as they arrive. All temporaries live in
+        the workspace, so no arrays are allocated. The result is the same as
+        refcor() gives for the same frame. With the default FFT backend, this
+        requires numpy >= 2.0 (out= in np.fft). The 'scipy' backend cannot
+        transform into out=, so it allocates (see Workspace).
+        
+        Parameters: frame, numpy.ndarray
+                      One (naxis2, naxis1) frame. It is overwritten.
+                    workspace, Workspace
+                      From workspace(). Its dtype must match the frame's.
+                    rowsonly, pplfix1, Bool
+                      See refcor(). Reference pixel repair (pplfix1 or set_refmask())
+                      makes a few small temporaries.
+        """
+        ws = workspace
+        if (ws.sirs is not self) or (frame.shape != ws.shape) or (frame.dtype != ws.dtype):
+            raise ValueError('workspace does not match this SIRS object and frame')
+        with call(self.profiler, 'refcor_frame'):
+            self._refcor_frame(frame, ws, rowsonly, pplfix1)
+        
+    def _refcor_frame(self, frame, ws, rowsonly, pplfix1):
+        """
+        SIRS reference correct one frame in place. See refcor_frame().
+        """
+        self._repair(frame[np.newaxis], 0, 1, pplfix1)
+        
+        if rowsonly == False:
+            
+            # Go to Fourier space
+            with stage(self.profiler, 'incomplete_ft'):
+                np.copyto(ws.refcols_2d[0], frame[:,:self.RB])
+                np.copyto(ws.refcols_2d[1], frame[:,-self.RB:])
+                if self.engine == 'fft':
+                    self.ift.transform(ws.refcols, out=ws.refcols_ft, work=ws.ift_work, backend=self.fft)
                 else:
-                    # Discard only half as many since we are working only with evens or odds
-                    _discard = np.int(np.round(self.discard/2))
-                    # Evens
-                    ref = np.mean(np.sort(D[z,self.rowslim[0]:self.rowslim[1]+1,
-                                        x0:x1:2].flatten())[_discard:-_discard])
-                    D[z,:,x0:x1:2] -= ref
-                    # Odds
-                    ref = np.mean(np.sort(D[z,self.rowslim[0]:self.rowslim[1]+1,
-                                        x0+1:x1:2].flatten())[_discard:-_discard])
-                    D[z,:,x0+1:x1:2] -= ref
+                    np.matmul(self.incft, ws.refcols[0], out=ws.refcols_ft[0]) # As in refcor()
+                    np.matmul(self.incft, ws.refcols[1], out=ws.refcols_ft[1])
+            𝓵, 𝓻 = ws.refcols_ft
+            
+            # Work output by output...
+            for op in np.arange(self.nout):
+                
+                # Build the rfft of the correction for this output
+                with stage(self.profiler, 'spectrum'):
+                    for fs, ks in ws.segments:
+                        np.multiply(self.α[op,fs], 𝓵[fs], out=ws.t1[fs])
+                        np.multiply(self.β[op,fs], 𝓻[fs], out=ws.t2[fs])
+                        np.add(ws.t1[fs], ws.t2[fs], out=ws.spec[ks])
                 
+                # Invert it, flip odd numbered outputs, and reference correct
+                with stage(self.profiler, 'irfft'):
+                    self.fft.irfft(ws.spec, n=self.nstep, out=ws.ref)
+                with stage(self.profiler, 'subtract'):
+                    x0 = op*self.xsize
+                    x1 = x0 + self.xsize
+                    if np.mod(op,2)==1:
+                        np.subtract(frame[:,x0:x1], ws.ref_flip, out=frame[:,x0:x1])
+                    else:
+                        np.subtract(frame[:,x0:x1], ws.ref_real, out=frame[:,x0:x1])
+        
+        # Correct DC using reference rows. This follows _dc_correct().
+        if self.rowslim is None:
+            return
+        with stage(self.profiler, 'dc'):
+            if self.w is not None:
+                np.copyto(ws.refrows_4d[:self.RB], frame[:self.RB].reshape(self.RB,self.nout,self.xsize))
+                np.copyto(ws.refrows_4d[self.RB:], frame[-self.RB:].reshape(self.RB,self.nout,self.xsize))
+                np.einsum('ok,ok->o', ws.refrows, self.w, out=ws.μ_w)
+                np.copyto(ws.offset_w, ws.μ_w[:,np.newaxis])
+                np.subtract(frame, ws.offset, out=frame)
+                return
+            rows = frame[self.rowslim[0]:self.rowslim[1]+1,:].reshape(-1,self.nout,self.xsize//2,2)
+            np.copyto(ws.middle_rows, rows.transpose(1,3,0,2))
+            _trimmed_mean_into(ws.middle_flat, int(np.round(self.discard/2)), ws.μ)
+            for i, op in enumerate(ws.edge):
+                np.copyto(ws.edge_rows[i], rows[:,op])
+            _trimmed_mean_into(ws.edge_flat, self.discard, ws.μ_edge)
+            for i, op in enumerate(ws.edge):
+                ws.μ[op] = ws.μ_edge[i]
+            np.copyto(ws.offset_3d, ws.μ[:,np.newaxis,:])
+            np.subtract(frame, ws.offset, out=frame)
+        
+    def _refcor_batch(self, D, z0, z1, pplfix1=False):
+        """
+        Batch mode SIRS reference correction of frames z0 ≤ z < z1.
+        See refcor().
+        """
+        nz = z1 - z0 # Number of frames in this batch
+        
+        # Deal with bad reference pixels
+        self._repair(D, z0, z1, pplfix1)
+        
+        # Stack left and right reference columns for all frames
+        # and project them into Fourier space together
+        lr = np.concatenate((D[z0:z1,:,:self.RB].reshape(nz,-1),
+                             D[z0:z1,:,-self.RB:].reshape(nz,-1)))
+        𝓵𝓻 = self._project(lr)
+        𝓵 = 𝓵𝓻[:nz,np.newaxis,:] # Broadcast over outputs
+        𝓻 = 𝓵𝓻[nz:,np.newaxis,:]
+        
+        # Build the (frames x outputs) rffts
+        with stage(self.profiler, 'spectrum'):
+            ref = np.zeros((nz,self.nout,self.nstep//2+1), dtype=np.complex64)
+            ref[:,:,self.kidx] = self.α*𝓵 + self.β*𝓻
+        
+        # Invert them all at once and keep just real samples
+        with stage(self.profiler, 'irfft'):
+            ref = self.fft.irfft(ref, n=self.nstep, axis=-1)
+        ref = ref.reshape(nz,self.nout,self.ysize,self.xsize+self.nroh)[:,:,:,:self.xsize]
+        
+        # SIRS reference correct data, flipping odd numbered outputs
+        with stage(self.profiler, 'subtract'):
+            for op in np.arange(self.nout):
+                x0 = op*self.xsize
+                x1 = x0 + self.xsize
+                if np.mod(op,2)==1:
+                    D[z0:z1,:,x0:x1] -= ref[:,op,:,::-1]
+                else:
+                    D[z0:z1,:,x0:x1] -= ref[:,op]
+        
+        # Correct DC using reference rows
+        self._dc_correct(D, z0, z1)
+                
+    def _project(self, lr):
+        """
+        Project reference columns into Fourier space
+        
+        Parameters: lr, numpy.ndarray
+                      Reference columns. One flattened set of left or right
+                      reference columns, or one such set per row.
+        Returns:
+          * The incomplete Fourier transform of each set. With the dense
+            engine, one set is a matrix-vector product, as in the original
+            frame by frame refcor(). Many sets are one matrix-matrix product,
+            which BLAS may round differently, by ~1e-15 relative.
+        """
+        with stage(self.profiler, 'incomplete_ft'):
+            if self.engine == 'fft':
+                return(self.ift.transform(lr, backend=self.fft))
+            if lr.ndim == 1:
+                return(np.matmul(self.incft, lr))
+            return(np.matmul(lr, self.incft.T))
+    
+    def _dc_correct(self, D, z0, z1):
+        """
+        Correct DC using reference rows. Per a request from Chris Willott
+        of Hertzberg Astrophysics, this now includes an alternating column
+        noise (ACN) correction for the middle outputs. The first and last outputs do
+        not require this because SIRS already applies an ACN correction.
+        
+        All outputs and frames are done at once. The robust (trimmed) means use
+        partial selection instead of sorting, and the offsets are applied with
+        one broadcasted subtraction.
+        
+        If the weights file holds reference row weights (w), each output's offset
+        is instead w·(its reference rows). See RowsSol.py.
+        
+        Parameters: D, Datacube
+                      The datacube being corrected. It is overwritten.
+                    z0, z1, int
+                      Correct frames z0 ≤ z < z1
+        """
+        if self.rowslim is None:
+            return # A window without reference rows
+        with stage(self.profiler, 'dc'):
+            nz = z1 - z0 # Number of frames
+            
+            # Weighted reference rows
+            if self.w is not None:
+                μ = np.einsum('zok,ok->zo', _refrows(D[z0:z1], self.RB, self.nout, self.xsize), self.w)
+                D[z0:z1] -= np.repeat(μ, self.xsize, axis=1)[:,np.newaxis,:]
+                return
+        
+            # Reference rows as (frames, rows, outputs, column pairs, even/odd)
+            rows = D[z0:z1,self.rowslim[0]:self.rowslim[1]+1,:].reshape(nz,-1,self.nout,self.xsize//2,2)
+        
+            # Middle outputs. Treat even and odd columns separately to suppress ACN.
+            # Discard only half as many since we are working only with evens or odds.
+            μ = _trimmed_mean(rows.transpose(0,2,4,1,3).reshape(nz,self.nout,2,-1),
+                              int(np.round(self.discard/2)))
+        
+            # First and last outputs use all columns
+            edge = np.unique([0, self.nout-1])
+            μ[:,edge,:] = _trimmed_mean(rows[:,:,edge].transpose(0,2,1,3,4).reshape(nz,len(edge),-1),
+                                        self.discard)[:,:,np.newaxis]
+        
+            # Subtract
+            D[z0:z1] -= np.broadcast_to(μ[:,:,np.newaxis,:],
+                                        (nz,self.nout,self.xsize//2,2)).reshape(nz,1,self.naxis1)
+
+
+def _trimmed_mean(a, discard):
+    """
+    Mean along the last axis after discarding the discard smallest and
+    discard largest values. Partial selection (np.partition) finds them
+    without a full sort.
+    """
+    n = a.shape[-1]
+    if discard > 0:
+        a = np.partition(a, (discard, n-discard-1), axis=-1)[...,discard:n-discard]
+    return(np.mean(a, axis=-1))
+
+
+def _trimmed_mean_into(a, discard, out):
+    """
+    In-place version of _trimmed_mean(). a is partitioned in place and
+    the result goes in out.
+    """
+    n = a.shape[-1]
+    if discard > 0:
+        a.partition((discard, n-discard-1), axis=-1)
+    np.mean(a[...,discard:n-discard], axis=-1, out=out)
+
+
+def _refrows(D, rb, nout, xsize):
+    """
+    Reference rows of each output of each frame, bottom then top, as used by
+    the reference row weights w. See RowsSol.py.
+    
+    Parameters: D, numpy.ndarray
+                  (frames, naxis2, naxis1) datacube
+    Returns:
+      * (frames, nout, 2*rb*xsize) array
+    """
+    nz = D.shape[0]
+    rows = np.concatenate((D[:,:rb], D[:,-rb:]), axis=1) # (frames, 2*rb, naxis1)
+    return(rows.reshape(nz,2*rb,nout,xsize).transpose(0,2,1,3).reshape(nz,nout,-1))
+
+
+def _as_slice(idx):
+    """
+    Express sorted indices as a slice if they are contiguous. Slicing
+    keeps memory-mapped and shared arrays as views.
+    """
+    if (len(idx) > 0) and (idx[-1]-idx[0]+1 == len(idx)):
+        return(slice(int(idx[0]), int(idx[-1])+1))
+    return(idx)
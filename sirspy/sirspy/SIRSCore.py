@@ -0,0 +1,368 @@
+import h5py
+import numpy as np
+from .IncompleteFT import IncompleteFT, sirs_freq_index
+from .SIRS import SIRS, _trimmed_mean
+from .Weights import write_weights
+from .FFT import get_backend
+from .RefRepair import RefRepair, _sg_repair, TRIM_SOFT, PPL_BAD_ROWS
+
+# Thresholds for trimming off outliers on top and on bottom. These are
+# 1/2 the total amount to trim. They are the same as in SIRS.jl.
+TRIM_HARD = .05/2        # Leaves 95%
+TRIM_MED  = .01/2        # Leaves 99%
+
+# Output quality control. Frames of an output whose good regular pixels
+# have a standard deviation outside (GD_OP_SIG_MIN, GD_OP_SIG_MAX) DN are
+# not coadded. These are the values used for flight and JPL PPL detectors.
+GD_OP_SIG_MIN = 2.0
+GD_OP_SIG_MAX = 28.0
+
+# The Savitzky-Golay outlier repair of the reference columns, and the JPL
+# PPL detector's bad reference pixels, are in RefRepair.py.
+
+
+class SIRSCore():
+    """
+    Accumulate SIRS sums from up-the-ramp darks and solve for α and β
+
+    This is the python equivalent of SIRSCore.jl, coadd!(), solve!() and
+    export_to_sirspy(). coadd() works on all outputs and a group of frames at
+    once. Partial sums from different darks, processes or nodes can be
+    combined using merge(), or saved and restored, before solving.
+
+    Parameters: hxrg_kind, string
+                  Selected from {'h4rg','h2rg'}
+                nout, int
+                  Number of SCA outputs
+                nroh, int
+                  New row overhead in pixels
+                τ, float
+                  Pixel dwell time in seconds. For 200 kHz clocking, set τ=5.e-6.
+                  For 100 kHz clocking, set τ=10.e-6.
+                gdpx, numpy.ndarray (optional)
+                  The detector's (naxis2, naxis1) good pixel map. Good pixels are True.
+                  Reference pixels are always treated as good. The default is all good.
+                fft_backend, string or FFT.FFTBackend (optional)
+                  FFT library. See SIRS.
+                fft_workers, int (optional)
+                  Threads for each FFT, for the 'scipy' and 'fftw' backends
+
+    Example:
+      sc = sirspy.SIRSCore('h4rg', 32, 12, 5.e-6, gdpx=gdpx)
+      for file in files:
+          sc.coadd(read_dark(file))
+      sc.solve()
+      sc.export('weights.h5')
+    """
+    RB = SIRS.RB # Reference pixel border width
+
+    def __init__(self, hxrg_kind, nout, nroh, τ, gdpx=None, fft_backend=None, fft_workers=None):
+
+        # Definitions that depend on HxRG kind
+        if hxrg_kind == 'h4rg':
+            self.naxis1, self.naxis2 = 4096, 4096
+        elif hxrg_kind == 'h2rg':
+            self.naxis1, self.naxis2 = 2048, 2048
+        else:
+            raise ValueError("hxrg_kind must be 'h4rg' or 'h2rg'")
+        self.hxrg_kind = hxrg_kind
+        self.nout  = int(nout)                          # Number of outputs
+        self.nroh  = int(nroh)                          # New row overhead in pixels
+        self.τ     = float(τ)                           # Pixel dwell time in seconds
+        self.xsize = self.naxis1 // self.nout           # Columns per output
+        self.ysize = self.naxis2                        # Rows per output
+        self.nstep = (self.xsize+self.nroh)*self.ysize  # Time steps per output per frame
+        self.kidx  = sirs_freq_index(self.ysize, self.nstep) # Frequencies that SIRS keeps
+        self.freq  = np.fft.rfftfreq(self.nstep, self.τ)[self.kidx] # In Hz
+        self.ift   = IncompleteFT(self.ysize, self.xsize, self.nroh, rb=self.RB)
+        self.fft   = get_backend(fft_backend, workers=fft_workers)
+
+        # Good pixel map. Consider reference pixels to be good.
+        if gdpx is None:
+            gdpx = np.ones((self.naxis2,self.naxis1), dtype=bool)
+        gdpx = np.array(gdpx, dtype=bool)
+        if gdpx.shape != (self.naxis2,self.naxis1):
+            raise ValueError('gdpx must be {} x {}'.format(self.naxis2, self.naxis1))
+        rb = self.RB
+        gdpx[:rb,:], gdpx[-rb:,:], gdpx[:,:rb], gdpx[:,-rb:] = True, True, True, True
+        self.gdpx = gdpx
+
+        # Per output good pixel maps and regular pixel masks, flipping odd numbered
+        # outputs to follow the clocking pattern. Regular pixels in the first and last
+        # outputs exclude the reference columns, which are then on the left.
+        self._gdpx = self._outputs(gdpx[np.newaxis])[0] # (nout, ysize, xsize)
+        self._regpix = np.zeros((self.nout,self.ysize,self.xsize), dtype=bool)
+        self._regpix[:,rb:-rb,:] = True
+        self._regpix[np.unique([0,self.nout-1]),:,:rb] = False
+
+        # Group outputs having the same number of good regular pixels. Within a group,
+        # transients are found for all outputs and frames at once. These index the good
+        # regular pixels of each output in a raw frame.
+        col = np.arange(self.naxis1).reshape(self.nout,self.xsize)
+        col[1::2] = col[1::2,::-1]
+        pix = np.arange(self.ysize)[np.newaxis,:,np.newaxis]*self.naxis1 + col[:,np.newaxis,:]
+        good = self._gdpx & self._regpix
+        ngood = np.sum(good, axis=(1,2))
+        self._groups = []
+        for n in np.unique(ngood):
+            ops = np.flatnonzero(ngood == n)
+            self._groups.append((ops, np.stack([pix[op][good[op]] for op in ops])))
+
+        self.clear()
+
+    def clear(self):
+        """
+        Reset the SIRS sums to zero
+        """
+        # Python normalizes identifiers, so ℕ is the same as N, ℝ as R and so on.
+        # The f = 0 Hz sums are therefore called R0 and N0.
+        nk = len(self.kidx)
+        self.ℕ = np.zeros((self.nout,nk))                     # = Σ 𝓷 𝓷*
+        self.𝕃 = np.zeros((self.nout,nk))                     # = Σ 𝓵 𝓵*
+        self.ℝ = np.zeros((self.nout,nk))                     # = Σ 𝓻 𝓻*
+        self.𝕏 = np.zeros((self.nout,nk), dtype=np.complex128) # = Σ 𝓷 𝓻*
+        self.𝕐 = np.zeros((self.nout,nk), dtype=np.complex128) # = Σ 𝓷 𝓵*
+        self.ℤ = np.zeros((self.nout,nk), dtype=np.complex128) # = Σ 𝓻 𝓵*
+        self.R0 = np.zeros(self.nout)                         # = Σ (μ - mean(refrows)). R in Julia.
+        self.N0 = np.zeros(self.nout, dtype=np.int64)         # Frames coadded per output. N in Julia.
+        self.α = None
+        self.β = None
+
+    def coadd(self, D, pplfix1=False, max_frames=4, verbose=False):
+        """
+        Coadd an up-the-ramp sampled dark into the SIRS sums
+
+        Each frame and output is first DC corrected using reference rows,
+        and a straight line is fitted to each pixel and subtracted. The
+        reference columns are Savitzky-Golay filtered to repair transients.
+        In the regular pixels, transients are flagged, outputs having anomalous
+        noise are skipped, and bad pixels are filled with the mean of the good
+        pixels in the same row. Then the Fourier sums are accumulated.
+
+        Parameters: D, numpy.ndarray
+                      A float64 (naxis3, naxis2, naxis1) datacube. It is overwritten.
+                    pplfix1, Bool
+                      The JPL PPL detector has some bad reference pixels. Interpolate over them.
+                    max_frames, int
+                      Maximum number of frames to process at once. Each needs about
+                      40*nout*nstep bytes of workspace (~730 MB for a 32 output H4RG).
+                    verbose, Bool
+                      Print each frame and output that is skipped by quality control.
+                      Either way, N0 counts the frames coadded for each output.
+        """
+        naxis3 = D.shape[0] # Number of frames
+        if D.shape[1:] != (self.naxis2,self.naxis1):
+            raise ValueError('D must be naxis3 x {} x {}'.format(self.naxis2, self.naxis1))
+        if (D.dtype != np.float64) or not D.flags.c_contiguous:
+            raise ValueError('D must be a C-contiguous float64 array')
+
+        # DC correct each output using the most stable reference rows. JWST NIRCam
+        # seems to require this on account of the SIDECAR resets every frame.
+        rows = D[:,self.ysize-3:self.ysize-1].reshape(naxis3,2,self.nout,self.xsize)
+        μ = _trimmed_mean(rows.transpose(0,2,1,3).reshape(naxis3,self.nout,-1),
+                          int(TRIM_MED*rows.shape[1]*self.xsize))
+        D.reshape(naxis3,self.ysize,self.nout,self.xsize)[...] -= μ[:,np.newaxis,:,np.newaxis]
+
+        # Compute residuals by fitting and subtracting a straight line
+        x = np.linspace(-1, 1, naxis3)
+        L = np.polynomial.legendre.legvander(x, 1) # Legendre basis matrix
+        _D = D.reshape(naxis3,-1)
+        λ = np.matmul(np.linalg.pinv(L), _D)
+        for z0 in np.arange(0, naxis3, max_frames):
+            z1 = min(z0+max_frames, naxis3)
+            _D[z0:z1] -= np.matmul(L[z0:z1], λ)
+        del λ
+
+        # Coadd groups of frames
+        for z0 in np.arange(0, naxis3, max_frames):
+            self._coadd_frames(D[z0:min(z0+max_frames, naxis3)], z0, pplfix1=pplfix1, verbose=verbose)
+
+    def _coadd_frames(self, Δ, z0, pplfix1=False, verbose=False):
+        """
+        Coadd detrended frames. See coadd().
+
+        Parameters: Δ, numpy.ndarray
+                      Residuals of some frames. The reference columns may be overwritten.
+                    z0, int
+                      Number of the first frame. Only used for messages.
+                    pplfix1, verbose, Bool
+                      See coadd()
+        """
+        nz = Δ.shape[0] # Number of frames
+        rb, xsize, ysize, nout = self.RB, self.xsize, self.ysize, self.nout
+
+        # Linearly interpolate over the JPL PPL detector's bad reference pixels
+        if pplfix1 == True:
+            RefRepair.ppl(Δ.shape[1:], rb=rb).repair(Δ)
+
+        # Incomplete Fourier transforms of the reference columns, after repairing
+        # transients. The right columns are read out in reverse.
+        lr = np.stack((Δ[:,:,:rb].reshape(nz,-1), Δ[:,:,:-rb-1:-1].reshape(nz,-1)), axis=1)
+        _sg_repair(lr)
+        𝓵𝓻 = self.ift.transform(lr, backend=self.fft)
+        𝓵, 𝓻 = 𝓵𝓻[:,0], 𝓵𝓻[:,1]
+
+        # Find transients. These are the regular pixels in the top and bottom TRIM_HARD
+        # of each output's good regular pixels.
+        lo = np.full((nz,nout), -np.inf)
+        hi = np.full((nz,nout), +np.inf)
+        frames = Δ.reshape(nz,-1)
+        for ops, pix in self._groups:
+            nrej = int(np.round(TRIM_HARD*pix.shape[1])) # Number to trim on either side
+            if nrej > 0:
+                v = np.partition(frames[:,pix], (nrej-1, pix.shape[1]-nrej), axis=-1)
+                lo[:,ops], hi[:,ops] = v[...,nrej-1], v[...,pix.shape[1]-nrej]
+
+        # Get each output's data with room for the new row overhead, flipping odd
+        # numbered outputs
+        d = np.empty((nz,nout,ysize,xsize+self.nroh))
+        dx = d[...,:xsize] # Real pixels
+        _Δ = Δ.reshape(nz,ysize,nout,xsize).transpose(0,2,1,3)
+        dx[:,0::2] = _Δ[:,0::2]
+        dx[:,1::2] = _Δ[:,1::2,:,::-1]
+        gd = self._gdpx & ~(self._regpix & ((dx <= lo[:,:,np.newaxis,np.newaxis]) |
+                                            (dx >= hi[:,:,np.newaxis,np.newaxis])))
+
+        # Output level quality control. Find anomalous outputs and frames using
+        # the remaining good pixels away from the reference rows.
+        here, good = dx[:,:,rb:-rb], gd[:,:,rb:-rb]
+        n = np.sum(good, axis=(2,3))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            μ = np.sum(here, axis=(2,3), where=good)/n
+            σ = np.sqrt(np.sum((here-μ[:,:,np.newaxis,np.newaxis])**2, axis=(2,3), where=good)/(n-1))
+        ok = (GD_OP_SIG_MIN < σ) & (σ < GD_OP_SIG_MAX)
+        if verbose == True:
+            for z, op in np.argwhere(~ok):
+                print('Skipping frame', z0+z, 'output', op, 'σ =', σ[z,op])
+
+        # Robust mean reference row value. These rows tend to be the
+        # most indicative of the regular pixels in Roman H4RGs.
+        μ_refrows = _trimmed_mean(dx[:,:,ysize-3:ysize-1].reshape(nz,nout,-1),
+                                  int(TRIM_HARD*2*xsize))
+
+        # Replace bad pixels and transients with the mean of the good pixels
+        # in the same row. Rows without any good pixels get the output's mean.
+        n = np.sum(gd, axis=-1)
+        fill = np.where(n > 0, np.sum(dx, axis=-1, where=gd)/np.maximum(n, 1),
+                        μ[:,:,np.newaxis])
+        np.copyto(dx, fill[...,np.newaxis], where=~gd)
+
+        # Fill overhead columns by mirroring
+        d[...,xsize:] = d[...,xsize-self.nroh:xsize][...,::-1]
+
+        # Fourier transform and keep just the frequencies of interest. Zero out
+        # the outputs that failed quality control so that they are not coadded.
+        𝓷 = self.fft.rfft(d.reshape(nz,nout,-1), axis=-1)[...,self.kidx]
+        del d, gd
+        𝓷[~ok] = 0
+        w = ok.astype(np.float64)
+
+        # Coadd sums for frequencies > 0 Hz
+        self.ℕ += np.einsum('zok->ok', np.abs(𝓷)**2)
+        self.𝕃 += np.matmul(w.T, np.abs(𝓵)**2)
+        self.ℝ += np.matmul(w.T, np.abs(𝓻)**2)
+        self.𝕏 += np.einsum('zok,zk->ok', 𝓷, np.conj(𝓻))
+        self.𝕐 += np.einsum('zok,zk->ok', 𝓷, np.conj(𝓵))
+        self.ℤ += np.matmul(w.T, 𝓻*np.conj(𝓵))
+
+        # Coadd sums for f = 0 Hz
+        self.R0 += np.sum(np.where(ok, μ-μ_refrows, 0), axis=0)
+        self.N0 += np.sum(ok, axis=0)
+
+    def _outputs(self, a):
+        """
+        Rearrange (..., naxis2, naxis1) arrays as (..., nout, ysize, xsize), flipping
+        odd numbered outputs
+        """
+        a = a.reshape(a.shape[:-1]+(self.nout,self.xsize))
+        a = np.moveaxis(a, -2, -3).copy()
+        a[...,1::2,:,:] = a[...,1::2,:,::-1]
+        return(a)
+
+    def merge(self, *others):
+        """
+        Add the sums of other SIRSCore objects into this one. They must
+        have the same readout geometry. Use this to combine darks that were
+        coadded in parallel.
+
+        Parameters: others, SIRSCore
+                      The SIRSCore objects to add
+        """
+        for other in others:
+            if self._geometry() != other._geometry():
+                raise ValueError('Only SIRSCores having the same readout geometry can be merged')
+            sums = other._sums()
+            for name, a in self._sums().items():
+                a += sums[name]
+        return(self)
+
+    def _sums(self):
+        # The SIRS sums by name
+        return({'ℕ':self.ℕ, '𝕃':self.𝕃, 'ℝ':self.ℝ, '𝕏':self.𝕏, '𝕐':self.𝕐, 'ℤ':self.ℤ,
+                'R0':self.R0, 'N0':self.N0})
+
+    def _geometry(self):
+        return((self.naxis1, self.naxis2, self.nout, self.nroh, self.τ))
+
+    def solve(self):
+        """
+        Solve for the SIRS α and β arrays
+        """
+        det = self.𝕃 - self.ℤ*np.conj(self.ℤ)/self.ℝ
+        self.α = (self.𝕐 - self.𝕏*self.ℤ/self.ℝ) / det
+        self.β = (self.𝕏*self.𝕃/self.ℝ - self.𝕐*np.conj(self.ℤ)/self.ℝ) / det
+        return(self.α, self.β)
+
+    def export(self, file, compact=False):
+        """
+        Write a sirspy weights file. See Weights.py.
+
+        Parameters: file, string
+                      Output filename. The suffix should be .h5.
+                    compact, Bool (optional)
+                      Write a compact version 2 file. Otherwise, a version 1 file
+                      including the dense incft matrix is written, as export_to_sirspy()
+                      does by default in Julia.
+        """
+        if self.α is None:
+            raise ValueError('Call solve() before export()')
+        write_weights(file, self.naxis1, self.naxis2, self.nout, self.nroh, self.xsize, self.ysize,
+                      self.freq, self.α, self.β, incft=None if compact == True else self.ift.matrix())
+
+    def save(self, file):
+        """
+        Save the SIRS sums to an HDF5 file so that they can be restored,
+        merged and solved later, e.g. on another node
+
+        Parameters: file, string
+                      Output filename
+        """
+        with h5py.File(file, 'w') as f:
+            g = f.create_group('SIRSSums')
+            g.attrs['hxrg_kind'] = self.hxrg_kind
+            g.attrs['nout'] = self.nout
+            g.attrs['nroh'] = self.nroh
+            g.attrs['τ'] = self.τ
+            g['gdpx'] = self.gdpx
+            for name, a in self._sums().items():
+                g[name] = a
+
+    @classmethod
+    def restore(cls, file, fft_backend=None, fft_workers=None):
+        """
+        Restore a SIRSCore from sums written by save()
+
+        Parameters: file, string
+                      Name of the file
+                    fft_backend, fft_workers (optional)
+                      See SIRSCore
+        """
+        with h5py.File(file, 'r') as f:
+            g = f['SIRSSums']
+            sc = cls(g.attrs['hxrg_kind'], int(g.attrs['nout']), int(g.attrs['nroh']),
+                     float(g.attrs['τ']), gdpx=g['gdpx'][...], fft_backend=fft_backend,
+                     fft_workers=fft_workers)
+            for name, a in sc._sums().items():
+                a[...] = g[name][...]
+        return(sc)
+
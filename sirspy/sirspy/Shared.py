@@ -0,0 +1,115 @@
+import sys
+import time
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+
+def mmap_dataset(filename, dset):
+    """
+    mmap_dataset(filename, dset)
+
+    Memory-map an HDF5 dataset read-only. The pages live in the
+    operating system's page cache, so every process that maps the
+    same file shares one copy.
+
+    Parameters: filename, string
+                  Name of the HDF5 file
+                dset, h5py.Dataset
+                  An open dataset in that file. It must be stored
+                  contiguously and uncompressed.
+    Returns:
+      * The dataset as a read-only numpy.memmap
+    """
+    offset = dset.id.get_offset()
+    if (offset is None) or (dset.chunks is not None) or (dset.compression is not None):
+        raise ValueError(dset.name + ' is not stored contiguously and cannot be memory-mapped')
+    return(np.memmap(filename, mode='r', dtype=dset.dtype, offset=offset, shape=dset.shape))
+
+
+class SharedArray():
+    """
+    A read-only numpy array held in a multiprocessing.shared_memory block.
+
+    The process that creates a SharedArray owns the block. Pickling a
+    SharedArray sends only its name, shape and dtype, so unpickling it in
+    another process attaches to the same block without copying.
+
+    Parameters: a, numpy.ndarray (optional)
+                  Create a new block holding a copy of this array
+                name, string (optional)
+                  Attach to an existing block having this name
+                shape, tuple (optional)
+                  Array shape. Required when attaching.
+                dtype, numpy.dtype (optional)
+                  Array dtype. Required when attaching.
+    """
+    def __init__(self, a=None, name=None, shape=None, dtype=None):
+        t0 = time.perf_counter()
+        if a is not None:
+            # Create and fill a new block
+            self.shape, self.dtype, self.owner = a.shape, np.dtype(a.dtype), True
+            self.shm = shared_memory.SharedMemory(create=True, size=max(a.nbytes, 1))
+            self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+            self.array[...] = a
+        else:
+            # Attach to an existing block. Before python-3.13, attaching
+            # registers the block with the resource tracker, which would
+            # unlink it when this process exits. Only the owner should do that.
+            self.shape, self.dtype, self.owner = tuple(shape), np.dtype(dtype), False
+            if sys.version_info >= (3, 13):
+                self.shm = shared_memory.SharedMemory(name=name, track=False)
+            else:
+                register = resource_tracker.register
+                resource_tracker.register = lambda *args: None
+                try:
+                    self.shm = shared_memory.SharedMemory(name=name)
+                finally:
+                    resource_tracker.register = register
+            self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+        self.array.flags.writeable = False
+        self.name = self.shm.name
+        self.attach_time = time.perf_counter() - t0 # Seconds to create or attach
+
+    def __reduce__(self):
+        return(SharedArray, (None, self.name, self.shape, self.dtype))
+
+    def close(self):
+        """
+        Detach from the block. The owner also unlinks it.
+        """
+        self.array = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+            self.owner = False
+
+    def __del__(self):
+        # The owner frees the block once nothing in this process refers to it.
+        # Processes that are still attached keep their mapping.
+        if getattr(self, 'owner', False):
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def process_memory():
+    """
+    process_memory()
+
+    Resident memory of this process in bytes, split into private
+    (anonymous), file-backed and shared memory parts, and its peak
+    (rss_peak). Only available on Linux. Returns an empty dict elsewhere.
+    """
+    keys = {'VmRSS':'rss', 'RssAnon':'rss_anon', 'RssFile':'rss_file', 'RssShmem':'rss_shmem',
+            'VmHWM':'rss_peak'}
+    report = {}
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                key = line.split(':')[0]
+                if key in keys:
+                    report[keys[key]] = 1024*int(line.split()[1])
+    except OSError:
+        pass
+    return(report)
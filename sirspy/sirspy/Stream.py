@@ -0,0 +1,571 @@
+import os
+import time
+import queue
+import threading
+import h5py
+import numpy as np
+from .Legendre import Legendre
+from .Profiler import call, stage
+
+BZERO = 4096 # DN. Constant that adapt_sirssub adds to make corrected values positive. See SIRS.jl.
+
+# Header keywords that describe the layout of a FITS HDU. They are
+# rewritten for the output and never copied from the input.
+_STRUCTURAL = ('SIMPLE', 'XTENSION', 'BITPIX', 'NAXIS', 'EXTEND', 'PCOUNT', 'GCOUNT',
+               'BZERO', 'BSCALE', 'BLANK', 'EXTNAME', 'CHECKSUM', 'DATASUM')
+
+
+class RampReader():
+    """
+    Read an up-the-ramp datacube one frame at a time without loading it
+
+    FITS images are memory-mapped, and their BSCALE/BZERO scaling is applied
+    one frame at a time. HDF5 datasets are read one frame (hyperslab) at a
+    time. Either way, only the frame being read is held in memory. Leading
+    axes of length one are dropped, so the 4-dimensional files on ADAPT read
+    as (nframes, naxis2, naxis1) cubes.
+
+    Parameters: file, string
+                  An uncompressed FITS file or an HDF5 file
+                hdu, int (optional)
+                  FITS HDU holding the datacube. The default is the first HDU
+                  having three or more dimensions.
+                dataset, string (optional)
+                  HDF5 dataset holding the datacube. The default is the first
+                  dataset having three or more dimensions.
+                sign, float (optional)
+                  Multiply frames by this. Use -1 for data that integrate down,
+                  like the DCL data that adapt_sirssub corrects.
+    Attributes:
+      * nframes: Number of frames
+      * shape: Frame shape, (naxis2, naxis1)
+      * header: Primary FITS header, as read by adapt_sirssub, or a dict of
+        the HDF5 dataset's attributes
+    """
+    def __init__(self, file, hdu=None, dataset=None, sign=1.0):
+        self.file = file
+        self.sign = float(sign)
+        self.scale, self.offset = self.sign, 0.0 # Frame = scale*raw + offset
+        self.dataset = None
+        if h5py.is_hdf5(file):
+            self.format = 'hdf5'
+            self._f = h5py.File(file, 'r')
+            if dataset is None:
+                dataset = _find_dataset(self._f)
+            self._data = self._f[dataset]
+            self.dataset = dataset
+            self.header = dict(self._data.attrs)
+        else:
+            from astropy.io import fits
+            self.format = 'fits'
+            self._f = fits.open(file, memmap=True, do_not_scale_image_data=True)
+            if hdu is None:
+                hdu = [i for i, h in enumerate(self._f) if (h.header.get('NAXIS',0) >= 3)][0]
+            self._data = self._f[hdu].data
+            self.header = self._f[0].header
+            bscale = float(self._f[hdu].header.get('BSCALE', 1.0))
+            bzero  = float(self._f[hdu].header.get('BZERO', 0.0))
+            self.scale, self.offset = self.sign*bscale, self.sign*bzero
+        if self._data.ndim < 3:
+            raise ValueError(file + ' does not hold a datacube')
+        self._lead = (0,)*(self._data.ndim-3) # Index that drops leading axes
+        if any([n != 1 for n in self._data.shape[:-3]]):
+            raise ValueError(file + ': leading axes of the datacube must have length one')
+        self.nframes = int(self._data.shape[-3])
+        self.shape = tuple([int(n) for n in self._data.shape[-2:]])
+        self.nbytes = self.nframes * int(np.prod(self.shape)) * self._data.dtype.itemsize
+
+    def read(self, z, out=None):
+        """
+        Read one frame
+
+        Parameters: z, int
+                      Frame number ∊ {0,1,... nframes-1}
+                    out, numpy.ndarray (optional)
+                      Float array of shape (naxis2, naxis1) in which to put the frame
+        Returns:
+          * The frame. It is float64 unless out is given.
+        """
+        if out is None:
+            out = np.empty(self.shape, dtype=np.float64)
+        if self.format == 'hdf5':
+            self._data.read_direct(out, source_sel=np.s_[self._lead+(z,)])
+        else:
+            np.copyto(out, self._data[self._lead+(z,)])
+        if self.scale != 1.0:
+            out *= self.scale
+        if self.offset != 0.0:
+            out += self.offset
+        return(out)
+
+    def __len__(self):
+        return(self.nframes)
+
+    def close(self):
+        self._data = None
+        self._f.close()
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class RampWriter():
+    """
+    Write a datacube one frame at a time
+
+    The output is HDF5 if the filename ends in .h5 or .hdf5, and FITS otherwise.
+    FITS files are written as a stream into the primary HDU. uint16 data are
+    stored using the standard FITS unsigned convention (BZERO = 32768).
+
+    Parameters: file, string
+                  Output filename
+                nframes, int
+                  Number of frames that will be written
+                shape, tuple
+                  Frame shape, (naxis2, naxis1)
+                dtype, numpy.dtype
+                  Output dtype. One of uint16, int16, int32, float32 and float64.
+                header, astropy.io.fits.Header or dict (optional)
+                  Header keywords (FITS) or attributes (HDF5) to write.
+                  Keywords that describe the FITS data layout are not copied.
+                dataset, string (optional)
+                  HDF5 dataset name
+    """
+    def __init__(self, file, nframes, shape, dtype, header=None, dataset='data'):
+        self.file = file
+        self.nframes = int(nframes)
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.nwritten = 0
+        if os.path.splitext(file)[1].lower() in ('.h5', '.hdf5'):
+            self.format = 'hdf5'
+            self._f = h5py.File(file, 'w')
+            self._data = self._f.create_dataset(dataset, (self.nframes,)+self.shape, dtype=self.dtype,
+                                                chunks=(1,)+self.shape)
+            for key, value, comment in _header_items(header):
+                if key not in ('COMMENT', 'HISTORY'):
+                    self._data.attrs[key] = value
+        else:
+            from astropy.io import fits
+            self.format = 'fits'
+            if self.dtype == np.uint16:
+                self._disk = np.dtype('>i2') # FITS has no unsigned type. Store u - 32768.
+            else:
+                self._disk = self.dtype.newbyteorder('>')
+            self._buf = np.empty(self.shape, dtype=self._disk)
+            self._f = fits.StreamingHDU(file, self._fits_header(header))
+
+    def _fits_header(self, header):
+        # Primary header for the streamed datacube
+        from astropy.io import fits
+        H = fits.Header()
+        H['SIMPLE'] = True
+        H['BITPIX'] = {'i2':16, 'i4':32, 'f4':-32, 'f8':-64}[self._disk.str[1:]]
+        H['NAXIS'] = 3
+        H['NAXIS1'] = self.shape[1]
+        H['NAXIS2'] = self.shape[0]
+        H['NAXIS3'] = self.nframes
+        H['EXTEND'] = True
+        if self.dtype == np.uint16:
+            H['BZERO'] = 32768
+            H['BSCALE'] = 1
+        for key, value, comment in _header_items(header):
+            H.append((key, value, comment))
+        return(H)
+
+    def write(self, frame):
+        """
+        Write the next frame
+
+        Parameters: frame, numpy.ndarray
+                      A (naxis2, naxis1) frame. It is converted to the output dtype.
+        """
+        if self.nwritten >= self.nframes:
+            raise ValueError(self.file + ': all frames have already been written')
+        if self.format == 'hdf5':
+            self._data.write_direct(np.ascontiguousarray(frame, dtype=self.dtype),
+                                    dest_sel=np.s_[self.nwritten])
+        elif self.dtype == np.uint16:
+            np.subtract(frame, 32768, out=self._buf, casting='unsafe')
+            self._f.write(self._buf)
+        else:
+            np.copyto(self._buf, frame, casting='same_kind')
+            self._f.write(self._buf)
+        self.nwritten += 1
+
+    def close(self):
+        if self.nwritten != self.nframes:
+            self._f.close()
+            raise ValueError('{}: {} of {} frames written'.format(self.file, self.nwritten, self.nframes))
+        self._f.close()
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *args):
+        if args[0] is None:
+            self.close()
+        else:
+            self._f.close() # Do not mask the original exception
+
+
+def adapt_convert(frame, out=None, work=None):
+    """
+    adapt_convert(frame, out=None, work=None)
+
+    Convert a corrected frame to the adapt_sirssub output convention.
+    Values are rounded to the nearest integer (ties to even, like Julia's
+    round()), offset by BZERO and clipped to {0,1,... 65535}.
+
+    Parameters: frame, numpy.ndarray
+                  Reference corrected frame
+                out, numpy.ndarray (optional)
+                  uint16 array in which to put the result
+                work, numpy.ndarray (optional)
+                  Float array, shaped like frame, to use as scratch space
+    Returns:
+      * The frame as uint16
+    """
+    if work is None:
+        work = np.empty(frame.shape, dtype=np.float64)
+    if out is None:
+        out = np.empty(frame.shape, dtype=np.uint16)
+    np.rint(frame, out=work)
+    work += BZERO
+    np.clip(work, 0, 2**16-1, out=work)
+    np.copyto(out, work, casting='unsafe')
+    return(out)
+
+
+def iter_corrected(sirs, source, rowsonly=False, pplfix1=False, sign=1.0, hdu=None, dataset=None,
+                   dtype=None, reuse=False, prefetch=0):
+    """
+    iter_corrected(sirs, source, rowsonly=False, pplfix1=False, sign=1.0, hdu=None, dataset=None,
+                   dtype=None, reuse=False, prefetch=0)
+
+    Generator of SIRS corrected frames. Frames are read one at a time from a
+    file and corrected using SIRS.refcor_frame(), so memory use does not depend
+    on the number of frames. The frames are the same as SIRS.refcor() gives.
+
+    Parameters: sirs, SIRS
+                  SIRS object
+                source, string, RampReader or numpy.ndarray
+                  Input FITS or HDF5 file, an open RampReader, or a raw datacube,
+                  which is not modified
+                rowsonly, pplfix1, Bool
+                  See SIRS.refcor()
+                sign, hdu, dataset
+                  Used to open source if it is a filename. See RampReader. sign
+                  also applies to a datacube.
+                dtype, numpy.dtype (optional)
+                  dtype of the corrected frames. The default is sirs.precision.
+                reuse, Bool (optional)
+                  Yield the same buffer every time, so nothing is allocated per
+                  frame. Each frame is then overwritten by the next one. Ignored
+                  if prefetch > 0.
+                prefetch, int (optional)
+                  Number of frames to read ahead in a background thread, so that
+                  reading overlaps with correction
+    Yields:
+      * Corrected (naxis2, naxis1) frames in order
+    """
+    reader = _open(source, sign, hdu, dataset)
+    try:
+        if reader.shape != (sirs.naxis2, sirs.naxis1):
+            raise ValueError('{}: frames are {}, but the weights are for {}'.format(
+                             reader.file, reader.shape, (sirs.naxis2, sirs.naxis1)))
+        ws = sirs.workspace(dtype)
+        dtype = ws.dtype
+        if prefetch > 0:
+            frames = _read_ahead(_read_frames(reader, dtype, False), prefetch)
+        else:
+            frames = _read_frames(reader, dtype, reuse)
+        for frame in frames:
+            sirs.refcor_frame(frame, ws, rowsonly=rowsonly, pplfix1=pplfix1)
+            yield frame
+    finally:
+        if 'frames' in locals():
+            frames.close() # Stop reading before closing the file
+        if reader is not source:
+            reader.close()
+
+
+def fit_corrected(sirs, source, degree, rowsonly=False, pplfix1=False, sign=1.0, hdu=None, dataset=None,
+                  dtype=None, prefetch=0, out=None):
+    """
+    fit_corrected(sirs, source, degree, rowsonly=False, pplfix1=False, sign=1.0, hdu=None, dataset=None,
+                  dtype=None, prefetch=0, out=None)
+
+    Legendre fit of the SIRS corrected ramp, without making the corrected
+    datacube. Each frame is corrected as it is read and then added into the
+    fit, λ += pinvB[:,z]*frame. Peak memory is about one frame plus the fit.
+    The result equals Legendre(nframes, degree).legfit() of SIRS.refcor()'s
+    output, apart from floating point rounding. With a Profiler attached to
+    sirs, the whole fit is profiled as one 'fit_corrected' call, and adding
+    frames into the fit is its 'matmul' stage.
+
+    Parameters: sirs, SIRS
+                  SIRS object
+                source, string, RampReader or numpy.ndarray
+                  Input FITS or HDF5 file, an open RampReader, or a raw datacube,
+                  which is not modified
+                degree, int
+                  Degree of Legendre polynomial fit
+                rowsonly, pplfix1, sign, hdu, dataset, dtype, prefetch (optional)
+                  See iter_corrected()
+                out, numpy.ndarray (optional)
+                  Float64 (degree+1, naxis2, naxis1) array for the result
+    Returns:
+      * The Legendre fit. See Legendre.legfit().
+    """
+    reader = _open(source, sign, hdu, dataset)
+    try:
+        with call(sirs.profiler, 'fit_corrected'):
+            return(_fit_corrected(sirs, reader, degree, rowsonly, pplfix1, dtype, prefetch, out))
+    finally:
+        if reader is not source:
+            reader.close()
+
+
+def _fit_corrected(sirs, reader, degree, rowsonly, pplfix1, dtype, prefetch, out):
+    # See fit_corrected()
+    pinvB = Legendre(reader.nframes, degree).pinvB
+    shape = (degree+1,) + reader.shape
+    if out is None:
+        out = np.zeros(shape)
+    elif out.shape != shape:
+        raise ValueError('out must be {}'.format(shape))
+    else:
+        out[...] = 0
+    work = np.empty(reader.shape)
+    frames = iter_corrected(sirs, reader, rowsonly=rowsonly, pplfix1=pplfix1, dtype=dtype,
+                            reuse=True, prefetch=prefetch)
+    for z, frame in enumerate(frames):
+        with stage(sirs.profiler, 'matmul'):
+            for k in np.arange(degree+1):
+                np.multiply(frame, pinvB[k,z], out=work)
+                out[k] += work
+    return(out)
+
+
+def _open(source, sign, hdu, dataset):
+    # RampReader (or equivalent) for a source
+    if isinstance(source, (RampReader, _ArrayReader)):
+        return(source)
+    if isinstance(source, np.ndarray):
+        return(_ArrayReader(source, sign))
+    return(RampReader(source, hdu=hdu, dataset=dataset, sign=sign))
+
+
+class _ArrayReader():
+    """
+    Read frames from a datacube like RampReader does
+    """
+    def __init__(self, D, sign=1.0):
+        self.file = 'datacube'
+        self._data = D
+        self.sign = sign
+        self.nframes = D.shape[0]
+        self.shape = D.shape[1:]
+
+    def read(self, z, out=None):
+        if out is None:
+            out = np.empty(self.shape, dtype=np.float64)
+        np.copyto(out, self._data[z], casting='unsafe')
+        if self.sign != 1:
+            out *= self.sign
+        return(out)
+
+    def close(self):
+        pass
+
+
+def _read_frames(reader, dtype, reuse):
+    # Generator of frames read from a RampReader
+    frame = np.empty(reader.shape, dtype=dtype)
+    for z in np.arange(reader.nframes):
+        if reuse == False:
+            frame = np.empty(reader.shape, dtype=dtype)
+        yield reader.read(z, out=frame)
+
+
+def _read_ahead(items, depth):
+    """
+    Generator that runs another generator in a background thread,
+    keeping up to depth of its items ready
+    """
+    q = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    def produce():
+        try:
+            for item in items:
+                while not stop.is_set():
+                    try:
+                        q.put((True, item), timeout=.1)
+                        break
+                    except queue.Full:
+                        pass
+                if stop.is_set():
+                    return
+            q.put((True, stop))
+        except BaseException as e:
+            q.put((False, e))
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            ok, item = q.get()
+            if ok == False:
+                raise item
+            if item is stop:
+                return
+            yield item
+    finally:
+        stop.set()
+        while thread.is_alive():
+            try:
+                q.get(timeout=.1)
+            except queue.Empty:
+                pass
+        thread.join()
+
+
+class _WriteBehind():
+    """
+    Write frames using a RampWriter in a background thread, so that
+    writing overlaps with correction. Frames must not be modified after
+    they are passed to write().
+    """
+    def __init__(self, writer, depth):
+        self.writer = writer
+        self._queue = queue.Queue(maxsize=depth)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            frame = self._queue.get()
+            if frame is None:
+                return
+            if self._error is None:
+                try:
+                    self.writer.write(frame)
+                except BaseException as e:
+                    self._error = e
+
+    def write(self, frame):
+        if self._error is not None:
+            raise self._error
+        self._queue.put(frame)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+
+def correct_file(sirs, in_file, out_file, adapt=False, rowsonly=False, pplfix1=False, sign=None,
+                 hdu=None, dataset=None, dtype=np.float32, overlap=False):
+    """
+    correct_file(sirs, in_file, out_file, adapt=False, rowsonly=False, pplfix1=False, sign=None,
+                 hdu=None, dataset=None, dtype=np.float32, overlap=False)
+
+    SIRS reference correct a FITS or HDF5 file, streaming it frame by frame
+    from in_file to out_file. Peak memory is a few frames, however long the
+    ramp. The output is written to a temporary file that is renamed to
+    out_file when it is complete, so out_file is never partially written.
+
+    Parameters: sirs, SIRS
+                  SIRS object
+                in_file, string
+                  Input FITS or HDF5 file. See RampReader.
+                out_file, string
+                  Output file. It is HDF5 if the suffix is .h5 or .hdf5 and FITS otherwise.
+                adapt, Bool (optional)
+                  Match the adapt_sirssub convention. The input is multiplied by -1 to
+                  make charge integrate up, and the output is adapt_convert()ed to uint16.
+                  The SIRSBIAS header keyword records BZERO.
+                rowsonly, pplfix1, Bool
+                  See SIRS.refcor()
+                sign, float (optional)
+                  Multiply the input by this. The default is -1 if adapt is True and 1 otherwise.
+                hdu, dataset (optional)
+                  Where the input datacube is. See RampReader.
+                dtype, numpy.dtype (optional)
+                  Output dtype when adapt is False
+                overlap, Bool (optional)
+                  Read the next frames and write the previous ones in background
+                  threads while the present frame is corrected
+    Returns: dict
+      * frames: Number of frames corrected
+      * seconds: Time taken
+      * bytes_read, bytes_written: Data bytes read and written
+    """
+    t0 = time.perf_counter()
+    if sign is None:
+        sign = -1.0 if adapt == True else 1.0
+    out_dtype = np.dtype(np.uint16 if adapt == True else dtype)
+    with RampReader(in_file, hdu=hdu, dataset=dataset, sign=sign) as reader:
+
+        # Augment the header
+        header = reader.header.copy()
+        header['REFCOR'] = True
+        if reader.format == 'fits':
+            header.comments['REFCOR'] = 'Two-stream reference corrected by SIRS'
+        if adapt == True:
+            header['SIRSBIAS'] = BZERO
+            if reader.format == 'fits':
+                header.comments['SIRSBIAS'] = 'DN; Constant added by SIRS to make values >0'
+
+        # Correct and write frame by frame
+        base, suffix = os.path.splitext(out_file)
+        tmp = base + '.{}.tmp'.format(os.getpid()) + suffix # Keep the suffix, which selects the format
+        try:
+            with RampWriter(tmp, reader.nframes, reader.shape, out_dtype, header=header,
+                            dataset=reader.dataset or 'data') as writer:
+                out, work = None, np.empty(reader.shape)
+                if overlap == False:
+                    out = np.empty(reader.shape, dtype=np.uint16) # Reuse buffers
+                else:
+                    writer = _WriteBehind(writer, 2)
+                try:
+                    for frame in iter_corrected(sirs, reader, rowsonly=rowsonly, pplfix1=pplfix1,
+                                                reuse=True, prefetch=2 if overlap == True else 0):
+                        writer.write(adapt_convert(frame, out=out, work=work) if adapt == True else frame)
+                finally:
+                    if overlap == True:
+                        writer.close()
+            os.replace(tmp, out_file)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return({'frames':reader.nframes, 'seconds':time.perf_counter()-t0, 'bytes_read':reader.nbytes,
+                'bytes_written':reader.nframes*int(np.prod(reader.shape))*out_dtype.itemsize})
+
+
+def _find_dataset(f):
+    # Name of the first dataset in an HDF5 file having three or more dimensions
+    names = []
+    f.visititems(lambda name, obj: names.append(name) if isinstance(obj, h5py.Dataset) and
+                                                         (obj.ndim >= 3) else None)
+    if len(names) == 0:
+        raise ValueError(f.filename + ' holds no datacube')
+    return(names[0])
+
+
+def _header_items(header):
+    # (keyword, value, comment) of each card of a FITS header or dict,
+    # except those that describe the data layout
+    if header is None:
+        return([])
+    if hasattr(header, 'cards'):
+        items = [(card.keyword, card.value, card.comment) for card in header.cards if card.keyword != '']
+    else:
+        items = [(key, value, '') for key, value in header.items()]
+    return([item for item in items if (item[0] not in _STRUCTURAL) and not item[0].startswith('NAXIS')])
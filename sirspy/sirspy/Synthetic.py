@@ -0,0 +1,249 @@
+import numpy as np
+from .IncompleteFT import IncompleteFT, sirs_freq_index
+from .Weights import write_weights
+
+# Detector formats, and the default number of outputs for each
+HXRG = {'h1rg':(1024, 16), 'h2rg':(2048, 4), 'h4rg':(4096, 32)} # naxis, nout
+RB = 4 # Reference pixel border width
+
+# Default noise model in DN. The 1/f noise has a part that is common to all
+# outputs, which SIRS can remove using the reference columns, and a part that
+# is not. ACN is independent 1/f noise in the even and odd columns.
+NOISE = {'white':6.0,      # Read noise of regular pixels
+         'white_ref':4.8,  # Read noise of reference pixels
+         'pink':4.0,       # Common 1/f noise
+         'pink_op':1.0,    # Uncorrelated 1/f noise of each output
+         'acn':0.5,        # Alternating column noise
+         'bias':500.,      # Standard deviation of the per pixel bias about 10000 DN
+         'dark':0.05}      # Mean dark signal per frame
+
+
+def geometry(hxrg_kind='h2rg', nout=None, nroh=12):
+    """
+    geometry(hxrg_kind='h2rg', nout=None, nroh=12)
+
+    Readout geometry of an HxRG detector
+
+    Parameters: hxrg_kind, string
+                  Selected from {'h1rg','h2rg','h4rg'}
+                nout, int (optional)
+                  Number of outputs. The default is 16, 4 and 32 (JWST H2RG, Roman H4RG).
+                nroh, int (optional)
+                  New row overhead in pixels
+    Returns: dict
+      * naxis1, naxis2, nout, nroh, xsize, ysize, nstep, as in SIRS
+    """
+    if hxrg_kind not in HXRG:
+        raise ValueError("hxrg_kind must be 'h1rg', 'h2rg' or 'h4rg'")
+    naxis, _nout = HXRG[hxrg_kind]
+    nout = _nout if nout is None else int(nout)
+    if naxis % nout != 0:
+        raise ValueError('nout must divide {}'.format(naxis))
+    xsize = naxis // nout
+    return({'naxis1':naxis, 'naxis2':naxis, 'nout':nout, 'nroh':int(nroh), 'xsize':xsize,
+            'ysize':naxis, 'nstep':(xsize+int(nroh))*naxis})
+
+
+def synthetic_weights(file, hxrg_kind='h2rg', nout=None, nroh=12, τ=5.e-6, nframes=8, seed=None,
+                      compact=True, pool=17, **noise):
+    """
+    synthetic_weights(file, hxrg_kind='h2rg', nout=None, nroh=12, τ=5.e-6, nframes=8, seed=None,
+                      compact=True, pool=17, **noise)
+
+    Write a weights file matching synthetic_frames(). The simulation knows
+    the correlated noise in each output's time series, including during the
+    new row overhead. So α and β are fit directly by least squares regression
+    of its rfft on the incomplete Fourier transforms of the left and right
+    reference columns. A few frames give only a few samples per frequency,
+    and fitting each frequency on its own then over-fits badly (|α| > 2 from
+    4 frames, which makes the noise worse). Since α and β vary slowly with
+    frequency, each frequency is fit using the sums of its pool neighbours.
+
+    Parameters: file, string
+                  Output filename. The suffix should be .h5.
+                hxrg_kind, nout, nroh (optional)
+                  See geometry()
+                τ, float (optional)
+                  Pixel dwell time in seconds
+                nframes, int (optional)
+                  Number of simulated frames to fit
+                pool, int (optional)
+                  Number of neighbouring frequencies fit together. 1 fits each on its own.
+                seed, noise (optional)
+                  See synthetic_frames()
+                compact, Bool (optional)
+                  Write a compact version 2 file, without incft. Otherwise the dense
+                  incft is included. For an H4RG, it is about 1 GB.
+    """
+    g = geometry(hxrg_kind, nout, nroh)
+    kidx = sirs_freq_index(g['ysize'], g['nstep'])
+    freq = np.fft.rfftfreq(g['nstep'], τ)[kidx]
+    ift = IncompleteFT(g['ysize'], g['xsize'], g['nroh'], rb=RB)
+
+    # Sums for the normal equations of each output and frequency
+    ll, lr, rr = 0., 0., 0.
+    ln, rn = 0., 0.
+    for frame, s in _simulate(nframes, g, seed, noise):
+        𝓵, 𝓻 = ift.transform(np.stack((frame[:,:RB].ravel(), frame[:,-RB:].ravel())))
+        𝓷 = np.fft.rfft(s, axis=-1)[:,kidx]
+        ll, lr, rr = ll + np.abs(𝓵)**2, lr + np.conj(𝓵)*𝓻, rr + np.abs(𝓻)**2
+        ln, rn = ln + np.conj(𝓵)*𝓷, rn + np.conj(𝓻)*𝓷
+    ll, lr, rr, ln, rn = (_pool(a, kidx, pool) for a in (ll, lr, rr, ln, rn))
+    det = ll*rr - np.abs(lr)**2
+    α = (rr*ln - lr*rn) / det
+    β = (ll*rn - np.conj(lr)*ln) / det
+    α[:,0], β[:,0] = 0, 0 # f = 0 Hz is corrected using reference rows
+
+    incft = None
+    if compact == False:
+        incft = ift.matrix()
+    write_weights(file, g['naxis1'], g['naxis2'], g['nout'], g['nroh'], g['xsize'], g['ysize'],
+                  freq, α, β, incft=incft)
+
+
+def synthetic_frames(nframes, hxrg_kind='h2rg', nout=None, nroh=12, seed=None, dtype=np.float32,
+                     **noise):
+    """
+    synthetic_frames(nframes, hxrg_kind='h2rg', nout=None, nroh=12, seed=None, dtype=np.float32,
+                     **noise)
+
+    Generator of the frames of a synthetic up-the-ramp dark
+
+    Each output is simulated as a time series of nstep samples per frame, which
+    includes the new row overhead. Odd numbered outputs are read out right to
+    left. The noise is white read noise, 1/f noise that is common to all
+    outputs (including the reference columns), 1/f noise that is not, and
+    alternating column noise. Regular pixels also have a per pixel bias and
+    dark current. Reference pixels have only the bias and noise.
+
+    Parameters: nframes, int
+                  Number of frames
+                hxrg_kind, nout, nroh (optional)
+                  See geometry()
+                seed, int (optional)
+                  Random seed
+                dtype, numpy.dtype (optional)
+                  dtype of the frames
+                noise (optional)
+                  Keywords that replace entries of NOISE
+    Yields:
+      * (naxis2, naxis1) frames
+    """
+    g = geometry(hxrg_kind, nout, nroh)
+    amp = _noise(noise)
+    rng = np.random.default_rng(seed)
+    shape = (g['naxis2'], g['naxis1'])
+
+    # Per pixel bias and dark current. Reference pixels have no dark current.
+    bias = 10000. + amp['bias']*rng.standard_normal(shape)
+    dark = np.where(_refpix(shape), 0., amp['dark']*rng.exponential(size=shape))
+    for z, (frame, s) in enumerate(_simulate(nframes, g, rng, amp)):
+        frame += bias + (z+1)*dark
+        yield frame.astype(dtype, copy=False)
+
+
+def synthetic_ramp(nframes, hxrg_kind='h2rg', nout=None, nroh=12, seed=None, dtype=np.float32,
+                   out=None, **noise):
+    """
+    synthetic_ramp(nframes, hxrg_kind='h2rg', nout=None, nroh=12, seed=None, dtype=np.float32,
+                   out=None, **noise)
+
+    A synthetic up-the-ramp dark. See synthetic_frames().
+
+    Parameters: out, numpy.ndarray (optional)
+                  (nframes, naxis2, naxis1) array, e.g. a memmap, for the result
+                others
+                  See synthetic_frames()
+    Returns:
+      * The datacube
+    """
+    g = geometry(hxrg_kind, nout, nroh)
+    if out is None:
+        out = np.empty((nframes, g['naxis2'], g['naxis1']), dtype=dtype)
+    for z, frame in enumerate(synthetic_frames(nframes, hxrg_kind, nout, nroh, seed, dtype, **noise)):
+        out[z] = frame
+    return(out)
+
+
+def _noise(noise):
+    # NOISE, with some entries replaced
+    amp = dict(NOISE)
+    for key in noise:
+        if key not in amp:
+            raise ValueError('unknown noise parameter ' + key)
+        amp[key] = noise[key]
+    return(amp)
+
+
+def _refpix(shape):
+    # Reference pixel mask
+    ref = np.zeros(shape, dtype=bool)
+    ref[:RB,:], ref[-RB:,:], ref[:,:RB], ref[:,-RB:] = True, True, True, True
+    return(ref)
+
+
+def _simulate(nframes, g, rng, noise):
+    """
+    Generator of noise frames, and the correlated noise in each output's
+    time series, including the new row overhead
+
+    Parameters: nframes, int
+                  Number of frames
+                g, dict
+                  From geometry()
+                rng, numpy.random.Generator or int
+                  Random number generator, or a seed
+                noise, dict
+                  Keywords that replace entries of NOISE
+    Yields:
+      * (frame, s), where s is (nout, nstep)
+    """
+    amp = _noise(noise)
+    rng = np.random.default_rng(rng)
+    nout, xsize, ysize, nstep = g['nout'], g['xsize'], g['ysize'], g['nstep']
+    shape = (g['naxis2'], g['naxis1'])
+    white = np.where(_refpix(shape), amp['white_ref'], amp['white'])
+
+    # +1/-1 in even/odd columns, in time order
+    alt = 1 - 2*(np.arange(nstep) % (xsize+g['nroh']) % 2)
+    for z in np.arange(nframes):
+
+        # Time series of each output
+        s = amp['pink']*_pink(rng, nstep) + amp['pink_op']*_pink(rng, nstep, nout)
+        s += amp['acn']*_pink(rng, nstep, nout)*alt
+
+        # Drop the new row overhead, flip odd numbered outputs, and lay
+        # the outputs side by side
+        d = s.reshape(nout,ysize,-1)[:,:,:xsize].copy()
+        d[1::2] = d[1::2,:,::-1]
+        frame = d.transpose(1,0,2).reshape(shape)
+        frame += white*rng.standard_normal(shape)
+        yield frame, s
+
+
+def _pool(a, kidx, width):
+    """
+    Sum a over width neighbouring frequencies (fewer at the ends), along its
+    last axis. The low and high frequency runs of kidx are pooled separately.
+    """
+    out = np.empty_like(a)
+    h = int(width)//2
+    for seg in np.split(np.arange(len(kidx)), np.flatnonzero(np.diff(kidx) != 1)+1):
+        c = np.cumsum(a[...,seg], axis=-1)
+        c = np.concatenate((np.zeros(c.shape[:-1]+(1,), dtype=c.dtype), c), axis=-1)
+        i = np.arange(len(seg))
+        out[...,seg] = c[...,np.minimum(i+h+1, len(seg))] - c[...,np.maximum(i-h, 0)]
+    return(out)
+
+
+def _pink(rng, n, m=None):
+    """
+    Unit variance 1/f noise, n samples long. With m, make m independent series.
+    """
+    shape = (n,) if m is None else (m,n)
+    f = np.arange(n//2+1)
+    f[0] = 1
+    spec = np.fft.rfft(rng.standard_normal(shape), axis=-1) / np.sqrt(f)
+    spec[...,0] = 0
+    s = np.fft.irfft(spec, n=n, axis=-1)
+    return(s / np.std(s, axis=-1, keepdims=True))
@@ -0,0 +1,58 @@
+import os
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# Thread pool helpers shared by SIRS.refcor() and Legendre. Threads work on
+# disjoint parts of the data, and NumPy releases the GIL while they do.
+
+
+@contextlib.contextmanager
+def thread_pool(workers, profiler=None):
+    """
+    thread_pool(workers, profiler=None)
+
+    Context giving a ThreadPoolExecutor of workers threads. While it is open,
+    BLAS is limited to cpu_count()//workers threads, so that the pool and BLAS
+    do not oversubscribe the cores. See blas_limit(). With a Profiler, the
+    threads' stages are added to the call in progress. See Profiler.worker().
+    """
+    initializer = None if profiler is None else profiler.worker()
+    with ThreadPoolExecutor(workers, initializer=initializer) as pool, \
+         blas_limit(max(1, os.cpu_count()//workers)):
+        yield pool
+
+
+def blas_limit(n):
+    """
+    blas_limit(n)
+
+    Context in which BLAS libraries use at most n threads. This needs
+    threadpoolctl. Without it, BLAS threads are left alone.
+    """
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return(contextlib.nullcontext())
+    return(threadpool_limits(limits=n, user_api='blas'))
+
+
+def split(z0, z1, n):
+    """
+    split(z0, z1, n)
+
+    Split the range z0 ≤ z < z1 into at most n contiguous (start, stop)
+    pieces of nearly equal length
+    """
+    edges = np.linspace(z0, z1, min(n, z1-z0)+1).round().astype(int)
+    return([(edges[i], edges[i+1]) for i in np.arange(len(edges)-1)])
+
+
+def wait(results):
+    """
+    wait(results)
+
+    Wait for all tasks submitted using ThreadPoolExecutor.map(), raising any exception
+    """
+    for result in results:
+        pass
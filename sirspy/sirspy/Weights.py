@@ -0,0 +1,140 @@
+import os
+import argparse
+import h5py
+import numpy as np
+from .IncompleteFT import IncompleteFT
+
+# Weights file formats. Both are HDF5 files with one group, SIRSCore.
+#
+#   Version 1 (export_to_sirspy.jl): naxis1, naxis2, nout, nroh, xsize, ysize,
+#     freq, α, β and incft, the dense incomplete Fourier transform operator.
+#     For an H4RG, incft is about 1 GB.
+#
+#   Version 2 (compact): the same, plus version = 2, but without incft.
+#     incft depends only on the readout geometry (naxis2, xsize, nroh), not
+#     on the detector's calibration, so sirspy regenerates it on load.
+#     A version 2 file is a few MB.
+#
+# Either version can also hold w, the f = 0 Hz reference row weights
+# written by RowsSol (rowssol.jl keeps them in a separate _SIRS2.jld file).
+VERSION = 2 # Current weights file format version
+
+
+def write_weights(file, naxis1, naxis2, nout, nroh, xsize, ysize, freq, α, β, incft=None, w=None):
+    """
+    write_weights(file, naxis1, naxis2, nout, nroh, xsize, ysize, freq, α, β, incft=None, w=None)
+
+    Write a sirspy weights file. The layout matches export_to_sirspy.jl.
+
+    Parameters: file, string
+                  Output filename. The suffix should be .h5.
+                naxis1, naxis2, nout, nroh, xsize, ysize, int
+                  Readout geometry. See SIRS.
+                freq, numpy.ndarray
+                  Incomplete Fourier transform frequencies in Hz
+                α, β, numpy.ndarray
+                  SIRS weights. The shape is (nout, len(freq)), as in SIRS.α.
+                incft, numpy.ndarray (optional)
+                  Dense incomplete Fourier transform operator. If given, a version 1
+                  file is written. Otherwise, a compact version 2 file is written.
+                w, numpy.ndarray (optional)
+                  Reference row weights. The shape is (nout, 2*rb*xsize), as in SIRS.w.
+    """
+    with h5py.File(file, 'w') as f:
+        g = f.create_group('SIRSCore')
+        g['naxis1'] = np.int64(naxis1)
+        g['naxis2'] = np.int64(naxis2)
+        g['nout'] = np.int64(nout)
+        g['nroh'] = np.int64(nroh)
+        g['xsize'] = np.int64(xsize)
+        g['ysize'] = np.int64(ysize)
+        g['freq'] = np.asarray(freq, dtype=np.float64)
+        g['α'] = np.ascontiguousarray(np.transpose(α))
+        g['β'] = np.ascontiguousarray(np.transpose(β))
+        if w is not None:
+            g['w'] = np.ascontiguousarray(np.transpose(w))
+        if incft is None:
+            g['version'] = np.int64(VERSION)
+        else:
+            g['incft'] = incft
+
+
+def compact_weights(in_file, out_file, verify=True):
+    """
+    compact_weights(in_file, out_file, verify=True)
+
+    Convert a version 1 weights file to the compact version 2 format
+
+    Parameters: in_file, string
+                  A version 1 weights file
+                out_file, string
+                  The version 2 weights file to write
+                verify, bool
+                  Check that the stored incft agrees with the operator that
+                  will be regenerated on load. This reads incft, so it is slow.
+    """
+    with h5py.File(in_file, 'r') as f:
+        g = f['SIRSCore']
+        geometry = [np.int64(g[key]) for key in ('naxis1','naxis2','nout','nroh','xsize','ysize')]
+        if 'incft' not in g:
+            raise ValueError(in_file + ' is already a compact weights file')
+        if verify == True:
+            naxis1, naxis2, nout, nroh, xsize, ysize = geometry
+            ift = IncompleteFT(ysize, xsize, nroh)
+            d = np.random.default_rng(0).normal(size=(2,g['incft'].shape[1]))
+            ref = np.matmul(d, np.transpose(g['incft'][...]))
+            if np.max(np.abs(ift.transform(d)-ref)) > 1.e-8*np.max(np.abs(ref)):
+                raise ValueError(in_file + ': incft does not match the regenerated operator')
+        write_weights(out_file, *geometry, g['freq'][...],
+                      np.transpose(g['α'][...]), np.transpose(g['β'][...]),
+                      w=np.transpose(g['w'][...]) if 'w' in g else None)
+
+
+def operator(ysize, xsize, nroh, rb=4, cache_dir=None, mmap=False):
+    """
+    operator(ysize, xsize, nroh, rb=4, cache_dir=None, mmap=False)
+
+    Regenerate the dense incomplete Fourier transform operator (incft) for
+    a readout geometry
+
+    Parameters: ysize, xsize, nroh, rb, int
+                  Readout geometry. See IncompleteFT.
+                cache_dir, string (optional)
+                  Directory in which to cache operators. If the operator for this
+                  geometry is there, it is loaded instead of rebuilt. Otherwise it
+                  is built and saved there.
+                mmap, bool
+                  Memory-map the cached operator read-only instead of reading it.
+                  Requires cache_dir.
+    """
+    if cache_dir is None:
+        if mmap == True:
+            raise ValueError('Memory-mapping a regenerated operator requires cache_dir')
+        return(IncompleteFT(ysize, xsize, nroh, rb=rb).matrix())
+    file = os.path.join(cache_dir, 'incft_{}_{}_{}_{}.npy'.format(ysize, xsize, nroh, rb))
+    if not os.path.exists(file):
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = file + '.{}.tmp'.format(os.getpid()) # Write atomically
+        with open(tmp, 'wb') as f:
+            np.save(f, IncompleteFT(ysize, xsize, nroh, rb=rb).matrix())
+        os.replace(tmp, file)
+    return(np.load(file, mmap_mode='r' if mmap == True else None))
+
+
+def main():
+    """
+    Console entry point, sirspy-compact. Convert version 1 weights files
+    to the compact version 2 format.
+    """
+    parser = argparse.ArgumentParser(description='Convert sirspy weights files to the compact version 2 format')
+    parser.add_argument('inputs', nargs='+', help='Version 1 weights files')
+    parser.add_argument('-o', '--odir', required=True, help='Output directory')
+    parser.add_argument('--no-verify', action='store_true',
+                        help='Do not check incft against the regenerated operator')
+    args = parser.parse_args()
+    os.makedirs(args.odir, exist_ok=True)
+    for file in args.inputs:
+        out_file = os.path.join(args.odir, os.path.basename(file))
+        compact_weights(file, out_file, verify=not args.no_verify)
+        print(file, '->', out_file, '({:.1f} MB -> {:.1f} MB)'.format(os.path.getsize(file)/2**20,
+                                                                      os.path.getsize(out_file)/2**20))
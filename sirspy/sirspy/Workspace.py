@@ -0,0 +1,76 @@
+import warnings
+import numpy as np
+
+
+class Workspace():
+    """
+    Preallocated buffers for correcting frames one at a time using
+    SIRS.refcor_frame(). Create one per SIRS object and frame dtype, and
+    reuse it for every frame. refcor_frame() then allocates no arrays that
+    grow with the frame. A few hundred kB of temporaries remain per frame,
+    as measured with tracemalloc: NumPy's ufunc iteration buffers (about
+    200 kB, for the strided subtractions) and, with engine='fft', copies of
+    the reference columns made by the FFT backend (their size with numpy,
+    twice it with fftw, about 0.5 MB for an H2RG).
+
+    Parameters: sirs, SIRS
+                  The SIRS object that will use this workspace
+                dtype, numpy.dtype (optional)
+                  The dtype of the frames to correct
+    """
+    def __init__(self, sirs, dtype=np.float64):
+
+        # Pick off what we need from the SIRS object
+        self.sirs  = sirs
+        self.dtype = np.dtype(dtype)
+        self.shape = (int(sirs.naxis2), int(sirs.naxis1)) # Frame shape
+        if sirs.fft.inplace == False:
+            warnings.warn("the {} FFT backend cannot transform into out=, so refcor_frame() will allocate "
+                          "arrays for every frame. Use 'numpy' or 'fftw'.".format(sirs.fft.name), stacklevel=3)
+        ysize, xsize, nroh, nout = int(sirs.ysize), int(sirs.xsize), int(sirs.nroh), int(sirs.nout)
+        nfreq = len(sirs.freq)
+
+        # Reference columns and their incomplete Fourier transforms. The
+        # projection is done in complex arithmetic, so keep them complex,
+        # in the precision of the SIRS object.
+        self.refcols = np.zeros((2,ysize*sirs.RB), dtype=sirs.cdtype) # Left and right refcols
+        self.refcols_2d = self.refcols.reshape(2,ysize,sirs.RB)
+        self.refcols_ft = np.zeros((2,nfreq), dtype=sirs.cdtype)
+        if sirs.engine == 'fft':
+            self.ift_work = (np.zeros((2,ysize,sirs.RB), dtype=sirs.cdtype),
+                             np.zeros((2,nfreq,sirs.RB), dtype=sirs.cdtype))
+
+        # Spectrum of one output. Only the kept frequencies are ever written,
+        # so everything else stays zero. Assemble it in contiguous segments.
+        self.t1   = np.zeros(nfreq, dtype=sirs.cdtype)
+        self.t2   = np.zeros(nfreq, dtype=sirs.cdtype)
+        self.spec = np.zeros(sirs.nstep//2+1, dtype=np.complex64)
+        self.segments = []
+        breaks = np.flatnonzero(np.diff(sirs.kidx) != 1) + 1
+        for f0, f1 in zip(np.concatenate(([0], breaks)), np.concatenate((breaks, [nfreq]))):
+            self.segments.append((slice(int(f0), int(f1)),
+                                  slice(int(sirs.kidx[f0]), int(sirs.kidx[f1-1])+1)))
+
+        # Time domain correction for one output, and views that pick out real
+        # samples in both readout directions
+        self.ref = np.zeros(sirs.nstep, dtype=self.spec.real.dtype)
+        self.ref_real = self.ref.reshape(ysize,xsize+nroh)[:,:xsize]
+        self.ref_flip = self.ref_real[:,::-1]
+
+        # DC correction. These mirror the layout used by SIRS._dc_correct()
+        # so that both give the same results. Windows may have no reference rows.
+        nrows = 0 if sirs.rowslim is None else sirs.rowslim[1]-sirs.rowslim[0]+1
+        self.edge = [int(op) for op in np.unique([0, nout-1])]
+        self.middle_rows = np.zeros((nout,2,nrows,xsize//2), dtype=self.dtype)
+        self.middle_flat = self.middle_rows.reshape(nout,2,-1)
+        self.edge_rows = np.zeros((len(self.edge),nrows,xsize//2,2), dtype=self.dtype)
+        self.edge_flat = self.edge_rows.reshape(len(self.edge),-1)
+        self.μ = np.zeros((nout,2), dtype=self.dtype)
+        self.μ_edge = np.zeros(len(self.edge), dtype=self.dtype)
+        self.offset = np.zeros(self.shape[1], dtype=self.dtype)
+        self.offset_3d = self.offset.reshape(nout,xsize//2,2)
+        if sirs.w is not None:
+            self.refrows = np.zeros((nout,2*sirs.RB*xsize), dtype=self.dtype) # As in RowsSol
+            self.refrows_4d = self.refrows.reshape(nout,2*sirs.RB,xsize).transpose(1,0,2)
+            self.μ_w = np.zeros(nout, dtype=self.dtype)
+            self.offset_w = self.offset.reshape(nout,xsize)
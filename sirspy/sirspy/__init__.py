@@ -1,3 +1,17 @@
 # Module imports
 from .SIRS import SIRS
-from .Legendre import Legendre
\ No newline at end of file
+from .Legendre import Legendre
+from .IncompleteFT import IncompleteFT
+from .Shared import SharedArray
+from .Weights import write_weights, compact_weights
+from .Registry import Registry
+from .Workspace import Workspace
+from .RefRepair import RefRepair, read_mask
+from .FFT import get_backend
+from .Profiler import Profiler
+from .Stream import RampReader, RampWriter, iter_corrected, fit_corrected, correct_file, adapt_convert
+from .SIRSCore import SIRSCore
+from .RowsSol import RowsSol, rowssol
+from .Batch import correct_files
+from .Synthetic import synthetic_frames, synthetic_ramp, synthetic_weights
+from .Benchmark import benchmark, compare_benchmarks, read_benchmarks
@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+import sirspy
+
+KIND = 'h1rg' # The smallest detector, 1024 x 1024 with 16 outputs
+
+
+@pytest.fixture(scope='session')
+def weights(tmp_path_factory):
+    """
+    Compact synthetic weights file
+    """
+    file = str(tmp_path_factory.mktemp('weights') / 'synthetic.h5')
+    sirspy.synthetic_weights(file, KIND, seed=1)
+    return(file)
+
+
+@pytest.fixture(scope='session')
+def ramp():
+    """
+    Short synthetic dark matching weights. Do not modify it.
+    """
+    D = sirspy.synthetic_ramp(4, KIND, seed=2, dtype=np.float64)
+    D.flags.writeable = False
+    return(D)
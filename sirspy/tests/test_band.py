@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+import sirspy
+
+F_MAX = 20000. # Hz
+
+
+def paths(sirs, ramp):
+    # Correct ramp frame by frame, in batch mode and with refcor_frame()
+    frame, batch, D = ramp.copy(), ramp.copy(), ramp.copy()
+    sirs.refcor(frame)
+    sirs.refcor(batch, batch=True)
+    ws = sirs.workspace()
+    for z in np.arange(D.shape[0]):
+        sirs.refcor_frame(D[z], ws)
+    np.testing.assert_allclose(batch, frame, rtol=0, atol=1e-9)
+    np.testing.assert_allclose(D, frame, rtol=0, atol=1e-9)
+    return(frame)
+
+
+@pytest.mark.parametrize('engine', ['dense', 'fft'])
+def test_restrict(weights, ramp, engine):
+    # A band limited object corrects like zeroing α and β outside the band,
+    # on every path, with an f_max or a mask
+    full = sirspy.SIRS(weights, engine=engine)
+    fmask = np.random.default_rng(0).random(len(full.freq)) < 0.5
+    for kwargs, keep in (({'f_max':F_MAX}, full.freq <= F_MAX), ({'fmask':fmask}, fmask)):
+        sirs = sirspy.SIRS(weights, engine=engine, **kwargs)
+        assert len(sirs.freq) == np.sum(keep)
+        zeroed = sirspy.SIRS(weights, engine=engine)
+        zeroed.α[:,~keep], zeroed.β[:,~keep] = 0, 0
+        expected = ramp.copy()
+        zeroed.refcor(expected)
+        np.testing.assert_allclose(paths(sirs, ramp), expected, rtol=0, atol=1e-9)
+
+
+@pytest.mark.parametrize('engine', ['dense', 'fft'])
+def test_restrict_all(weights, ramp, engine):
+    # Keeping every frequency changes nothing
+    full = sirspy.SIRS(weights, engine=engine)
+    sirs = sirspy.SIRS(weights, engine=engine, fmask=np.ones(len(full.freq), dtype=bool))
+    np.testing.assert_array_equal(paths(sirs, ramp), paths(full, ramp))
+
+
+def test_band_tradeoff(weights, ramp):
+    sirs = sirspy.SIRS(weights)
+    win, nfreq = sirs.window(0, 512), len(sirs.freq)
+    results = sirs.band_tradeoff(ramp, [F_MAX])
+    assert [r['f_max'] for r in results] == [None, F_MAX]
+    assert (results[0]['rms'], results[0]['max']) == (0.0, 0.0)
+    assert results[1]['nfreq'] == np.sum(sirs.freq <= F_MAX)
+    band = sirspy.SIRS(weights, f_max=F_MAX)
+    D = ramp.copy()
+    band.refcor(D)
+    assert results[1]['noise'] == pytest.approx(np.std(band._cds(D)), rel=1e-9)
+    assert len(sirs.freq) == sirs.α.shape[1] == nfreq # The copies did not change this object
+    assert sirs.window(0, 512) is win
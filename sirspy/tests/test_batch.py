@@ -0,0 +1,34 @@
+import os
+import multiprocessing
+import h5py
+import pytest
+import sirspy
+
+
+def test_correct_files_failure(tmp_path, weights, ramp):
+    # A bad input is reported, and the others are still corrected
+    good, bad = str(tmp_path / 'good.h5'), str(tmp_path / 'bad.h5')
+    with h5py.File(good, 'w') as f:
+        f['data'] = ramp[:2]
+    with open(bad, 'w') as f:
+        f.write('not a ramp')
+    odir = str(tmp_path / 'out')
+    results = sirspy.correct_files(weights, [bad, good], odir, workers=1, verbose=False)
+    errors = {r['file']:r['error'] for r in results}
+    assert errors[good] is None
+    assert errors[bad] is not None
+    assert sorted(os.listdir(odir)) == ['good.sirs.h5']
+
+
+def test_correct_files_pool_error(tmp_path, weights, ramp, monkeypatch):
+    # An error starting the pool is raised as is
+    def pool(*args, **kwargs):
+        raise OSError('no processes')
+    monkeypatch.setattr(multiprocessing, 'Pool', pool)
+    files = []
+    for name in ('a.h5', 'b.h5'):
+        files.append(str(tmp_path / name))
+        with h5py.File(files[-1], 'w') as f:
+            f['data'] = ramp[:2]
+    with pytest.raises(OSError, match='no processes'):
+        sirspy.correct_files(weights, files, str(tmp_path / 'out'), workers=2, verbose=False)
@@ -0,0 +1,11 @@
+import sirspy
+
+
+def test_init_cases(tmp_path):
+    # init loads the compact weights with the default engine, and init_dense
+    # loads the dense operator of a version 1 file
+    results = sirspy.benchmark(kinds=('h1rg',), nframes=(2,), repeat=1, cases=('init', 'init_dense'),
+                               workdir=str(tmp_path))
+    assert [(r['case'], r['engine']) for r in results] == [('init', 'fft'), ('init_dense', 'dense')]
+    assert results[1]['peak_alloc'] > results[0]['peak_alloc']
+    assert results[0]['noise_sirs'] < results[0]['noise_raw']
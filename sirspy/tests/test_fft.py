@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+import sirspy
+from sirspy.FFT import NumpyFFT, FFTWBackend
+
+
+@pytest.fixture
+def fftw():
+    pytest.importorskip('pyfftw')
+    return(FFTWBackend(effort='FFTW_ESTIMATE', batch=4, max_plans=3))
+
+
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+@pytest.mark.parametrize('shape, axis', [((30,), -1), ((11,30), -1), ((3,30,5), 1), ((2,30,4), -2)])
+def test_fftw_matches_numpy(fftw, dtype, shape, axis):
+    # Batches longer than a plan are done in chunks
+    rng = np.random.default_rng(1)
+    a = rng.standard_normal(shape).astype(dtype)
+    c = (a + 1j*rng.standard_normal(shape)).astype(np.result_type(dtype, np.complex64))
+    rtol = 1e-5 if dtype == np.float32 else 1e-12
+    ref = NumpyFFT()
+    for kind, x in (('fft', c), ('rfft', a), ('irfft', c)):
+        expected = getattr(ref, kind)(x, axis=axis)
+        result = getattr(fftw, kind)(x, axis=axis)
+        assert result.dtype == expected.dtype
+        np.testing.assert_allclose(result, expected, rtol=rtol, atol=rtol*np.abs(expected).max())
+
+
+def test_fftw_out(fftw):
+    # out can be a view that does not flatten into rows
+    a = np.random.default_rng(2).standard_normal((6,16))
+    out = np.zeros((12,16), dtype=np.complex128)[::2].T
+    result = fftw.fft(a.T.astype(np.complex128), axis=0, out=out)
+    assert result is out
+    np.testing.assert_allclose(out, np.fft.fft(a.T, axis=0), atol=1e-12)
+
+
+def test_fftw_plan_cache(fftw):
+    # Plans are bounded in size and number
+    for n in (8, 16, 32, 64, 128):
+        fftw.irfft(np.ones((10,n//2+1), dtype=np.complex64), n=n)
+    plans = fftw._plans()
+    assert len(plans) <= fftw.max_plans
+    assert all(plan.input_array.shape[0] <= fftw.batch for plan in plans.values())
+
+
+def test_fftw_refcor(fftw, weights, ramp):
+    sirs = sirspy.SIRS(weights)
+    sirs_fftw = sirspy.SIRS(weights, fft_backend=FFTWBackend(effort='FFTW_ESTIMATE'))
+    D, D_fftw = ramp.copy(), ramp.copy()
+    sirs.refcor(D, batch=True)
+    sirs_fftw.refcor(D_fftw, batch=True)
+    np.testing.assert_allclose(D_fftw, D, rtol=0, atol=1e-3) # irfft is single precision
+
+
+def test_scipy_workspace(weights):
+    # scipy.fft cannot transform into out=, so refcor_frame() would allocate
+    sirs = sirspy.SIRS(weights, fft_backend='scipy')
+    with pytest.warns(UserWarning, match='out='):
+        sirs.workspace()
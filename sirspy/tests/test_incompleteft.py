@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+import sirspy
+from sirspy.IncompleteFT import IncompleteFT
+
+
+def dense_pinv(ift):
+    # Moore-Penrose inverse of the incomplete Fourier basis, as SIRSCore.jl builds it
+    row = np.arange(ift.ysize)[:,np.newaxis]*(ift.xsize+ift.nroh)
+    t = (row + np.arange(ift.rb)[np.newaxis,:]).ravel() # Time step of each reference pixel
+    B = np.exp(2j*np.pi*np.outer(t, ift.k)/ift.nstep)/ift.nstep
+    return(np.linalg.pinv(B))
+
+
+@pytest.mark.parametrize('ysize, xsize, nroh, rb', [(16, 8, 3, 4), (15, 10, 12, 4), (32, 64, 12, 4), (8, 6, 0, 2)])
+def test_matches_dense_pinv(ysize, xsize, nroh, rb):
+    ift = IncompleteFT(ysize, xsize, nroh, rb=rb)
+    P = dense_pinv(ift)
+    d = np.random.default_rng(0).standard_normal((3,ysize*rb))
+    expected = np.matmul(d, P.T)
+    np.testing.assert_allclose(ift.matrix(), P, rtol=0, atol=1e-10*np.abs(P).max())
+    np.testing.assert_allclose(ift.transform(d), expected, rtol=0, atol=1e-10*np.abs(expected).max())
+
+
+def test_transform_batch_and_subset():
+    ift = IncompleteFT(32, 16, 12)
+    d = np.random.default_rng(1).standard_normal((2,3,32*4))
+    full = ift.transform(d)
+    np.testing.assert_allclose(full[1,2], ift.transform(d[1,2]), rtol=1e-13, atol=0)
+    sel = np.array([0, 3, 5, 20])
+    np.testing.assert_allclose(ift.subset(sel).transform(d), full[...,sel], rtol=1e-13, atol=0)
+
+
+def test_engines_agree(weights, ramp):
+    # The structured and dense engines give the same correction
+    D_fft, D_dense = ramp.copy(), ramp.copy()
+    sirspy.SIRS(weights, engine='fft').refcor(D_fft)
+    sirspy.SIRS(weights, engine='dense').refcor(D_dense)
+    np.testing.assert_allclose(D_fft, D_dense, rtol=0, atol=1e-6)
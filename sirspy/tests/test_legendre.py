@@ -0,0 +1,23 @@
+import numpy as np
+import sirspy
+
+
+def test_tiled_fits(ramp):
+    # Tiles and threads do not change the fit, model or residual
+    leg = sirspy.Legendre(ramp.shape[0], 1)
+    λ = np.tensordot(leg.pinvB, ramp, axes=1)
+    for kwargs in ({}, {'tile':1000}, {'tile':1000, 'workers':3}):
+        np.testing.assert_allclose(leg.legfit(ramp, **kwargs), λ, rtol=1e-12, atol=1e-9)
+        np.testing.assert_allclose(leg.legval(λ, **kwargs), np.tensordot(leg.B, λ, axes=1), rtol=1e-12)
+    D = ramp.copy()
+    leg.residual(D, out=D, tile=1000)
+    np.testing.assert_allclose(D, ramp - np.tensordot(leg.B, λ, axes=1), rtol=0, atol=1e-9)
+
+
+def test_fit_corrected(weights, ramp):
+    # The fused fit equals fitting the corrected datacube
+    sirs = sirspy.SIRS(weights)
+    D = ramp.copy()
+    sirs.refcor(D)
+    expected = sirspy.Legendre(D.shape[0], 1).legfit(D)
+    np.testing.assert_allclose(sirspy.fit_corrected(sirs, ramp, 1), expected, rtol=0, atol=1e-9)
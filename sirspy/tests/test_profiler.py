@@ -0,0 +1,55 @@
+import contextlib
+import threading
+import sirspy
+from sirspy.Profiler import call, stage
+
+
+def test_stages(weights, ramp):
+    # Stages are timed within their call
+    sirs = sirspy.SIRS(weights)
+    p = sirs.set_profiler(sirspy.Profiler())
+    sirs.refcor(ramp.copy())
+    report = p.last
+    assert report['call'] == 'refcor'
+    assert set(report['stages']) == {'incomplete_ft', 'spectrum', 'irfft', 'subtract', 'dc'}
+    assert report['stages']['spectrum']['calls'] == ramp.shape[0]*sirs.nout
+    assert sum([s['seconds'] for s in report['stages'].values()]) <= report['seconds']
+    assert p.totals['refcor']['calls'] == 1
+
+
+def test_workers(weights, ramp):
+    # Stages run by worker threads are added to the call that started them
+    sirs = sirspy.SIRS(weights)
+    p = sirs.set_profiler(sirspy.Profiler())
+    sirs.refcor(ramp.copy(), workers=4)
+    assert p.last['stages']['spectrum']['calls'] == ramp.shape[0]*sirs.nout
+    leg = sirspy.Legendre(ramp.shape[0], 1, profiler=p)
+    leg.legfit(ramp, tile=1000, workers=3)
+    assert p.last['stages']['matmul']['calls'] == ramp.shape[1] # One row per tile
+
+
+def test_threads():
+    # Calls made at the same time from different threads get separate reports
+    reports = []
+    p = sirspy.Profiler(callback=reports.append)
+    barrier = threading.Barrier(2)
+    def run(name, n):
+        with p.call(name):
+            barrier.wait()
+            for i in range(n):
+                with p.stage(name):
+                    pass
+            barrier.wait()
+    threads = [threading.Thread(target=run, args=(name, n)) for name, n in (('a', 1), ('b', 2))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted([(r['call'], list(r['stages']), r['stages'][r['call']]['calls']) for r in reports]) ==\
+           [('a', ['a'], 1), ('b', ['b'], 2)]
+
+
+def test_disabled():
+    # Without a profiler, calls and stages are a shared do-nothing context
+    assert isinstance(call(None, 'refcor'), contextlib.nullcontext)
+    assert stage(None, 'dc') is call(None, 'refcor')
@@ -0,0 +1,77 @@
+import copy
+import numpy as np
+import pytest
+import sirspy
+
+
+@pytest.fixture(scope='module', params=['dense', 'fft'])
+def sirs(request, weights):
+    return(sirspy.SIRS(weights, engine=request.param))
+
+
+def refcor(sirs, D, **kwargs):
+    D = D.copy()
+    sirs.refcor(D, **kwargs)
+    return(D)
+
+
+def test_batch(sirs, ramp):
+    # Batch mode agrees with frame by frame to within rounding, however it is split
+    frame = refcor(sirs, ramp)
+    for kwargs in ({'batch':True}, {'batch':True, 'max_frames':3}, {'batch':True, 'workers':2}):
+        np.testing.assert_allclose(refcor(sirs, ramp, **kwargs), frame, rtol=0, atol=1e-9)
+
+
+def test_workers(sirs, ramp):
+    # Frame by frame and rows only, threads do not change the result
+    for rowsonly in (False, True):
+        np.testing.assert_array_equal(refcor(sirs, ramp, rowsonly=rowsonly, workers=3),
+                                      refcor(sirs, ramp, rowsonly=rowsonly))
+
+
+@pytest.mark.parametrize('rowsonly', [False, True])
+def test_refcor_frame(sirs, ramp, rowsonly):
+    # refcor_frame() gives the same result as refcor()
+    expected = refcor(sirs, ramp, rowsonly=rowsonly)
+    D = ramp.copy()
+    ws = sirs.workspace()
+    for z in np.arange(D.shape[0]):
+        sirs.refcor_frame(D[z], ws, rowsonly=rowsonly)
+    np.testing.assert_array_equal(D, expected)
+
+
+def test_refcor_frame_float32(weights, ramp):
+    sirs = sirspy.SIRS(weights, precision='float32')
+    D = ramp.astype(np.float32)
+    expected = refcor(sirs, D)
+    ws = sirs.workspace()
+    for z in np.arange(D.shape[0]):
+        sirs.refcor_frame(D[z], ws)
+    np.testing.assert_array_equal(D, expected)
+    with pytest.raises(ValueError):
+        sirs.refcor(ramp.copy())
+
+
+def dc_reference(sirs, D):
+    # The original output by output, sort based DC and ACN correction
+    D = D.copy()
+    y0, y1, d = sirs.rowslim[0], sirs.rowslim[1]+1, sirs.discard
+    mean = lambda a, d: np.mean(np.sort(a.flatten())[d:a.size-d])
+    for z in np.arange(D.shape[0]):
+        for op in np.arange(sirs.nout):
+            x0, x1 = op*sirs.xsize, (op+1)*sirs.xsize
+            if (op == 0) or (op == sirs.nout-1):
+                D[z,:,x0:x1] -= mean(D[z,y0:y1,x0:x1], d)
+            else:
+                _d = int(np.round(d/2))
+                D[z,:,x0:x1:2] -= mean(D[z,y0:y1,x0:x1:2], _d)
+                D[z,:,x0+1:x1:2] -= mean(D[z,y0:y1,x0+1:x1:2], _d)
+    return(D)
+
+
+@pytest.mark.parametrize('discard', [None, 6])
+def test_dc(weights, ramp, discard):
+    sirs = copy.copy(sirspy.SIRS(weights))
+    if discard is not None:
+        sirs.discard = discard # H1RGs discard nothing by default
+    np.testing.assert_allclose(refcor(sirs, ramp, rowsonly=True), dc_reference(sirs, ramp), rtol=0, atol=1e-9)
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from scipy import interpolate
+import sirspy
+from sirspy.RefRepair import PPL_BAD_ROWS, _sg_repair
+
+RB = 4
+
+
+def pplfix1(D):
+    # The original pplfix1 loop of SIRS.refcor()
+    x = np.arange(4096)
+    px = (x<1870) | (x>2224)
+    for z in np.arange(D.shape[0]):
+        r = D[z,:,-RB:]
+        for col in np.arange(4):
+            spl = interpolate.interp1d(x[px], r[px,col], kind='linear')
+            r[np.logical_not(px),col] = spl(x[np.logical_not(px)])
+
+
+def test_ppl_mask():
+    # The PPL detector's bad pixels are rows 1870-2224 of the right columns
+    repair = sirspy.RefRepair.ppl((4096,16))
+    assert repair.nbad == (PPL_BAD_ROWS[1]-PPL_BAD_ROWS[0])*RB
+    assert set(repair.x) == set(range(16-RB, 16))
+    assert (repair.y.min(), repair.y.max()) == (1870, 2224)
+    with pytest.raises(ValueError):
+        sirspy.RefRepair.ppl((2048,16))
+
+
+def test_ppl_repair():
+    # pplfix1 gives what the original loop did
+    D = np.random.default_rng(0).normal(size=(2,4096,16))
+    expected = D.copy()
+    pplfix1(expected)
+    sirspy.RefRepair.ppl(D.shape[1:]).repair(D)
+    np.testing.assert_allclose(D, expected, rtol=1e-12, atol=1e-12)
+
+
+def test_mask_repair():
+    # Bad pixels are interpolated along their columns, and pixels beyond the
+    # last good one take its value
+    rng = np.random.default_rng(1)
+    D = rng.normal(size=(3,64,16))
+    mask = rng.random(D.shape[1:]) < 0.2
+    mask[:3,0] = True
+    mask[-2:,-1] = True
+    expected = D.copy()
+    for j in list(range(RB)) + list(range(16-RB, 16)):
+        good = ~mask[:,j]
+        for z in range(D.shape[0]):
+            expected[z,~good,j] = np.interp(np.flatnonzero(~good), np.flatnonzero(good), D[z,good,j])
+    sirspy.RefRepair(D.shape[1:], mask=mask).repair(D[:,:,:]) # Regular pixels are not used
+    np.testing.assert_allclose(D, expected, rtol=1e-12, atol=1e-12)
+
+
+def test_sg_repair():
+    # A transient is removed from both reference column streams, each in
+    # readout order. The right columns are read out in reverse.
+    nz, ny, nx = 2, 64, 16
+    t = np.arange(ny*RB)
+    signal = np.sin(t/7.) + np.random.default_rng(2).normal(scale=0.01, size=(nz,ny*RB))
+    signal[:,100] += 50.
+    D = np.zeros((nz,ny,nx))
+    D[:,:,:RB] = signal.reshape(nz,ny,RB)
+    D[:,:,:-RB-1:-1] = signal.reshape(nz,ny,RB)
+    sirspy.RefRepair(D.shape[1:], sg=True).repair(D)
+    left = D[:,:,:RB].reshape(nz,-1)
+    right = D[:,:,:-RB-1:-1].reshape(nz,-1)
+    np.testing.assert_array_equal(left, right)
+    expected = signal.copy()
+    _sg_repair(expected)
+    np.testing.assert_array_equal(left, expected)
+    assert np.all(np.abs(left[:,100]-np.sin(100/7.)) < 25.)
@@ -0,0 +1,50 @@
+import numpy as np
+import sirspy
+
+
+def test_shared_operator(weights):
+    # Detectors with the same readout geometry share one operator, and
+    # nbytes() counts it once
+    reg = sirspy.Registry({'SCA01':weights, 'SCA02':weights}, engine='dense')
+    a, b = reg['SCA01'], reg['SCA02']
+    assert a is not b
+    assert a.incft is b.incft
+    assert reg.stats()['operators'] == 1
+    private = a._nbytes()[0] + b._nbytes()[0]
+    assert reg.nbytes() == private + a.incft.nbytes
+    assert reg['SCA01'] is a
+    assert (reg.hits, reg.misses) == (1, 2)
+
+
+def test_evict(weights):
+    # An evicted detector is reloaded by get(), and an operator is dropped
+    # with the last detector using it
+    reg = sirspy.Registry({'SCA01':weights, 'SCA02':weights})
+    a = reg['SCA01']
+    reg['SCA02']
+    reg.evict('SCA01')
+    assert 'SCA01' not in reg
+    assert reg.stats()['operators'] == 1
+    reg.evict('SCA02')
+    assert (len(reg), reg.stats()['operators'], reg.nbytes()) == (0, 0, 0)
+    b = reg['SCA01']
+    assert b is not a
+    np.testing.assert_array_equal(b.α, a.α)
+    assert (reg.misses, reg.evictions) == (3, 2)
+
+
+def test_budget(weights):
+    # Over budget, the least recently used detectors are evicted first
+    reg = sirspy.Registry({key:weights for key in ('SCA01','SCA02','SCA03')})
+    reg['SCA01']
+    one = reg.nbytes()
+    reg['SCA02']
+    two = reg.nbytes()
+    reg.memory_budget = two
+    reg['SCA01'] # Now SCA02 is the least recently used
+    reg['SCA03']
+    assert reg.stats()['loaded'] == ['SCA01', 'SCA03']
+    assert reg.evictions == 1
+    reg.memory_budget = one - 1
+    reg['SCA02']
+    assert reg.stats()['loaded'] == ['SCA02'] # The newest is never evicted
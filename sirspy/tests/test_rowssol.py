@@ -0,0 +1,33 @@
+import numpy as np
+import sirspy
+from sirspy.SIRS import _refrows
+
+
+def test_solve_matches_pinv():
+    # The normal equation sums give the same weights as pinv(R)·μ
+    rng = np.random.default_rng(0)
+    rs = sirspy.RowsSol(32, 16, 2)
+    R = rng.normal(size=(300,2,2*rs.rb*rs.xsize))
+    μ = rng.normal(size=(300,2))
+    rs._add(R[:100], μ[:100])
+    other = sirspy.RowsSol(32, 16, 2)
+    other._add(R[100:], μ[100:])
+    rs.merge(other)
+    w = rs.solve()
+    assert rs.nframes == 300
+    for op in range(2):
+        np.testing.assert_allclose(w[op], np.matmul(np.linalg.pinv(R[:,op]), μ[:,op]), rtol=1e-9, atol=1e-12)
+
+
+def test_row_weights(tmp_path, weights, ramp):
+    # rowssol() writes weights that SIRS uses for the DC correction
+    file = str(tmp_path / 'w.h5')
+    with open(weights, 'rb') as f, open(file, 'wb') as g:
+        g.write(f.read())
+    w = sirspy.rowssol([ramp], file, verbose=False)
+    sirs = sirspy.SIRS(file)
+    np.testing.assert_allclose(sirs.w, w)
+    D = ramp.copy()
+    sirs.refcor(D, rowsonly=True)
+    μ = np.einsum('zok,ok->zo', _refrows(ramp, sirs.RB, sirs.nout, sirs.xsize), w)
+    np.testing.assert_allclose(D, ramp - np.repeat(μ, sirs.xsize, axis=1)[:,np.newaxis,:], rtol=0, atol=1e-9)
@@ -0,0 +1,67 @@
+import h5py
+import numpy as np
+import pytest
+import sirspy
+from sirspy.Benchmark import _check_noise
+
+KIND, NOUT, NROH, TAU = 'h2rg', 4, 12, 5.e-6 # SIRSCore, like SIRS.jl, takes H2RGs and H4RGs
+
+
+def dark(nframes, seed):
+    return(sirspy.synthetic_ramp(nframes, KIND, NOUT, NROH, seed=seed, dtype=np.float64))
+
+
+@pytest.fixture(scope='module')
+def core():
+    sc = sirspy.SIRSCore(KIND, NOUT, NROH, TAU)
+    sc.coadd(dark(6, 10))
+    sc.solve()
+    return(sc)
+
+
+def test_normal_equations(core):
+    # α and β minimize Σ |𝓷 - α𝓵 - β𝓻|², as solve!() does in Julia
+    α, β = core.α[:,1:], core.β[:,1:]
+    L, R, X, Y, Z = (a[:,1:] for a in (core.𝕃, core.ℝ, core.𝕏, core.𝕐, core.ℤ))
+    np.testing.assert_allclose(α*L + β*Z, Y, rtol=1e-8, atol=0)
+    np.testing.assert_allclose(α*np.conj(Z) + β*R, X, rtol=1e-8, atol=0)
+    assert np.all(core.N0 == 6)
+
+
+def test_export(tmp_path, core):
+    # export() writes a version 1 file by default, as export_to_sirspy.jl does,
+    # and SIRS reads back α and β
+    file = str(tmp_path / 'sc.h5')
+    core.export(file)
+    with h5py.File(file, 'r') as f:
+        assert 'incft' in f['SIRSCore']
+    sirs = sirspy.SIRS(file)
+    np.testing.assert_array_equal(sirs.α[:,1:], core.α[:,1:])
+    np.testing.assert_array_equal(sirs.β[:,1:], core.β[:,1:])
+    np.testing.assert_array_equal(sirs.freq, core.freq)
+
+    # The weights reduce the noise of another dark
+    raw, corrected = _check_noise(sirs, dark(4, 2))
+    assert corrected < .98*raw
+
+
+def test_coadd_merge_save(tmp_path):
+    # The sums do not depend on how frames are grouped, and merging or saving
+    # and restoring partial sums gives the same sums as coadding in one object
+    D = dark(3, 11)
+    one, grouped = sirspy.SIRSCore(KIND, NOUT, NROH, TAU), sirspy.SIRSCore(KIND, NOUT, NROH, TAU)
+    one.coadd(D.copy(), max_frames=1)
+    grouped.coadd(D.copy(), max_frames=3)
+    for name, a in one._sums().items():
+        np.testing.assert_allclose(grouped._sums()[name], a, rtol=1e-10, atol=0)
+
+    file = str(tmp_path / 'sums.h5')
+    one.save(file)
+    restored = sirspy.SIRSCore.restore(file)
+    for name, a in one._sums().items():
+        np.testing.assert_array_equal(restored._sums()[name], a)
+    restored.merge(grouped)
+    for name, a in one._sums().items():
+        np.testing.assert_allclose(restored._sums()[name], 2*a, rtol=1e-10, atol=0)
+    with pytest.raises(ValueError):
+        restored.merge(sirspy.SIRSCore(KIND, 2*NOUT, NROH, TAU))
@@ -0,0 +1,94 @@
+import os
+import h5py
+import numpy as np
+import pytest
+from astropy.io import fits
+import sirspy
+
+
+@pytest.fixture(scope='module')
+def sirs(weights):
+    return(sirspy.SIRS(weights))
+
+
+def corrected(sirs, D):
+    # In memory refcor() of a copy of D
+    D = np.array(D, dtype=np.float64)
+    sirs.refcor(D)
+    return(D)
+
+
+def test_fits(tmp_path, sirs, ramp):
+    # FITS in, FITS out, with the header carried over
+    in_file, out_file = str(tmp_path / 'in.fits'), str(tmp_path / 'out.fits')
+    header = fits.Header([('OBSERVER', 'sirspy')])
+    fits.PrimaryHDU(ramp, header=header).writeto(in_file)
+    result = sirspy.correct_file(sirs, in_file, out_file)
+    assert result['frames'] == ramp.shape[0]
+    with fits.open(out_file) as hdul:
+        assert hdul[0].header['OBSERVER'] == 'sirspy'
+        assert hdul[0].header['REFCOR'] == True
+        assert hdul[0].data.dtype == np.dtype('>f4')
+        np.testing.assert_allclose(hdul[0].data, corrected(sirs, ramp), rtol=0, atol=1e-3)
+
+
+@pytest.mark.parametrize('overlap', [False, True])
+def test_hdf5(tmp_path, sirs, ramp, overlap):
+    # HDF5 in, HDF5 out, with or without background reading and writing
+    in_file, out_file = str(tmp_path / 'in.h5'), str(tmp_path / 'out.h5')
+    with h5py.File(in_file, 'w') as f:
+        f['ramp'] = ramp[np.newaxis]
+        f['ramp'].attrs['OBSERVER'] = 'sirspy'
+    sirspy.correct_file(sirs, in_file, out_file, dtype=np.float64, overlap=overlap)
+    with h5py.File(out_file, 'r') as f:
+        assert f['ramp'].attrs['OBSERVER'] == 'sirspy'
+        assert f['ramp'].attrs['REFCOR'] == True
+        np.testing.assert_allclose(f['ramp'][...], corrected(sirs, ramp), rtol=0, atol=1e-9)
+
+
+def uint16_fits(file, ramp):
+    # Write a ramp as FITS uint16, which is stored with BZERO = 32768
+    D = np.rint(ramp).astype(np.uint16)
+    D[:,500,500] = 2**16-1 # Clips to 0 after adapt_convert()
+    fits.PrimaryHDU(D, header=fits.Header([('OBSERVER', 'sirspy')])).writeto(file)
+    with fits.open(file, do_not_scale_image_data=True) as hdul:
+        assert hdul[0].header['BZERO'] == 32768
+    return(D)
+
+
+def test_uint16(tmp_path, sirs, ramp):
+    # uint16 input is read through its BZERO scaling
+    in_file, out_file = str(tmp_path / 'in.fits'), str(tmp_path / 'out.h5')
+    D = uint16_fits(in_file, ramp)
+    with sirspy.RampReader(in_file) as reader:
+        np.testing.assert_array_equal(reader.read(1), D[1])
+    sirspy.correct_file(sirs, in_file, out_file, dtype=np.float64)
+    with h5py.File(out_file, 'r') as f:
+        np.testing.assert_allclose(f['data'][...], corrected(sirs, D), rtol=0, atol=1e-9)
+
+
+def test_adapt(tmp_path, sirs, ramp):
+    # adapt=True negates, corrects, rounds, adds BZERO, clips and writes uint16
+    in_file, out_file = str(tmp_path / 'in.fits'), str(tmp_path / 'out.fits')
+    D = uint16_fits(in_file, ramp)
+    sirspy.correct_file(sirs, in_file, out_file, adapt=True, overlap=True)
+    c = corrected(sirs, -D.astype(np.float64))
+    expected = np.clip(np.rint(c)+4096, 0, 2**16-1)
+    with fits.open(out_file) as hdul:
+        header, out = hdul[0].header, hdul[0].data
+        assert out.dtype == np.uint16
+        assert header['OBSERVER'] == 'sirspy'
+        assert header['SIRSBIAS'] == 4096
+        assert np.all(out[:,500,500] == 0)
+        tie = np.abs(np.abs(c-np.floor(c))-0.5) < 1e-6 # Rounding may go either way
+        assert np.all((out == expected) | tie)
+
+
+def test_cleanup(tmp_path, sirs):
+    # A failed correction leaves neither an output nor a temporary file
+    in_file, out_file = str(tmp_path / 'in.h5'), str(tmp_path / 'out.h5')
+    with h5py.File(in_file, 'w') as f:
+        f['data'] = np.zeros((2,64,64))
+    with pytest.raises(ValueError):
+        sirspy.correct_file(sirs, in_file, out_file)
+    assert os.listdir(str(tmp_path)) == ['in.h5']
@@ -0,0 +1,21 @@
+import numpy as np
+import pytest
+import sirspy
+from sirspy.Synthetic import _pool
+from sirspy.Benchmark import _check_noise
+
+
+def test_pool():
+    kidx = np.array([0, 1, 2, 3, 10, 11, 12])
+    a = np.arange(7.)
+    np.testing.assert_array_equal(_pool(a, kidx, 1), a)
+    np.testing.assert_array_equal(_pool(a, kidx, 3), [1, 3, 6, 5, 9, 15, 11])
+
+
+@pytest.mark.parametrize('nframes', [2, 8])
+def test_weights_reduce_noise(tmp_path, ramp, nframes):
+    # Even weights fit from a few frames must not over-fit
+    file = str(tmp_path / 'w.h5')
+    sirspy.synthetic_weights(file, 'h1rg', nframes=nframes, seed=3)
+    raw, corrected = _check_noise(sirspy.SIRS(file), ramp)
+    assert corrected < .97*raw
@@ -0,0 +1,76 @@
+import pickle
+import h5py
+import numpy as np
+import pytest
+import sirspy
+from sirspy.IncompleteFT import sirs_freq_index
+from sirspy.Weights import write_weights, compact_weights
+
+
+@pytest.fixture(scope='module')
+def v1(tmp_path_factory):
+    """
+    Version 1 weights file, with incft and reference row weights
+    """
+    file = str(tmp_path_factory.mktemp('v1') / 'v1.h5')
+    sirspy.synthetic_weights(file, 'h1rg', seed=1, compact=False)
+    with h5py.File(file, 'r+') as f:
+        g = f['SIRSCore']
+        w = np.random.default_rng(0).normal(size=(int(np.int64(g['nout'])), 2*4*int(np.int64(g['xsize']))))
+        g['w'] = np.ascontiguousarray(w.T)/w.size
+    return(file)
+
+
+def test_compact_round_trip(tmp_path, v1):
+    # Compacting keeps everything except incft, which is regenerated on load
+    v2 = str(tmp_path / 'v2.h5')
+    compact_weights(v1, v2, verify=True)
+    with h5py.File(v1, 'r') as f1, h5py.File(v2, 'r') as f2:
+        g1, g2 = f1['SIRSCore'], f2['SIRSCore']
+        assert 'version' not in g1
+        assert np.int64(g2['version']) == 2
+        assert 'incft' not in g2
+        assert set(g1.keys()) - {'incft'} == set(g2.keys()) - {'version'}
+        for key in g2.keys():
+            if key != 'version':
+                np.testing.assert_array_equal(g2[key][...], g1[key][...])
+    with pytest.raises(ValueError):
+        compact_weights(v2, str(tmp_path / 'again.h5'))
+
+    s1, s2 = sirspy.SIRS(v1), sirspy.SIRS(v2)
+    assert (s1.engine, s1.version, s2.engine, s2.version) == ('dense', 1, 'fft', 2)
+    dense2 = sirspy.SIRS(v2, engine='dense')
+    np.testing.assert_allclose(dense2.incft, s1.incft, rtol=0, atol=1e-12*np.abs(s1.incft).max())
+    np.testing.assert_array_equal(s2.w, s1.w)
+
+
+def test_write_weights_round_trip(tmp_path):
+    # SIRS reads back what write_weights() writes, in the layout of export_to_sirspy.jl
+    rng = np.random.default_rng(2)
+    nout, xsize, ysize, nroh = 4, 8, 16, 3
+    nfreq = len(sirs_freq_index(ysize, (xsize+nroh)*ysize))
+    α, β = (rng.normal(size=(nout,nfreq)) + 1j*rng.normal(size=(nout,nfreq)) for i in range(2))
+    w = rng.normal(size=(nout,2*4*xsize))
+    file = str(tmp_path / 'w.h5')
+    write_weights(file, nout*xsize, ysize, nout, nroh, xsize, ysize, np.arange(nfreq), α, β, w=w)
+    sirs = sirspy.SIRS(file)
+    np.testing.assert_array_equal(sirs.α[:,1:], α[:,1:])
+    np.testing.assert_array_equal(sirs.β[:,1:], β[:,1:])
+    assert np.all(sirs.α[:,0] == 0) and np.all(sirs.β[:,0] == 0)
+    np.testing.assert_array_equal(sirs.w, w)
+    assert sirspy.SIRS(file, row_weights=False).w is None
+
+
+@pytest.mark.parametrize('load', ['mmap', 'shm'])
+def test_load_modes(v1, ramp, load):
+    # Shared loading modes give the same correction, also after pickling
+    expected = ramp.copy()
+    sirspy.SIRS(v1).refcor(expected)
+    sirs = sirspy.SIRS(v1, load=load)
+    try:
+        for s in (sirs, pickle.loads(pickle.dumps(sirs))):
+            D = ramp.copy()
+            s.refcor(D)
+            np.testing.assert_array_equal(D, expected)
+    finally:
+        sirs.close()
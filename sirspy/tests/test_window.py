@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+import sirspy
+
+
+@pytest.fixture(scope='module')
+def sirs(weights):
+    return(sirspy.SIRS(weights))
+
+
+@pytest.mark.parametrize('y0, y1, rowslim', [(0, 1024, (1021, 1022)),   # Full frame
+                                              (2, 1022, (0, 1)),         # Both blocks, partly
+                                              (0, 1022, (0, 3)),         # Both blocks, all bottom rows
+                                              (1, 1024, (1020, 1021)),   # Full frame rows
+                                              (1000, 1022, (20, 21)),    # Top block only
+                                              (100, 200, None)])         # No reference rows
+def test_window_rowslim(sirs, y0, y1, rowslim):
+    # The DC correction rows are one contiguous block of reference rows
+    win = sirs.window(y0, y1)
+    assert win.rowslim == rowslim
+    if rowslim is not None:
+        rows = y0 + np.arange(rowslim[0], rowslim[1]+1)
+        assert np.all(rows < sirs.RB) or np.all(rows >= sirs.naxis2-sirs.RB)
+
+
+def test_window_identity(sirs):
+    assert sirs.window() is sirs
+    assert sirs.window(0, 1024, 16, int(sirs.nroh)) is sirs
+
+
+def test_window_paths(sirs, ramp):
+    # Frame by frame, batch and refcor_frame() agree on a window with both blocks
+    win = sirs.window(2, 1022)
+    D = ramp[:,2:1022].copy()
+    frame, batch = D.copy(), D.copy()
+    win.refcor(frame)
+    win.refcor(batch, batch=True)
+    ws = win.workspace()
+    for z in np.arange(D.shape[0]):
+        win.refcor_frame(D[z], ws)
+    np.testing.assert_allclose(batch, frame, rtol=0, atol=1e-9)
+    np.testing.assert_array_equal(frame, D)
+
+
+@pytest.mark.parametrize('nout', [1, 4])
+def test_window_fewer_outputs_paths(sirs, ramp, nout):
+    # Readouts using fewer outputs are corrected alike by every path
+    win = sirs.window(0, 512, nout=nout)
+    assert (win.nout, win.xsize, win.α.shape[0]) == (nout, 1024//nout, nout)
+    D = ramp[:,:512].copy()
+    frame, batch = D.copy(), D.copy()
+    win.refcor(frame)
+    win.refcor(batch, batch=True)
+    ws = win.workspace()
+    for z in np.arange(D.shape[0]):
+        win.refcor_frame(D[z], ws)
+    np.testing.assert_allclose(batch, frame, rtol=0, atol=1e-9)
+    np.testing.assert_array_equal(frame, D)
+
+
+def test_window_fewer_outputs_noise(sirs):
+    # The derived weights reduce the noise left by the reference row (DC)
+    # correction of a 4 output readout, which native weights also get
+    D = sirspy.synthetic_ramp(8, 'h1rg', nout=4, seed=5, dtype=np.float64)
+    win = sirs.window(nout=4)
+    rows, full = D.copy(), D.copy()
+    win.refcor(rows, rowsonly=True)
+    win.refcor(full)
+    assert np.std(win._cds(full)) < 0.95*np.std(win._cds(rows))
+
+
+def test_window_fewer_outputs_divide(sirs):
+    with pytest.raises(ValueError):
+        sirs.window(0, 64, nout=3)
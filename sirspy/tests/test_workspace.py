@@ -0,0 +1,31 @@
+import tracemalloc
+import numpy as np
+import pytest
+import sirspy
+from sirspy.FFT import FFTWBackend
+
+# Peak bytes refcor_frame() may allocate for an H1RG frame. About 200 kB
+# are NumPy's ufunc buffers, and the fft engine's FFT copies the 128 kB of
+# reference columns. A frame is 8 MB, and one output's time series 300 kB.
+PEAK = 320*1024
+
+
+@pytest.mark.parametrize('backend', ['numpy', 'fftw'])
+@pytest.mark.parametrize('engine', ['dense', 'fft'])
+def test_refcor_frame_allocation(weights, ramp, engine, backend):
+    if backend == 'fftw':
+        pytest.importorskip('pyfftw')
+        backend = FFTWBackend(effort='FFTW_ESTIMATE')
+    sirs = sirspy.SIRS(weights, engine=engine, fft_backend=backend)
+    ws = sirs.workspace()
+    frame = ramp[0].copy()
+    sirs.refcor_frame(frame, ws) # Plans and caches are made here
+    frame[...] = ramp[1]
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        sirs.refcor_frame(frame, ws)
+        peak = tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+    assert peak < PEAK
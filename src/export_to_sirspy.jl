@@ -1,5 +1,5 @@
 """
-    export_to_sirspy(sc, file)
+    export_to_sirspy(sc, file; compact=false)
 
 Export a SIRSCore for use by sirspy, the python-3 backend to SIRS.
 
@@ -8,12 +8,16 @@ Export a SIRSCore for use by sirspy, the python-3 backend to SIRS.
                 file::String
                   The output filename. The file will be written in hdf5
                   format.
+                compact::Bool (optional)
+                  Write a compact (version 2) file. This omits the incomplete
+                  Fourier transform operator, which depends only on the
+                  readout geometry. Sirspy regenerates it on load.
 
     Notes:
       * We do not export the entire SIRSCore. We only export the parameters
         that are used by sirspy.d
 """
-function export_to_sirspy(sc::SIRSCore, file::String)
+function export_to_sirspy(sc::SIRSCore, file::String; compact::Bool=false)
     h5open(file, "w") do file
         g = create_group(file, "SIRSCore") # create a group
         g["naxis1"] = sc.naxis1
@@ -23,7 +27,11 @@ function export_to_sirspy(sc::SIRSCore, file::String)
         g["xsize"] = sc.xsize
         g["ysize"] = sc.ysize
         g["freq"] = sc.𝒇
-        g["incft"] = copy(transpose(sc.SFT.Binv))  # copy(transpose()) converts to row major
+        if compact == false
+            g["incft"] = copy(transpose(sc.SFT.Binv))  # copy(transpose()) converts to row major
+        else
+            g["version"] = 2
+        end
         g["α"] = copy(transpose(sc.α))
         g["β"] = copy(transpose(sc.β))
     end